@@ -0,0 +1,209 @@
+"""
+Mergeable moment accumulators
+可合并的流式累加器：按 组×指标 保存 count、均值与 M2（Welford/Chan 更新），比率指标另存协矩，
+每天只需折叠新一天的数据，多个 worker 的部分结果合并后与单次遍历一致
+"""
+
+import json
+import struct
+from dataclasses import astuple, dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from group_stats import GroupedMetricStats
+from sufficient_stats import MOMENT_KINDS, metric_label, parse_ratio_metric, ratio_delta_variance
+
+# Blob layout: magic, format version, length of the JSON header, JSON header, float64 states
+_MAGIC = b'ABMA'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHI')
+
+
+@dataclass
+class MomentAccumulator:
+    """
+    Running moments of one metric in one group.
+
+    Holds the count, the means and the centered second moments (M2 = Σ(x - x̄)²)
+    plus the co-moment Σ(x - x̄)(y - ȳ) for ratio metrics. Batches are folded in
+    with Chan's parallel update, so the state never stores raw sums of squares and
+    merging partial accumulators in any order gives the single-pass result up to
+    floating-point rounding.
+    """
+    count: float = 0.0
+    mean_x: float = 0.0
+    m2_x: float = 0.0
+    mean_y: float = 0.0
+    m2_y: float = 0.0
+    c_xy: float = 0.0
+
+    @classmethod
+    def from_values(cls, x: np.ndarray, y: Optional[np.ndarray] = None) -> 'MomentAccumulator':
+        """Accumulator of one batch (two-pass moments). Missing values are skipped, pairwise for ratios."""
+        x = np.asarray(x, dtype=np.float64)
+        keep = ~np.isnan(x)
+        if y is not None:
+            y = np.asarray(y, dtype=np.float64)
+            keep &= ~np.isnan(y)
+            y = y[keep]
+        x = x[keep]
+        if not len(x):
+            return cls()
+        dx = x - x.mean()
+        if y is None:
+            return cls(float(len(x)), float(x.mean()), float(dx @ dx))
+        dy = y - y.mean()
+        return cls(float(len(x)), float(x.mean()), float(dx @ dx), float(y.mean()), float(dy @ dy), float(dx @ dy))
+
+    def merge(self, other: 'MomentAccumulator') -> 'MomentAccumulator':
+        """Fold ``other`` into this accumulator (Chan et al.) and return self."""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean_x, self.m2_x, self.mean_y, self.m2_y, self.c_xy = astuple(other)
+            return self
+        count = self.count + other.count
+        weight = self.count * other.count / count
+        delta_x = other.mean_x - self.mean_x
+        delta_y = other.mean_y - self.mean_y
+        self.mean_x += delta_x * other.count / count
+        self.mean_y += delta_y * other.count / count
+        self.m2_x += other.m2_x + delta_x * delta_x * weight
+        self.m2_y += other.m2_y + delta_y * delta_y * weight
+        self.c_xy += other.c_xy + delta_x * delta_y * weight
+        self.count = count
+        return self
+
+    def update(self, x: np.ndarray, y: Optional[np.ndarray] = None) -> 'MomentAccumulator':
+        """Fold a batch of values into this accumulator and return self."""
+        return self.merge(MomentAccumulator.from_values(x, y))
+
+    def estimate(self, metric_type: str) -> Tuple[float, float]:
+        """Point estimate (mean, rate or Σx / Σy) and variance of the estimate."""
+        n, mean_x, mean_y = np.float64(self.count), np.float64(self.mean_x), np.float64(self.mean_y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if metric_type == 'ratio':
+                x_var, y_var, cov = (np.float64(m) / (n - 1) / n for m in (self.m2_x, self.m2_y, self.c_xy))
+                return mean_x / mean_y, ratio_delta_variance(mean_x, mean_y, x_var, y_var, cov)
+            if metric_type == 'proportion':
+                return mean_x, mean_x * (1 - mean_x) / n
+            return mean_x, np.float64(self.m2_x) / (n - 1) / n
+
+
+class ExperimentAccumulator:
+    """
+    MomentAccumulator per (group, metric) for a fixed list of metrics.
+
+    Typical daily use: load yesterday's blob with from_bytes, update() with the new
+    day's rows only, persist to_bytes(), and run the tests on the merged state,
+    e.g. ``analyzer.test_mean(accumulator, None, 'treatment', 'control', 'gmv')``.
+
+    Missing values are skipped (pairwise for ratio metrics) and each group's n is
+    its number of non-missing observations. On complete data the tests equal the
+    row-level tests on the concatenated rows up to floating-point rounding.
+    """
+
+    def __init__(self, metrics: Sequence[Union[str, List[str]]], metric_types: Sequence[str]):
+        """
+        Args:
+            metrics (List): Metrics; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): 'mean', 'proportion' or 'ratio' per metric
+        """
+        if len(metrics) != len(metric_types):
+            raise ValueError("metrics and metric_types must have the same length")
+        for metric_type in metric_types:
+            if metric_type not in MOMENT_KINDS:
+                raise ValueError(f"Unsupported metric type: {metric_type}")
+        self.metrics = list(metrics)
+        self.metric_types = list(metric_types)
+        self.metric_labels = [metric_label(m) for m in self.metrics]
+        self.groups: Dict[object, List[MomentAccumulator]] = {}
+
+    def _group(self, label) -> List[MomentAccumulator]:
+        if label not in self.groups:
+            self.groups[label] = [MomentAccumulator() for _ in self.metrics]
+        return self.groups[label]
+
+    def update(self, data: pd.DataFrame, groupname: str) -> 'ExperimentAccumulator':
+        """Fold a batch of rows (e.g. one day) into the accumulators and return self."""
+        codes, uniques = pd.factorize(data[groupname])
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        columns = {}
+        for metric, metric_type in zip(self.metrics, self.metric_types):
+            names = parse_ratio_metric(metric) if metric_type == 'ratio' else (metric,)
+            for name in names:
+                if name not in columns:
+                    columns[name] = data[name].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+        for g, label in enumerate(uniques):
+            rows = slice(bounds[g], bounds[g + 1])
+            accumulators = self._group(label.item() if isinstance(label, np.generic) else label)
+            for i, (metric, metric_type) in enumerate(zip(self.metrics, self.metric_types)):
+                if metric_type == 'ratio':
+                    x_column, y_column = parse_ratio_metric(metric)
+                    accumulators[i].update(columns[x_column][rows], columns[y_column][rows])
+                else:
+                    accumulators[i].update(columns[metric][rows])
+        return self
+
+    def merge(self, other: 'ExperimentAccumulator') -> 'ExperimentAccumulator':
+        """Fold the state of another accumulator (same metrics) into this one and return self."""
+        if other.metric_labels != self.metric_labels or other.metric_types != self.metric_types:
+            raise ValueError("Cannot merge accumulators of different metrics")
+        for label, accumulators in other.groups.items():
+            for mine, theirs in zip(self._group(label), accumulators):
+                mine.merge(theirs)
+        return self
+
+    def group_stats(self, metrics: Optional[Sequence[Union[str, List[str]]]] = None) -> GroupedMetricStats:
+        """
+        Grouped test engine over the accumulated state.
+
+        Args:
+            metrics (List, optional): Subset of the accumulated metrics, reported as given (default: all)
+        """
+        labels = list(self.groups)
+        if metrics is None:
+            metrics = self.metrics
+        positions = []
+        for metric in metrics:
+            if metric_label(metric) not in self.metric_labels:
+                raise KeyError(metric_label(metric))
+            positions.append(self.metric_labels.index(metric_label(metric)))
+        shape = (len(positions), len(labels))
+        estimate, variance, counts = np.empty(shape), np.empty(shape), np.empty(shape)
+        for g, label in enumerate(labels):
+            for row, i in enumerate(positions):
+                accumulator = self.groups[label][i]
+                estimate[row, g], variance[row, g] = accumulator.estimate(self.metric_types[i])
+                counts[row, g] = accumulator.count
+        return GroupedMetricStats.from_estimates(labels, list(metrics),
+                                                 [self.metric_types[i] for i in positions],
+                                                 estimate, variance, counts)
+
+    def to_bytes(self) -> bytes:
+        """Compact binary state: a small JSON header plus 6 float64 values per (group, metric)."""
+        header = json.dumps({
+            'metrics': self.metric_labels,
+            'metric_types': self.metric_types,
+            'groups': list(self.groups),
+        }).encode('utf-8')
+        states = np.array([astuple(a) for accumulators in self.groups.values() for a in accumulators],
+                          dtype='<f8')
+        return _HEADER.pack(_MAGIC, _VERSION, len(header)) + header + states.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> 'ExperimentAccumulator':
+        """Inverse of to_bytes."""
+        magic, version, header_size = _HEADER.unpack_from(blob)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Not an accumulator blob of a supported version")
+        header = json.loads(blob[_HEADER.size:_HEADER.size + header_size].decode('utf-8'))
+        accumulator = cls(header['metrics'], header['metric_types'])
+        states = np.frombuffer(blob, dtype='<f8', offset=_HEADER.size + header_size)
+        states = states.reshape(len(header['groups']), len(header['metrics']), 6)
+        for label, group_states in zip(header['groups'], states):
+            accumulator.groups[label] = [MomentAccumulator(*map(float, state)) for state in group_states]
+        return accumulator
@@ -1,15 +1,28 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 import pandas as pd
 import numpy as np
 from scipy import stats
+import csv
+import io
 import json
 import hashlib
+import os
+import tempfile
+import threading
+import uuid
 from typing import Dict, List, Union, Tuple
 import random
 
 from SampleCalculator import SampleSizeCalculator
 from experiment_analysis_with_seedfinder import ExperimentAnalysisWithSeedFinder
+from bucketing import apollo_bucket_bulk, iter_unit_id_chunks
+from assignment_store import AssignmentStore, LRUCache
+from dataset_store import DatasetStore
+from jobs import JobManager
+from score_cache import SeedScoreCache
+from seed_search import BALANCE_CRITERIA, SEARCH_ENGINES
+from sufficient_stats import parse_ratio_metric
 
 app = Flask(__name__)
 CORS(app)
@@ -18,6 +31,39 @@ CORS(app)
 sample_calculator = SampleSizeCalculator()
 experiment_analyzer = ExperimentAnalysisWithSeedFinder()
 
+# 重随机迭代次数上限与种子搜索进程数上限
+MAX_RERANDOMIZATION_ITERATIONS = 20000
+MAX_SEARCH_WORKERS = os.cpu_count() or 1
+
+# 异步任务：有界后台任务池，完成的结果按 TTL 保留；异步任务允许更多迭代
+MAX_JOB_ITERATIONS = 1000000
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# 并发任务平分 CPU：每个任务线程各自创建进程池，不能都按 cpu_count 创建
+MAX_JOB_SEARCH_WORKERS = max(1, MAX_SEARCH_WORKERS // JOB_WORKERS)
+job_manager = JobManager(max_workers=JOB_WORKERS,
+                         result_ttl=float(os.environ.get('JOB_RESULT_TTL', 3600)))
+
+# 种子得分缓存：同一数据集重复提交时只计算新的种子/指标，SCORE_CACHE_ENTRIES=0 关闭
+if int(os.environ.get('SCORE_CACHE_ENTRIES', 200000)) > 0:
+    ExperimentAnalysisWithSeedFinder.score_cache = SeedScoreCache(int(os.environ.get('SCORE_CACHE_ENTRIES', 200000)))
+
+# 分桶立方体：保留最近的搜索的每种子 100 桶充分统计量，用于修改分组比例后即时重新排序
+bucket_cubes = LRUCache(int(os.environ.get('BUCKET_CUBE_ENTRIES', 8)))
+bucket_cubes_lock = threading.Lock()
+
+# 序贯检验：按实验名保存 mSPRT 累加状态（与数据量无关），增量批次到达时常数时间更新
+sequential_tests = LRUCache(int(os.environ.get('SEQUENTIAL_TEST_ENTRIES', 256)))
+sequential_tests_lock = threading.Lock()
+
+# 数据集注册表：POST /datasets 上传一次、解析为列式文件，之后各接口用 dataset_id 内存映射读取
+dataset_store = DatasetStore(os.environ.get('DATASET_STORE_DIR', os.path.join(tempfile.gettempdir(), 'ab-testing-datasets')),
+                             max_open_datasets=int(os.environ.get('DATASET_CACHE_ENTRIES', 16)))
+
+# 可选：持久化分桶索引，设置 ASSIGNMENT_STORE_DIR 后启用；
+# 只保存注册（/assign 带 register=true 上线）的实验
+if os.environ.get('ASSIGNMENT_STORE_DIR'):
+    ExperimentAnalysisWithSeedFinder.assignment_store = AssignmentStore(os.environ['ASSIGNMENT_STORE_DIR'])
+
 @app.route('/sample-size', methods=['POST'])
 def calculate_sample_size():
     try:
@@ -34,6 +80,16 @@ def calculate_sample_size():
         k = data.get('k', 1)
         group_num = data.get('group_num', 2)
         
+        # 已注册的数据集：未显式给出时，基线与方差取自数据集中的指标列（只内存映射该列）
+        if data.get('dataset_id'):
+            metric_column = data.get('metric_column', metric_name)
+            values = _load_dataset_columns(data['dataset_id'], [metric_column])
+            if metric_column not in values.columns:
+                raise ValueError(f'Column "{metric_column}" not found in dataset')
+            values = pd.to_numeric(values[metric_column], errors='coerce').dropna()
+            baseline = data.get('baseline', float(values.mean()))
+            variance = data.get('variance', float(values.var()))
+        
         # 根据指标类型计算样本量
         if metric_type == 'mean':
             control_sample_size = sample_calculator.calculate_continuous_metric_sample_size(
@@ -78,6 +134,9 @@ def experiment_analysis():
     try:
         data = request.get_json()
         
+        if data.get('dataset_id'):
+            return jsonify(_dataset_experiment_analysis(data))
+        
         group1 = data.get('group1', [])
         group2 = data.get('group2', [])
         test_type = data.get('test_type', 'welch')
@@ -85,30 +144,47 @@ def experiment_analysis():
         if not group1 or not group2:
             return jsonify({'error': 'Both groups must contain data'}), 400
         
+        # 分维度拆分：{"platform": {"group1": [...], "group2": [...]}}，每个观测一个维度取值
+        segment_by = data.get('segment_by') or {}
+        if segment_by and data.get('input_format', 'raw') == 'summary':
+            return jsonify({'error': 'segment_by requires raw observations'}), 400
+        
+        if data.get('input_format', 'raw') == 'summary':
+            # 汇总统计量输入：每组只传 n、sum、sum_sq（比例指标可只传 n、sum；
+            # 比率指标传 n、sum_x、sum_y、sum_x_sq、sum_y_sq、sum_xy），请求大小与样本量无关
+            if not isinstance(group1, dict) or not isinstance(group2, dict):
+                return jsonify({'error': 'Summary input requires a statistics object per group'}), 400
+            metric_type = 'mean' if test_type == 'welch' else test_type
+            if metric_type not in ('mean', 'proportion', 'ratio'):
+                return jsonify({'error': f'Unsupported test type: {test_type}'}), 400
+            
+            result = experiment_analyzer.compare_summary_stats(
+                {'control': group1, 'treatment': group2}, metric_type, [('treatment', 'control')]
+            ).test_result(0)
+            
+            t_stat = result[4]  # T统计量
+            p_value = result[5]  # P值
+            ci = result[7]  # 置信区间
+            
         # 创建DataFrame格式的数据，以便使用experiment_analyzer的方法
-        if test_type == 'ratio':
+        elif test_type == 'ratio':
             # 比率检验：处理X/Y格式
             if isinstance(group1, dict) and isinstance(group2, dict):
                 # 如果输入是字典格式 {X: [...], Y: [...]}
                 x1, y1 = group1['X'], group1['Y']
                 x2, y2 = group2['X'], group2['Y']
                 
-                # 创建DataFrame
-                df_data = []
-                for i in range(len(x1)):
-                    df_data.append({
-                        'group_name': 'control',
-                        'x_var': x1[i],
-                        'y_var': y1[i]
-                    })
-                for i in range(len(x2)):
-                    df_data.append({
-                        'group_name': 'treatment',
-                        'x_var': x2[i],
-                        'y_var': y2[i]
-                    })
+                # X、Y 按位置配对，长度不一致时无法配对，直接拒绝而不是截断
+                if len(x1) != len(y1) or len(x2) != len(y2):
+                    return jsonify({'error': f'Ratio test requires X and Y of equal length per group, got '
+                                             f'group1 {len(x1)}/{len(y1)} and group2 {len(x2)}/{len(y2)}'}), 400
                 
-                df = pd.DataFrame(df_data)
+                # 按列创建DataFrame
+                df = pd.DataFrame({
+                    'group_name': ['control'] * len(x1) + ['treatment'] * len(x2),
+                    'x_var': list(x1) + list(x2),
+                    'y_var': list(y1) + list(y2)
+                })
                 
                 # 使用test_ratio方法
                 result = experiment_analyzer.test_ratio(
@@ -129,20 +205,11 @@ def experiment_analysis():
                 
         else:
             # 均值和比例检验：处理简单数组格式
-            # 创建DataFrame
-            df_data = []
-            for value in group1:
-                df_data.append({
-                    'group_name': 'control',
-                    'metric': value
-                })
-            for value in group2:
-                df_data.append({
-                    'group_name': 'treatment',
-                    'metric': value
-                })
-            
-            df = pd.DataFrame(df_data)
+            # 按列创建DataFrame
+            df = pd.DataFrame({
+                'group_name': ['control'] * len(group1) + ['treatment'] * len(group2),
+                'metric': list(group1) + list(group2)
+            })
             
             if test_type == 'welch' or test_type == 'mean':
                 # 使用test_mean方法
@@ -182,73 +249,348 @@ def experiment_analysis():
             'test_type': test_type
         }
         
+        if segment_by:
+            metric = ['x_var', 'y_var'] if test_type == 'ratio' else 'metric'
+            metric_type = 'mean' if test_type == 'welch' else test_type
+            _attach_segments(df, segment_by)
+            result['segments'] = _segment_breakdown(df, 'group_name', 'treatment', 'control', metric, metric_type,
+                                                    list(segment_by), bool(data.get('bh_correction', False)))
+        
         return jsonify(result)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+def _dataset_experiment_analysis(data):
+    """
+    对已注册数据集做两组检验：group1/group2 为分组列中的对照组/实验组标签，
+    metric 为指标列（比率检验为 [分子列, 分母列] 或 "分子列/分母列"），segment_by 为维度列列表
+    """
+    test_type = data.get('test_type', 'welch')
+    metric_type = 'mean' if test_type == 'welch' else test_type
+    if metric_type not in ('mean', 'proportion', 'ratio'):
+        raise ValueError(f'Unsupported test type: {test_type}')
+    group_column = data.get('group_column', 'group_name')
+    control_label, treated_label = data.get('group1', 'control'), data.get('group2', 'treatment')
+    metric = data.get('metric')
+    if not metric:
+        raise ValueError('A metric column is required with dataset_id')
+    metric_columns = list(parse_ratio_metric(metric)) if metric_type == 'ratio' else [metric]
+    segment_columns = list(data.get('segment_by') or [])
+    
+    # 只内存映射分组列、指标列与维度列
+    columns = [group_column] + metric_columns + segment_columns
+    df = _load_dataset_columns(data['dataset_id'], columns)
+    for column in columns:
+        if column not in df.columns:
+            raise ValueError(f'Column "{column}" not found in dataset')
+    
+    result = experiment_analyzer.compare_groups(df, [metric], [metric_type], group_column,
+                                                [(treated_label, control_label)]).test_result(0)
+    response = {
+        't_stat': float(result[4]),
+        'p_value': float(result[5]),
+        'confidence_interval': result[7],
+        'test_type': test_type
+    }
+    if segment_columns:
+        response['segments'] = _segment_breakdown(df, group_column, treated_label, control_label, metric,
+                                                  metric_type, segment_columns,
+                                                  bool(data.get('bh_correction', False)))
+    return response
+
+@app.route('/datasets', methods=['POST'])
+def create_dataset():
+    """
+    注册数据集：JSON 行列表（与 /rerandomization 的 data 相同）或上传 CSV 文件，
+    解析一次后按列存盘，返回 dataset_id。userIdColumn 默认与 /rerandomization 相同为 user_id，
+    该列按字符串字典编码（不做数值转换），保证与直接传 data 时哈希的 ID 一致
+    """
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            id_column = request.form.get('userIdColumn') or 'user_id'
+            df = pd.read_csv(upload, dtype={id_column: str})
+        else:
+            data = request.get_json()
+            id_column = data.get('userIdColumn') or 'user_id'
+            if not data.get('data'):
+                raise ValueError('No valid data provided')
+            df = pd.DataFrame(data['data'])
+        if df.empty:
+            raise ValueError('Empty dataset')
+        info = dataset_store.create(df, id_column)
+        return jsonify(info.to_dict()), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/datasets/<dataset_id>', methods=['GET'])
+def get_dataset(dataset_id):
+    """数据集元信息（行数、数值列、字典编码列）"""
+    try:
+        return jsonify(dataset_store.info(dataset_id).to_dict())
+    except KeyError:
+        return jsonify({'error': f'Dataset "{dataset_id}" not found'}), 404
+
+@app.route('/datasets/<dataset_id>', methods=['DELETE'])
+def delete_dataset(dataset_id):
+    if not dataset_store.delete(dataset_id):
+        return jsonify({'error': f'Dataset "{dataset_id}" not found'}), 404
+    return jsonify({'deleted': dataset_id})
+
+def _load_dataset_columns(dataset_id, columns):
+    """按需内存映射数据集的列；未注册的数据集报错"""
+    try:
+        return dataset_store.load(dataset_id, columns)
+    except KeyError:
+        raise ValueError(f'Dataset "{dataset_id}" not found')
+
 @app.route('/rerandomization', methods=['POST'])
 def rerandomization():
+    try:
+        params = _prepare_rerandomization(request.get_json(), MAX_RERANDOMIZATION_ITERATIONS)
+        return jsonify(_run_rerandomization(params))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/rerandomization/rerank', methods=['POST'])
+def rerank_rerandomization():
+    """按新的分组比例对已保存的候选种子重新排序（不重新哈希、不读取原始数据）"""
     try:
         data = request.get_json()
+        cube_id = data.get('bucketCubeId')
+        groupProportions = data.get('groupProportions', {})
+        top_k = max(1, int(data.get('topK', 10)))
+        with bucket_cubes_lock:
+            bucket_cube = bucket_cubes.get(cube_id)
+        if bucket_cube is None:
+            return jsonify({'error': f'Bucket cube "{cube_id}" not found or expired'}), 404
         
-        # 提取参数
-        input_data = data.get('data', [])
-        selected_metrics = data.get('selectedMetrics', [])  # 用户选择的指标
-        metric_types = data.get('metricTypes', {})  # 指标类型映射
-        userIdColumn = data.get('userIdColumn', 'user_id')
-        iterations = data.get('iterations', 1000)
-        groupProportions = data.get('groupProportions', {'control': 50, 'treatment': 50})
+        total_proportion = sum(groupProportions.values())
+        if total_proportion != 100:
+            raise ValueError(f'Group proportions must sum to 100%, current sum: {total_proportion}%')
         
-        # 调试信息
-        print(f"DEBUG: selected_metrics = {selected_metrics}")
-        print(f"DEBUG: metric_types = {metric_types}")
-        print(f"DEBUG: input_data columns = {list(input_data[0].keys()) if input_data else 'No data'}")
+        # 对照组与 /rerandomization 一致：默认取第一个组
+        control_group = data.get('controlGroup') or list(groupProportions.keys())[0]
+        search_result = experiment_analyzer.rerank_seeds(
+            bucket_cube, groupProportions, control_label=control_group, top_k=top_k
+        )
+        return jsonify({
+            'bestSeed': search_result.best_seed,
+            'topSeeds': _format_top_seeds(search_result),
+            **_score_distribution(search_result),
+            'groupProportions': groupProportions,
+            'randomState': search_result.random_state,
+            'criterion': search_result.criterion,
+            'bucketCubeId': cube_id
+        })
         
-        # 处理可能的JSON转义字符问题
-        selected_metrics_clean = []
-        for metric in selected_metrics:
-            if isinstance(metric, list) and len(metric) == 2:
-                # 数组格式的比率指标，直接保留
-                selected_metrics_clean.append(metric)
-                print(f"DEBUG: Array metric: {metric}")
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/sequential-tests/<name>', methods=['POST'])
+def update_sequential_test(name):
+    """
+    序贯检验（mSPRT）：为指定实验追加一批新数据，返回随时有效的 p 值与置信序列。
+    首次请求需带 metrics / metricTypes / controlGroup 以创建状态，之后只需传 rows
+    """
+    try:
+        data = request.get_json()
+        rows = data.get('rows', [])
+        group_column = data.get('groupColumn', 'group_name')
+        with sequential_tests_lock:
+            sequential_test = sequential_tests.get(name)
+            if sequential_test is None:
+                metrics = data.get('metrics')
+                if not metrics or 'controlGroup' not in data:
+                    return jsonify({'error': f'Sequential test "{name}" not found; '
+                                             'metrics and controlGroup are required to create it'}), 404
+                mixing_variance = data.get('mixingVariance')
+                if isinstance(mixing_variance, dict):
+                    mixing_variance = [mixing_variance.get(json.dumps(m) if isinstance(m, list) else m)
+                                       for m in metrics]
+                sequential_test = experiment_analyzer.create_sequential_test(
+                    metrics, _resolve_metric_types(metrics, data.get('metricTypes', {})), data['controlGroup'],
+                    relative_effect=float(data.get('relativeEffect', 0.05)), mixing_variance=mixing_variance
+                )
+                sequential_tests.put(name, sequential_test)
+            elif data.get('metrics') and data['metrics'] != sequential_test.metrics:
+                raise ValueError(f'Sequential test "{name}" was created with different metrics')
+            
+            # 只折叠本批数据，不重算历史
+            batch = pd.DataFrame(rows)
+            if len(batch):
+                table = sequential_test.update(batch, group_column)
             else:
-                # 字符串格式，移除可能的转义字符
-                metric_clean = metric.replace('\\', '').replace('"', '')
-                selected_metrics_clean.append(metric_clean)
-                print(f"DEBUG: Original metric: '{metric}' -> Cleaned: '{metric_clean}'")
-        
-        selected_metrics = selected_metrics_clean
-        
-        # 清理metric_types中的键
-        metric_types_clean = {}
-        for key, value in metric_types.items():
-            key_clean = key.replace('\\', '').replace('"', '')
-            metric_types_clean[key_clean] = value
-            print(f"DEBUG: Original key: '{key}' -> Cleaned: '{key_clean}'")
-        
-        metric_types = metric_types_clean
+                table = sequential_test.results()
+        return jsonify(_format_sequential_results(name, sequential_test, table))
         
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/sequential-tests/<name>', methods=['GET'])
+def get_sequential_test(name):
+    """查询序贯检验的当前结果（不追加数据）"""
+    with sequential_tests_lock:
+        sequential_test = sequential_tests.get(name)
+        if sequential_test is None:
+            return jsonify({'error': f'Sequential test "{name}" not found or expired'}), 404
+        table = sequential_test.results()
+    return jsonify(_format_sequential_results(name, sequential_test, table))
+
+@app.route('/sequential-tests/<name>', methods=['DELETE'])
+def delete_sequential_test(name):
+    """删除序贯检验状态（重新开始监控）"""
+    with sequential_tests_lock:
+        sequential_test = sequential_tests.pop(name)
+    if sequential_test is None:
+        return jsonify({'error': f'Sequential test "{name}" not found or expired'}), 404
+    return jsonify({'name': name, 'deleted': True})
+
+def _format_sequential_results(name, sequential_test, table):
+    """
+    序贯检验结果转为与显著性检验相近的 JSON 结构
+    """
+    def optional_float(value):
+        return float(value) if np.isfinite(value) else None
+    
+    results = {}
+    for i, (metric, metric_type) in enumerate(zip(sequential_test.metrics, sequential_test.metric_types)):
+        result_key = f"{metric[0]}/{metric[1]}" if isinstance(metric, list) and len(metric) == 2 else metric
+        results[result_key] = {
+            'metric_type': metric_type,
+            'mixing_variance': optional_float(sequential_test.mixing_variance[i]),
+            'tests': []
+        }
+    for e in range(len(table)):
+        metric = table.metrics[e]
+        result_key = f"{metric[0]}/{metric[1]}" if isinstance(metric, list) and len(metric) == 2 else metric
+        results[result_key]['tests'].append({
+            'group1': str(sequential_test.control_label),
+            'group2': str(table.treated_labels[e]),
+            'test_type': 'mSPRT (always valid)',
+            'p_value': float(table.p_value[e]),
+            'significant': table.significance[e] == "显著",
+            'confidence_sequence': [optional_float(table.ci_lower[e]), optional_float(table.ci_upper[e])],
+            'group1_mean': optional_float(table.control_value[e]),
+            'group2_mean': optional_float(table.treatment_value[e]),
+            'absolute_diff': optional_float(table.absolute_diff[e]),
+            'group1_size': int(table.control_size[e]),
+            'group2_size': int(table.treatment_size[e])
+        })
+    return {'name': name, 'looks': table.looks, 'alpha': sequential_test.alpha, 'results': results}
+
+@app.route('/jobs/rerandomization', methods=['POST'])
+def submit_rerandomization_job():
+    """异步重随机：参数校验在请求内完成，种子搜索在后台任务池中执行"""
+    try:
+        params = _prepare_rerandomization(request.get_json(), MAX_JOB_ITERATIONS, MAX_JOB_SEARCH_WORKERS)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def run(job):
+        def report(progress):
+            best = {'seed': progress.best_seed, 'score': progress.best_score}
+            if params['criterion'] == 'max-t':
+                best['maxTStat'] = progress.best_score
+            job.report(progress.completed, progress.total, best)
+        return _run_rerandomization(params, progress_callback=report)
+    
+    try:
+        job = job_manager.submit('rerandomization', run)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询任务状态、进度、当前最佳种子、预计剩余时间；完成后返回结果"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job "{job_id}" not found or expired'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """取消排队中或运行中的任务"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'error': f'Job "{job_id}" not found or expired'}), 404
+    return jsonify(job.to_dict(include_result=False))
+
+def _prepare_rerandomization(data, max_iterations, max_workers=MAX_SEARCH_WORKERS):
+    """
+    解析并校验重随机请求，返回清洗后的数据与搜索参数；参数错误时抛出 ValueError
+    """
+    # 提取参数
+    input_data = data.get('data', [])
+    selected_metrics = data.get('selectedMetrics', [])  # 用户选择的指标
+    metric_types = data.get('metricTypes', {})  # 指标类型映射
+    userIdColumn = data.get('userIdColumn', 'user_id')
+    iterations = min(int(data.get('iterations', 1000)), max_iterations)
+    groupProportions = data.get('groupProportions', {'control': 50, 'treatment': 50})
+    random_state = data.get('randomState')  # 主种子：相同主种子得到相同的搜索结果
+    workers = max(1, min(int(data.get('workers', 1)), max_workers))
+    prune = bool(data.get('prune', False))  # 提前淘汰不可能进入前K的种子
+    engine = data.get('engine', 'per-seed')  # 'per-seed' 或 'batched'（多种子批量核）
+    keep_bucket_cube = bool(data.get('keepBucketCube', False))  # 保存分桶立方体，供 /rerandomization/rerank 使用
+    criterion = data.get('criterion', 'max-t')  # 平衡性准则：'max-t'（最大|T|）或 'mahalanobis'（马氏距离）
+
+    # 调试信息
+    app.logger.debug('selected_metrics = %s', selected_metrics)
+    app.logger.debug('metric_types = %s', metric_types)
+    app.logger.debug('input_data columns = %s', list(input_data[0].keys()) if input_data else 'No data')
+
+    # 处理可能的JSON转义字符问题
+    selected_metrics_clean = []
+    for metric in selected_metrics:
+        if isinstance(metric, list) and len(metric) == 2:
+            # 数组格式的比率指标，直接保留
+            selected_metrics_clean.append(metric)
+            app.logger.debug('Array metric: %s', metric)
+        else:
+            # 字符串格式，移除可能的转义字符
+            metric_clean = metric.replace('\\', '').replace('"', '')
+            selected_metrics_clean.append(metric_clean)
+            app.logger.debug("Original metric: '%s' -> Cleaned: '%s'", metric, metric_clean)
+
+    selected_metrics = selected_metrics_clean
+
+    # 清理metric_types中的键
+    metric_types_clean = {}
+    for key, value in metric_types.items():
+        key_clean = key.replace('\\', '').replace('"', '')
+        metric_types_clean[key_clean] = value
+        app.logger.debug("Original key: '%s' -> Cleaned: '%s'", key, key_clean)
+
+    metric_types = metric_types_clean
+
+    dataset_id = data.get('datasetId')
+    if dataset_id:
+        # 已注册的数据集：列类型在上传时已确定，只内存映射用到的列，跳过 JSON 解析与逐列探测
+        df, numeric_columns = _load_rerandomization_dataset(dataset_id, userIdColumn, selected_metrics)
+    else:
         if not input_data:
-            return jsonify({'error': 'No valid data provided'}), 400
-        
+            raise ValueError('No valid data provided')
+
         # 转换为DataFrame
         df = pd.DataFrame(input_data)
-        
+
         if df.empty:
-            return jsonify({'error': 'Empty dataset'}), 400
-        
+            raise ValueError('Empty dataset')
+
         # 调试信息
-        print(f"DEBUG: DataFrame shape = {df.shape}")
-        print(f"DEBUG: DataFrame columns = {list(df.columns)}")
-        print(f"DEBUG: DataFrame dtypes = {df.dtypes.to_dict()}")
-        print(f"DEBUG: First few rows:")
-        print(df.head())
-        
+        app.logger.debug('DataFrame shape = %s', df.shape)
+        app.logger.debug('DataFrame columns = %s', list(df.columns))
+        app.logger.debug('DataFrame dtypes = %s', df.dtypes.to_dict())
+        app.logger.debug('First few rows:\n%s', df.head())
+
         # 检查必要的列是否存在
         if userIdColumn not in df.columns:
-            return jsonify({'error': f'User ID column "{userIdColumn}" not found'}), 400
-        
+            raise ValueError(f'User ID column "{userIdColumn}" not found')
+
         # 获取所有数值型列作为可用指标
         numeric_columns = []
         for col in df.columns:
@@ -258,413 +600,487 @@ def rerandomization():
                     numeric_columns.append(col)
                 except:
                     continue
-        
-        if not numeric_columns:
-            return jsonify({'error': 'No numeric columns found for metrics'}), 400
-        
-        # 如果用户没有选择指标，使用所有数值列
-        if not selected_metrics:
-            selected_metrics = numeric_columns[:3]  # 默认选择前3个指标
-        
-        # 验证选择的指标是否存在
-        for metric in selected_metrics:
-            # 对于比率指标，需要从metricTypes中找到对应的类型
-            metric_type = None
-            if isinstance(metric, list) and len(metric) == 2:
-                # 数组格式的比率指标，需要在metricTypes中查找对应的JSON字符串键
-                metric_key = json.dumps(metric)
-                metric_type = metric_types.get(metric_key, 'ratio')
-            else:
-                metric_type = metric_types.get(metric, 'mean')
-            
-            print(f"DEBUG: Processing metric '{metric}' with type '{metric_type}'")
-            print(f"DEBUG: Available columns: {list(df.columns)}")
-            
-            if metric_type == 'ratio':
-                # 比率类型：检查分子和分母列是否存在
-                if isinstance(metric, list) and len(metric) == 2:
-                    # 新的数组格式：[numerator, denominator]
-                    x_var, y_var = metric[0], metric[1]
-                    print(f"DEBUG: Ratio metric (array format) - x_var: '{x_var}', y_var: '{y_var}'")
-                else:
-                    # 旧的字符串格式：处理可能的转义字符
-                    metric_clean = metric.replace('\\', '').replace('"', '')
-                    x_var, y_var = metric_clean.split('/')
-                    print(f"DEBUG: Ratio metric (string format) - x_var: '{x_var}', y_var: '{y_var}'")
-                
-                if x_var not in df.columns:
-                    print(f"DEBUG: x_var '{x_var}' not found in columns")
-                    return jsonify({'error': f'Numerator column "{x_var}" not found for ratio metric "{metric}"'}), 400
-                if y_var not in df.columns:
-                    print(f"DEBUG: y_var '{y_var}' not found in columns")
-                    return jsonify({'error': f'Denominator column "{y_var}" not found for ratio metric "{metric}"'}), 400
-            else:
-                # 其他类型：检查指标列是否存在
-                if metric not in df.columns:
-                    print(f"DEBUG: metric '{metric}' not found in columns")
-                    return jsonify({'error': f'Metric column "{metric}" not found'}), 400
-        
-        # 验证指标类型
-        valid_types = ['mean', 'proportion', 'ratio']
-        for metric, metric_type in metric_types.items():
-            if metric_type not in valid_types:
-                return jsonify({'error': f'Invalid metric type for {metric}: {metric_type}. Must be one of {valid_types}'}), 400
-        
-        # 验证组别比例总和
-        total_proportion = sum(groupProportions.values())
-        if total_proportion != 100:
-            return jsonify({'error': f'Group proportions must sum to 100%, current sum: {total_proportion}%'}), 400
-        
-        # 确保用户ID列是字符串类型
-        df[userIdColumn] = df[userIdColumn].astype(str)
-        
-        # 确保指标列是数值类型
-        for metric in selected_metrics:
-            # 获取指标类型
-            if isinstance(metric, list) and len(metric) == 2:
-                metric_key = json.dumps(metric)
-                metric_type = metric_types.get(metric_key, 'ratio')
-            else:
-                metric_type = metric_types.get(metric, 'mean')
-            
-            if metric_type == 'ratio':
-                # 比率类型：确保分子和分母列是数值类型
-                if isinstance(metric, list):
-                    x_var, y_var = metric[0], metric[1]
-                else:
-                    metric_clean = metric.replace('\\', '')
-                    x_var, y_var = metric_clean.split('/')
-                df[x_var] = pd.to_numeric(df[x_var], errors='coerce')
-                df[y_var] = pd.to_numeric(df[y_var], errors='coerce')
-            else:
-                # 其他类型：确保指标列是数值类型
-                df[metric] = pd.to_numeric(df[metric], errors='coerce')
-        
-        # 移除包含NaN的行
-        columns_to_check = [userIdColumn]
-        for metric in selected_metrics:
-            # 获取指标类型
+
+    if not numeric_columns:
+        raise ValueError('No numeric columns found for metrics')
+
+    # 如果用户没有选择指标，使用所有数值列
+    if not selected_metrics:
+        selected_metrics = numeric_columns[:3]  # 默认选择前3个指标
+
+    # 验证选择的指标是否存在
+    for metric in selected_metrics:
+        # 对于比率指标，需要从metricTypes中找到对应的类型
+        metric_type = None
+        if isinstance(metric, list) and len(metric) == 2:
+            # 数组格式的比率指标，需要在metricTypes中查找对应的JSON字符串键
+            metric_key = json.dumps(metric)
+            metric_type = metric_types.get(metric_key, 'ratio')
+        else:
+            metric_type = metric_types.get(metric, 'mean')
+
+        app.logger.debug("Processing metric '%s' with type '%s'", metric, metric_type)
+        app.logger.debug('Available columns: %s', list(df.columns))
+
+        if metric_type == 'ratio':
+            # 比率类型：检查分子和分母列是否存在
             if isinstance(metric, list) and len(metric) == 2:
-                metric_key = json.dumps(metric)
-                metric_type = metric_types.get(metric_key, 'ratio')
+                # 新的数组格式：[numerator, denominator]
+                x_var, y_var = metric[0], metric[1]
+                app.logger.debug("Ratio metric (array format) - x_var: '%s', y_var: '%s'", x_var, y_var)
             else:
-                metric_type = metric_types.get(metric, 'mean')
-            
-            if metric_type == 'ratio':
-                # 比率类型：检查分子和分母列
-                if isinstance(metric, list):
-                    x_var, y_var = metric[0], metric[1]
-                else:
-                    metric_clean = metric.replace('\\', '')
-                    x_var, y_var = metric_clean.split('/')
-                columns_to_check.extend([x_var, y_var])
+                # 旧的字符串格式：处理可能的转义字符
+                metric_clean = metric.replace('\\', '').replace('"', '')
+                x_var, y_var = metric_clean.split('/')
+                app.logger.debug("Ratio metric (string format) - x_var: '%s', y_var: '%s'", x_var, y_var)
+
+            if x_var not in df.columns:
+                app.logger.debug("x_var '%s' not found in columns", x_var)
+                raise ValueError(f'Numerator column "{x_var}" not found for ratio metric "{metric}"')
+            if y_var not in df.columns:
+                app.logger.debug("y_var '%s' not found in columns", y_var)
+                raise ValueError(f'Denominator column "{y_var}" not found for ratio metric "{metric}"')
+        else:
+            # 其他类型：检查指标列是否存在
+            if metric not in df.columns:
+                app.logger.debug("metric '%s' not found in columns", metric)
+                raise ValueError(f'Metric column "{metric}" not found')
+
+    # 验证指标类型
+    valid_types = ['mean', 'proportion', 'ratio']
+    for metric, metric_type in metric_types.items():
+        if metric_type not in valid_types:
+            raise ValueError(f'Invalid metric type for {metric}: {metric_type}. Must be one of {valid_types}')
+
+    # 验证组别比例总和
+    total_proportion = sum(groupProportions.values())
+    if total_proportion != 100:
+        raise ValueError(f'Group proportions must sum to 100%, current sum: {total_proportion}%')
+
+    if engine not in SEARCH_ENGINES:
+        raise ValueError(f'Invalid search engine: {engine}. Must be one of {list(SEARCH_ENGINES)}')
+    if criterion not in BALANCE_CRITERIA:
+        raise ValueError(f'Invalid balance criterion: {criterion}. Must be one of {list(BALANCE_CRITERIA)}')
+    if criterion != 'max-t' and prune:
+        raise ValueError('Pruning is only available for the max-t criterion')
+
+    # 预编译分组查找表，整个请求复用
+    allocator = experiment_analyzer.get_allocator(groupProportions)
+
+    # 确保用户ID列是字符串类型
+    df[userIdColumn] = df[userIdColumn].astype(str)
+
+    # 确保指标列是数值类型
+    for metric in selected_metrics:
+        # 获取指标类型
+        if isinstance(metric, list) and len(metric) == 2:
+            metric_key = json.dumps(metric)
+            metric_type = metric_types.get(metric_key, 'ratio')
+        else:
+            metric_type = metric_types.get(metric, 'mean')
+
+        if metric_type == 'ratio':
+            # 比率类型：确保分子和分母列是数值类型
+            if isinstance(metric, list):
+                x_var, y_var = metric[0], metric[1]
             else:
-                # 其他类型：检查指标列
-                columns_to_check.append(metric)
-        
-        df = df.dropna(subset=columns_to_check)
-        
-        if df.empty:
-            return jsonify({'error': 'No valid data after cleaning'}), 400
-        
-        # 生成实验名称
-        experiment_name = f"rerandomization_{hashlib.md5(str(df[userIdColumn].tolist()).encode()).hexdigest()[:8]}"
-        
-        # 获取对照组名称（通常是第一个组）
-        control_group = list(groupProportions.keys())[0]
-        
-        # 构建指标类型列表
-        metric_types_list = []
-        for metric in selected_metrics:
-            if isinstance(metric, list) and len(metric) == 2:
-                # 数组格式的比率指标，需要在metricTypes中查找对应的JSON字符串键
-                metric_key = json.dumps(metric)
-                metric_type = metric_types.get(metric_key, 'ratio')
+                metric_clean = metric.replace('\\', '')
+                x_var, y_var = metric_clean.split('/')
+            df[x_var] = pd.to_numeric(df[x_var], errors='coerce')
+            df[y_var] = pd.to_numeric(df[y_var], errors='coerce')
+        else:
+            # 其他类型：确保指标列是数值类型
+            df[metric] = pd.to_numeric(df[metric], errors='coerce')
+
+    # 移除包含NaN的行
+    columns_to_check = [userIdColumn]
+    for metric in selected_metrics:
+        # 获取指标类型
+        if isinstance(metric, list) and len(metric) == 2:
+            metric_key = json.dumps(metric)
+            metric_type = metric_types.get(metric_key, 'ratio')
+        else:
+            metric_type = metric_types.get(metric, 'mean')
+
+        if metric_type == 'ratio':
+            # 比率类型：检查分子和分母列
+            if isinstance(metric, list):
+                x_var, y_var = metric[0], metric[1]
             else:
-                metric_type = metric_types.get(metric, 'mean')
-            metric_types_list.append(metric_type)
-        
-        # 执行重随机
-        best_seed = experiment_analyzer.generate_best_seed(
-            df=df,
-            metrics=selected_metrics,
-            metric_types=metric_types_list,
-            group_name='group_name',
-            unit_id=userIdColumn,
-            iterations=min(iterations, 100),  # 限制迭代次数以避免性能问题
-            group_proportions=groupProportions,
-            control_label=control_group
-        )
-        
-        # 使用最佳种子分配组别
-        df_with_groups = experiment_analyzer.assign_groups_with_seed(
-            df=df,
-            seed=best_seed,
-            unit_id=userIdColumn,
-            group_name='group_name',
-            group_proportions=groupProportions
-        )
-        
-        # 计算最佳种子的显著性检验结果
-        best_seed_results = calculate_significance_tests(df_with_groups, selected_metrics, metric_types, groupProportions)
-        
-        # 计算所有迭代的T统计量
-        all_t_stats = []
-        top_seeds = []
-        
-        for i in range(min(iterations, 50)):  # 进一步限制迭代次数
-            seed = f"seed_{i}"
-            try:
-                # 使用种子分配组别
-                temp_df = experiment_analyzer.assign_groups_with_seed(
-                    df=df,
-                    seed=seed,
-                    unit_id=userIdColumn,
-                    group_name='group_name',
-                    group_proportions=groupProportions
-                )
-                
-                # 计算每个指标的T统计量（多组别情况下，计算所有组别对之间的最大T统计量）
-                max_t_stat = 0
-                for i, metric in enumerate(selected_metrics):
-                    # 获取指标类型
-                    if isinstance(metric, list) and len(metric) == 2:
-                        metric_key = json.dumps(metric)
-                        metric_type = metric_types.get(metric_key, 'ratio')
-                    else:
-                        metric_type = metric_types.get(metric, 'mean')
-                    
-                    # 计算所有组别对之间的统计量
-                    group_names = list(groupProportions.keys())
-                    for j in range(len(group_names)):
-                        for k in range(j + 1, len(group_names)):
-                            group1_name = group_names[j]
-                            group2_name = group_names[k]
-                            
-                            # 根据指标类型选择不同的检验方法
-                            if metric_type == 'mean':
-                                # 使用test_mean方法
-                                try:
-                                    result = experiment_analyzer.test_mean(
-                                        data=temp_df,
-                                        groupname='group_name',
-                                        treated_label=group2_name,
-                                        control_label=group1_name,
-                                        test_metric=metric
-                                    )
-                                    t_stat = result[4]  # T统计量在第5个位置
-                                    max_t_stat = max(max_t_stat, abs(t_stat))
-                                except Exception as e:
-                                    print(f"Error in test_mean for {metric}: {e}")
-                                    continue
-                                    
-                            elif metric_type == 'proportion':
-                                # 使用test_proportion方法
-                                try:
-                                    result = experiment_analyzer.test_proportion(
-                                        data=temp_df,
-                                        groupname='group_name',
-                                        treated_label=group2_name,
-                                        control_label=group1_name,
-                                        metric=metric
-                                    )
-                                    t_stat = result[4]  # T统计量在第5个位置
-                                    max_t_stat = max(max_t_stat, abs(t_stat))
-                                except Exception as e:
-                                    print(f"Error in test_proportion for {metric}: {e}")
-                                    continue
-                                    
-                            elif metric_type == 'ratio':
-                                # 使用test_ratio方法
-                                try:
-                                    # 解析比率指标
-                                    if isinstance(metric, list) and len(metric) == 2:
-                                        # 新的数组格式：[numerator, denominator]
-                                        x_var, y_var = metric[0], metric[1]
-                                    else:
-                                        # 旧的字符串格式
-                                        x_var, y_var = metric.split('/')
-                                    
-                                    result = experiment_analyzer.test_ratio(
-                                        data=temp_df,
-                                        groupname='group_name',
-                                        treated_label=group2_name,
-                                        control_label=group1_name,
-                                        x_var=x_var,
-                                        y_var=y_var
-                                    )
-                                    t_stat = result[4]  # T统计量在第5个位置
-                                    max_t_stat = max(max_t_stat, abs(t_stat))
-                                except Exception as e:
-                                    print(f"Error in test_ratio for {metric}: {e}")
-                                    continue
-                
-                all_t_stats.append(max_t_stat)
-                top_seeds.append({
-                    'seed': seed,
-                    'maxTStat': max_t_stat
-                })
-                
-            except Exception as e:
-                print(f"Error with seed {seed}: {e}")
-                continue
-        
-        # 排序并获取前10个最佳种子
-        top_seeds.sort(key=lambda x: x['maxTStat'])
-        top_seeds = top_seeds[:10]
-        
-        if not top_seeds:
-            return jsonify({'error': 'No valid seeds found. Please check your data and parameters.'}), 400
-        
-        result = {
-            'bestSeed': best_seed,
-            'bestSeedResults': best_seed_results,  # 新增：最佳种子的显著性检验结果
-            'topSeeds': top_seeds,
-            'allTStats': all_t_stats,
-            'totalIterations': len(all_t_stats),
-            'groupProportions': groupProportions,
-            'selectedMetrics': selected_metrics,
-            'availableMetrics': numeric_columns,  # 新增：所有可用指标
-            'metricTypes': metric_types
+                metric_clean = metric.replace('\\', '')
+                x_var, y_var = metric_clean.split('/')
+            columns_to_check.extend([x_var, y_var])
+        else:
+            # 其他类型：检查指标列
+            columns_to_check.append(metric)
+
+    df = df.dropna(subset=columns_to_check)
+
+    if df.empty:
+        raise ValueError('No valid data after cleaning')
+
+    # 获取对照组名称（通常是第一个组）
+    control_group = list(groupProportions.keys())[0]
+
+    # 构建指标类型列表
+    metric_types_list = []
+    for metric in selected_metrics:
+        if isinstance(metric, list) and len(metric) == 2:
+            # 数组格式的比率指标，需要在metricTypes中查找对应的JSON字符串键
+            metric_key = json.dumps(metric)
+            metric_type = metric_types.get(metric_key, 'ratio')
+        else:
+            metric_type = metric_types.get(metric, 'mean')
+        metric_types_list.append(metric_type)
+
+    return {
+        'df': df,
+        'selected_metrics': selected_metrics,
+        'metric_types': metric_types,
+        'metric_types_list': metric_types_list,
+        'userIdColumn': userIdColumn,
+        'iterations': iterations,
+        'groupProportions': groupProportions,
+        'allocator': allocator,
+        'control_group': control_group,
+        'random_state': random_state,
+        'workers': workers,
+        'prune': prune,
+        'engine': engine,
+        'keep_bucket_cube': keep_bucket_cube,
+        'criterion': criterion,
+        'numeric_columns': numeric_columns,
+    }
+
+def _load_rerandomization_dataset(dataset_id, userIdColumn, selected_metrics):
+    """
+    从数据集注册表读取重随机所需的列：ID 列与所选指标（未选择时为前3个数值列）的源列
+    """
+    try:
+        info = dataset_store.info(dataset_id)
+    except KeyError:
+        raise ValueError(f'Dataset "{dataset_id}" not found')
+    if userIdColumn not in info.columns:
+        raise ValueError(f'User ID column "{userIdColumn}" not found')
+    if userIdColumn != info.id_column:
+        # 其他列上传时可能已转为数值（如 '00123' -> 123），哈希结果会与原始 ID 不同
+        raise ValueError(f'Dataset "{dataset_id}" was registered with user ID column "{info.id_column}"; '
+                         f'register it again with userIdColumn "{userIdColumn}"')
+    numeric_columns = [col for col in info.numeric_columns
+                       if col != userIdColumn and col not in ['group', 'group_name', 'treatment']]
+    columns = [userIdColumn]
+    for metric in selected_metrics or numeric_columns[:3]:
+        if isinstance(metric, list):
+            columns.extend(metric)
+        elif metric not in info.columns and '/' in metric:
+            columns.extend(metric.split('/'))
+        else:
+            columns.append(metric)
+    return _load_dataset_columns(dataset_id, columns), numeric_columns
+
+def _run_rerandomization(params, progress_callback=None):
+    """
+    执行种子搜索并构建 /rerandomization 的响应内容
+    """
+    df = params['df']
+    selected_metrics = params['selected_metrics']
+    metric_types = params['metric_types']
+    metric_types_list = params['metric_types_list']
+    userIdColumn = params['userIdColumn']
+    iterations = params['iterations']
+    groupProportions = params['groupProportions']
+    allocator = params['allocator']
+    control_group = params['control_group']
+    random_state = params['random_state']
+    workers = params['workers']
+    prune = params['prune']
+    engine = params['engine']
+    keep_bucket_cube = params['keep_bucket_cube']
+    criterion = params['criterion']
+    numeric_columns = params['numeric_columns']
+
+    # 执行重随机
+    search_result = experiment_analyzer.search_seeds(
+        df=df,
+        metrics=selected_metrics,
+        metric_types=metric_types_list,
+        unit_id=userIdColumn,
+        iterations=iterations,
+        group_proportions=allocator,
+        control_label=control_group,
+        random_state=random_state,
+        n_workers=workers,
+        prune=prune,
+        engine=engine,
+        keep_bucket_cube=keep_bucket_cube,
+        criterion=criterion,
+        progress_callback=progress_callback
+    )
+    best_seed = search_result.best_seed
+
+    # 使用最佳种子分配组别
+    df_with_groups = experiment_analyzer.assign_groups_with_seed(
+        df=df,
+        seed=best_seed,
+        unit_id=userIdColumn,
+        group_name='group_name',
+        group_proportions=allocator
+    )
+
+    # 计算最佳种子的显著性检验结果
+    best_seed_results = calculate_significance_tests(df_with_groups, selected_metrics, metric_types, groupProportions)
+
+    # 分布与前K名直接取自搜索结果：每个候选种子的最大|T|，以及前K名种子的逐指标T统计量
+    top_seeds = _format_top_seeds(search_result)
+
+    result = {
+        'bestSeed': best_seed,
+        'bestSeedResults': best_seed_results,  # 新增：最佳种子的显著性检验结果
+        'topSeeds': top_seeds,
+        **_score_distribution(search_result),
+        'groupProportions': groupProportions,
+        'selectedMetrics': selected_metrics,
+        'availableMetrics': numeric_columns,  # 新增：所有可用指标
+        'metricTypes': metric_types,
+        'randomState': search_result.random_state,
+        'criterion': search_result.criterion,  # allTStats/score 为该准则下的得分
+        'searchStats': {
+            'evaluatedSeeds': search_result.n_evaluated,
+            'prunedSeeds': search_result.n_pruned,
+            'pruneRate': search_result.prune_rate,
+            'metricsPerSeed': search_result.metrics_per_seed,
+            'metricCount': search_result.n_metrics,
+            'cacheHits': {
+                'seeds': search_result.cached_seeds,
+                'metricTests': search_result.cached_metric_evaluations
+            }
         }
-        
-        return jsonify(result)
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 400
+    }
 
-def calculate_significance_tests(df, metrics, metric_types, group_proportions):
+    if search_result.bucket_cube is not None:
+        cube_id = uuid.uuid4().hex
+        with bucket_cubes_lock:
+            bucket_cubes.put(cube_id, search_result.bucket_cube)
+        result['bucketCubeId'] = cube_id
+
+    return result
+
+def _score_distribution(search_result):
     """
-    计算显著性检验结果
+    候选种子的得分分布。开启 prune 时被提前淘汰的种子没有完整得分，allTStats 只含可能进入前K的种子，
+    此时 allTStatsTruncated 为 true，不能当作完整的零分布；totalIterations 始终为全部有效候选种子数
     """
-    results = {}
-    group_names = list(group_proportions.keys())
+    return {
+        'allTStats': search_result.score_distribution.tolist(),
+        'allTStatsTruncated': search_result.n_pruned > 0,
+        'totalIterations': search_result.n_evaluated,
+    }
+
+def _format_top_seeds(search_result):
+    """前K名种子的得分（搜索准则下）、最大|T|及逐指标、逐实验组的T统计量"""
+    top_seeds = []
+    for (seed, score), t_stats in zip(search_result.top_seeds, search_result.top_t_stats):
+        abs_t_stats = np.abs(t_stats)
+        top_seeds.append({
+            'seed': seed,
+            'score': score,
+            'maxTStat': None if np.isnan(abs_t_stats).all() else float(np.nanmax(abs_t_stats)),
+            'tStats': {
+                metric: {
+                    treatment: (None if np.isnan(t_stats[i, j]) else float(t_stats[i, j]))
+                    for j, treatment in enumerate(search_result.treatment_labels)
+                }
+                for i, metric in enumerate(search_result.metric_labels)
+            }
+        })
+    return top_seeds
+
+def _attach_segments(df, segment_by):
+    """
+    把请求中的维度取值（{"列名": {"group1": [...], "group2": [...]}}）加为 DataFrame 列
+    """
+    n_control = int((df['group_name'] == 'control').sum())
+    for column, values in segment_by.items():
+        group1_values, group2_values = values.get('group1', []), values.get('group2', [])
+        if len(group1_values) != n_control or len(group2_values) != len(df) - n_control:
+            raise ValueError(f'Segment "{column}" needs one value per observation of each group')
+        df[column] = list(group1_values) + list(group2_values)
+
+def _segment_breakdown(df, groupname, treated_label, control_label, metric, metric_type, segment_by, bh_correction):
+    """
+    各维度取值内的检验结果：所有维度组合在一次分组计算中完成，可选对全部维度检验做 BH 校正
+    """
+    results_df = experiment_analyzer.run_statistical_tests(df, [metric], [metric_type], groupname, [treated_label],
+                                                           control_label, segment_by=segment_by,
+                                                           bh_correction=bh_correction)
+    
+    def optional_float(value):
+        return float(value) if not np.isnan(value) else None
     
-    for i, metric in enumerate(metrics):
+    segments = []
+    for _, row in results_df.iterrows():
+        segment_result = {
+            'segment': {column: (row[column].item() if isinstance(row[column], np.generic) else row[column])
+                        for column in segment_by},
+            't_stat': optional_float(row['T_Statistic']),
+            'p_value': optional_float(row['P_Value']),
+            'significant': row['Significance'] == "显著",
+            'confidence_interval': [optional_float(v) for v in row['Confidence_Interval']],
+            'group1_mean': optional_float(row['Control_Value']),
+            'group2_mean': optional_float(row['Treatment_Value'])
+        }
+        if bh_correction:
+            segment_result['p_value_bh'] = optional_float(row['P_Value_BH'])
+            segment_result['significant_bh'] = row['Significance_BH'] == "显著"
+        segments.append(segment_result)
+    return segments
+
+def _resolve_metric_types(metrics, metric_types):
+    """
+    按指标顺序解析 metricTypes 字典，返回类型列表
+    """
+    metric_type_list = []
+    for metric in metrics:
         # 获取指标类型
         if isinstance(metric, list) and len(metric) == 2:
             # 数组格式的比率指标，需要在metricTypes中查找对应的JSON字符串键
-            metric_key = json.dumps(metric)
-            metric_type = metric_types.get(metric_key, 'ratio')
+            metric_type_list.append(metric_types.get(json.dumps(metric), 'ratio'))
         else:
             # 字符串格式的指标，直接在metric_types字典中查找
-            metric_type = metric_types.get(metric, 'mean')
-        
+            metric_type_list.append(metric_types.get(metric, 'mean'))
+    return metric_type_list
+
+def calculate_significance_tests(df, metrics, metric_types, group_proportions):
+    """
+    计算显著性检验结果
+    """
+    group_names = list(group_proportions.keys())
+    metric_type_list = _resolve_metric_types(metrics, metric_types)
+    
+    # 所有组别对 (group2 为实验组, group1 为对照组) 与所有指标在一次分组计算中完成
+    pairs = [(group_names[k], group_names[j])
+             for j in range(len(group_names)) for k in range(j + 1, len(group_names))]
+    table = experiment_analyzer.compare_groups(df, metrics, metric_type_list, 'group_name', pairs,
+                                               on_error='collect')
+    test_types = {'mean': "Welch's t-test", 'proportion': "Proportion test", 'ratio': "Ratio test (Delta method)"}
+    
+    def optional_float(value):
+        return float(value) if not np.isnan(value) else None
+    
+    results = {}
+    for i, (metric, metric_type) in enumerate(zip(metrics, metric_type_list)):
         # 为结果创建一个键，如果是数组格式，使用字符串表示
-        if isinstance(metric, list) and len(metric) == 2:
-            result_key = f"{metric[0]}/{metric[1]}"
-        else:
-            result_key = metric
-        
+        result_key = f"{metric[0]}/{metric[1]}" if isinstance(metric, list) and len(metric) == 2 else metric
         results[result_key] = {
             'metric_type': metric_type,
             'tests': []
         }
         
-        # 计算所有组别对之间的检验
-        for j in range(len(group_names)):
-            for k in range(j + 1, len(group_names)):
-                group1_name = group_names[j]
-                group2_name = group_names[k]
-                
-                try:
-                    if metric_type == 'mean':
-                        # 使用test_mean方法
-                        result = experiment_analyzer.test_mean(
-                            data=df,
-                            groupname='group_name',
-                            treated_label=group2_name,
-                            control_label=group1_name,
-                            test_metric=metric
-                        )
-                        test_result = {
-                            'group1': str(group1_name),
-                            'group2': str(group2_name),
-                            'test_type': "Welch's t-test",
-                            'statistic': float(result[4]) if not np.isnan(result[4]) else None,
-                            'p_value': float(result[5]) if not np.isnan(result[5]) else None,
-                            'significant': result[6] == "显著",
-                            'group1_mean': float(result[1]) if not np.isnan(result[1]) else None,
-                            'group2_mean': float(result[0]) if not np.isnan(result[0]) else None,
-                            'group1_size': int(len(df[df['group_name'] == group1_name][metric].dropna())),
-                            'group2_size': int(len(df[df['group_name'] == group2_name][metric].dropna()))
-                        }
-                        
-                    elif metric_type == 'proportion':
-                        # 使用test_proportion方法
-                        result = experiment_analyzer.test_proportion(
-                            data=df,
-                            groupname='group_name',
-                            treated_label=group2_name,
-                            control_label=group1_name,
-                            metric=metric
-                        )
-                        test_result = {
-                            'group1': str(group1_name),
-                            'group2': str(group2_name),
-                            'test_type': "Proportion test",
-                            'statistic': float(result[4]) if not np.isnan(result[4]) else None,
-                            'p_value': float(result[5]) if not np.isnan(result[5]) else None,
-                            'significant': result[6] == "显著",
-                            'group1_mean': float(result[1]) if not np.isnan(result[1]) else None,
-                            'group2_mean': float(result[0]) if not np.isnan(result[0]) else None,
-                            'group1_size': int(len(df[df['group_name'] == group1_name][metric].dropna())),
-                            'group2_size': int(len(df[df['group_name'] == group2_name][metric].dropna()))
-                        }
-                        
-                    elif metric_type == 'ratio':
-                        # 使用test_ratio方法
-                        if isinstance(metric, list) and len(metric) == 2:
-                            # 新的数组格式：[numerator, denominator]
-                            x_var, y_var = metric[0], metric[1]
-                        else:
-                            # 旧的字符串格式
-                            x_var, y_var = metric.split('/')
-                        
-                        result = experiment_analyzer.test_ratio(
-                            data=df,
-                            groupname='group_name',
-                            treated_label=group2_name,
-                            control_label=group1_name,
-                            x_var=x_var,
-                            y_var=y_var
-                        )
-                        test_result = {
-                            'group1': str(group1_name),
-                            'group2': str(group2_name),
-                            'test_type': "Ratio test (Delta method)",
-                            'statistic': float(result[4]) if not np.isnan(result[4]) else None,
-                            'p_value': float(result[5]) if not np.isnan(result[5]) else None,
-                            'significant': result[6] == "显著",
-                            'group1_mean': float(result[1]) if not np.isnan(result[1]) else None,
-                            'group2_mean': float(result[0]) if not np.isnan(result[0]) else None,
-                            'group1_size': int(len(df[df['group_name'] == group1_name][x_var].dropna())),
-                            'group2_size': int(len(df[df['group_name'] == group2_name][x_var].dropna()))
-                        }
-                    else:
-                        raise ValueError(f"Unknown metric type: {metric_type}")
-                    
-                    results[result_key]['tests'].append(test_result)
-                    
-                except Exception as e:
-                    # 如果测试失败，返回错误信息
-                    test_result = {
-                        'group1': str(group1_name),
-                        'group2': str(group2_name),
-                        'test_type': f"{metric_type.capitalize()} test",
-                        'statistic': None,
-                        'p_value': None,
-                        'significant': False,
-                        'error': str(e),
-                        'group1_mean': None,
-                        'group2_mean': None,
-                        'group1_size': 0,
-                        'group2_size': 0
-                    }
-                    results[result_key]['tests'].append(test_result)
+        # 结果表按组别对优先排列：第 p 个组别对的该指标位于 p * 指标数 + i
+        for e in range(i, len(table), len(metrics)):
+            group1_name, group2_name = table.control_labels[e], table.treated_labels[e]
+            if table.errors[e] is not None:
+                # 如果测试失败，返回错误信息
+                test_result = {
+                    'group1': str(group1_name),
+                    'group2': str(group2_name),
+                    'test_type': f"{metric_type.capitalize()} test",
+                    'statistic': None,
+                    'p_value': None,
+                    'significant': False,
+                    'error': table.errors[e],
+                    'group1_mean': None,
+                    'group2_mean': None,
+                    'group1_size': 0,
+                    'group2_size': 0
+                }
+            else:
+                test_result = {
+                    'group1': str(group1_name),
+                    'group2': str(group2_name),
+                    'test_type': test_types[metric_type],
+                    'statistic': optional_float(table.t_statistic[e]),
+                    'p_value': optional_float(table.p_value[e]),
+                    'significant': table.significance[e] == "显著",
+                    'group1_mean': optional_float(table.control_value[e]),
+                    'group2_mean': optional_float(table.treatment_value[e]),
+                    'group1_size': int(table.control_size[e]),
+                    'group2_size': int(table.treatment_size[e])
+                }
+            results[result_key]['tests'].append(test_result)
     
     return results
 
+@app.route('/assign', methods=['POST'])
+def assign():
+    """
+    批量分组：上传用户ID文件（CSV 或 NDJSON，可 gzip 压缩），
+    以流式 CSV 返回 unit_id,bucket,group，内存占用与用户数无关。
+    register=true 且配置了分桶存储时，视为实验上线：注册该实验并把分桶写入存储
+    """
+    try:
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'error': 'An ID file must be uploaded as "file"'}), 400
+        
+        # 提取参数（表单字段）
+        experiment_name = request.form.get('experiment_name') or request.form.get('seed')
+        group_proportions = json.loads(request.form.get('group_proportions', '{"control": 50, "treatment": 50}'))
+        id_column = request.form.get('id_column') or None
+        chunk_size = int(request.form.get('chunk_size', 100000))
+        file_format = request.form.get('format')
+        register = request.form.get('register', '').lower() in ('1', 'true', 'yes')
+        if not file_format:
+            filename = (upload.filename or '').lower()
+            file_format = 'ndjson' if filename.endswith(('.ndjson', '.ndjson.gz', '.jsonl', '.jsonl.gz')) else 'csv'
+        
+        if not experiment_name:
+            return jsonify({'error': 'experiment_name (or seed) is required'}), 400
+        
+        allocator = experiment_analyzer.get_allocator(group_proportions)
+        store = ExperimentAnalysisWithSeedFinder.assignment_store
+        if register and store is not None:
+            store.register(experiment_name)
+        # 请求结束时 Flask 会关闭上传文件，这里接管文件流，由生成器读完后自行关闭
+        id_stream, upload.stream = upload.stream, io.BytesIO()
+        # 开始返回200之前先完整解析一遍（只读ID、不哈希，内存仍只与块大小有关），
+        # 格式错误的行或损坏的 gzip 在这里返回400，而不是得到一个被截断的 CSV
+        n_units = sum(len(chunk) for chunk in iter_unit_id_chunks(id_stream, file_format, id_column, chunk_size))
+        id_stream.seek(0)
+        chunks = iter_unit_id_chunks(id_stream, file_format, id_column, chunk_size)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    
+    labels = np.array(allocator.labels, dtype=object)
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(['unit_id', 'bucket', 'group'])
+        try:
+            for chunk in chunks:
+                if register:
+                    # 已上线的实验经过分桶存储，按块追加新用户
+                    buckets = ExperimentAnalysisWithSeedFinder.apollo_bucket_bulk(
+                        experiment_name, np.asarray(chunk, dtype=object))
+                else:
+                    # 不经过分桶存储，保证内存占用只与块大小有关
+                    buckets = apollo_bucket_bulk(experiment_name, np.asarray(chunk, dtype=object))
+                groups = labels[allocator.codes_from_buckets(buckets)]
+                writer.writerows(zip(chunk, buckets.tolist(), groups.tolist()))
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        except Exception as e:
+            # 状态码已发出：以错误标记行结束，客户端据此（或按 X-Unit-Count 行数）识别不完整的结果
+            yield buffer.getvalue() + f'# error: {e}\n'
+        finally:
+            id_stream.close()
+    
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{experiment_name}_assignments.csv"',
+                             'X-Unit-Count': str(n_units)})
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
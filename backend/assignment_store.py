@@ -0,0 +1,435 @@
+"""
+Persistent assignment store
+持久化 (实验, 用户) -> 分桶 索引：只保存显式注册（上线）的实验，磁盘上按实验存放按键排序的用户ID
+（偏移量 + 字节块）与 uint8 分桶列，以内存映射方式打开，前面加一层进程内 LRU 缓存
+"""
+
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: segment names are still unique per process, only merging is unguarded
+    fcntl = None
+
+from bucketing import DEFAULT_CHUNK_SIZE, bucket_formatted_ids
+
+
+class LRUCache:
+    """Minimal thread-unsafe LRU mapping with a fixed maximum number of entries."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Query IDs are hashed and searched in chunks of this many IDs, bounding the per-byte index arrays
+_LOOKUP_CHUNK = 1 << 20
+# Multiplier of the polynomial byte hash behind the segment sort keys (64-bit FNV prime)
+_KEY_MULTIPLIER = np.uint64(1099511628211)
+_SEGMENT_FILES = ('keys', 'offsets', 'blob', 'buckets')
+
+
+class _Segment(NamedTuple):
+    """Unit IDs sorted by key: ``keys[i]`` is the key of ``blob[offsets[i]:offsets[i + 1]]``."""
+    keys: np.ndarray
+    offsets: np.ndarray
+    blob: np.ndarray
+    buckets: np.ndarray
+
+
+class AssignmentStore:
+    """
+    On-disk (experiment, unit) -> bucket index for registered experiments.
+
+    Only experiments registered with ``register`` (e.g. launched through /assign) are
+    stored; every other name, such as rerandomization seeds and what-if runs, is hashed
+    and never written, so the store grows with the experiments that were put live and
+    ``delete`` removes them again.
+
+    Each registered experiment owns a directory of immutable segments. A segment keeps
+    the unit IDs as one UTF-8 byte blob plus int64 offsets, sorted by a 64-bit key of
+    the bytes, and the aligned uint8 bucket column. Lookups binary-search the keys and
+    compare the bytes of every hit, so key collisions never return a wrong bucket.
+    Segment files are opened with np.load(mmap_mode='r'), so opening a store costs no
+    parsing. New IDs are written as a new segment named after its creation time,
+    process ID and a random suffix, so several server processes can append at once;
+    writing and merging (once an experiment has more than ``max_segments`` segments)
+    hold an exclusive file lock on the experiment directory.
+
+    In front of the files sit two bounded in-process LRU layers: one for opened
+    experiments (their segment maps) and one for single-unit lookups.
+    """
+
+    def __init__(self, root_dir: str, max_open_experiments: int = 16,
+                 max_cached_units: int = 100000, max_segments: int = 8,
+                 flush_threshold: int = 10000):
+        """
+        Args:
+            root_dir (str): Directory holding one sub-directory per experiment
+            max_open_experiments (int): Experiments whose segment maps stay open
+            max_cached_units (int): Capacity of the single-unit LRU cache
+            max_segments (int): Segment count that triggers a merge
+            flush_threshold (int): Pending single-unit assignments before they are written
+        """
+        self.root_dir = root_dir
+        self.max_segments = max_segments
+        self.flush_threshold = flush_threshold
+        self._segments = LRUCache(max_open_experiments)
+        self._units = LRUCache(max_cached_units)
+        self._pending: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.RLock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    # ------------------------------------------------------------------ registry
+
+    def register(self, experiment_name: str):
+        """Start storing the assignments of an experiment (idempotent)."""
+        exp_dir = self._experiment_dir(experiment_name)
+        os.makedirs(exp_dir, exist_ok=True)
+        meta_path = os.path.join(exp_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            tmp_path = f'{meta_path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'experiment_name': experiment_name}, f)
+            os.replace(tmp_path, meta_path)
+
+    def is_registered(self, experiment_name: str) -> bool:
+        return os.path.exists(os.path.join(self._experiment_dir(experiment_name), 'meta.json'))
+
+    def delete(self, experiment_name: str) -> bool:
+        """Unregister an experiment and remove its stored assignments; False if it was not registered."""
+        exp_dir = self._experiment_dir(experiment_name)
+        with self._lock:
+            self._segments.pop(experiment_name)
+            self._pending.pop(experiment_name, None)
+            if not self.is_registered(experiment_name):
+                return False
+            with _directory_lock(exp_dir):
+                os.remove(os.path.join(exp_dir, 'meta.json'))
+            shutil.rmtree(exp_dir, ignore_errors=True)
+            return True
+
+    # ------------------------------------------------------------------ lookup
+
+    def get_buckets(self, experiment_name: str, formatted_ids: List[str], n_workers: int = 1,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        """
+        Return buckets for already-formatted unit IDs, hashing and storing only new IDs.
+
+        IDs of experiments that are not registered are hashed without touching the disk.
+
+        Args:
+            experiment_name (str): Name of the experiment (or seed)
+            formatted_ids (List[str]): IDs as produced by bucketing.format_unit_ids
+            n_workers (int): Worker processes used to hash new IDs (1 = serial)
+            chunk_size (int): Number of IDs per task in parallel mode
+
+        Returns:
+            np.ndarray: uint8 buckets aligned with ``formatted_ids``
+        """
+        if not self.is_registered(experiment_name):
+            return bucket_formatted_ids(experiment_name, formatted_ids, n_workers, chunk_size)
+        with self._lock:
+            buckets, found = self._lookup(experiment_name, _encode(formatted_ids))
+            if not found.all():
+                rows = np.flatnonzero(~found)
+                missing = formatted_ids if len(rows) == len(found) else [formatted_ids[i] for i in rows]
+                buckets[rows] = bucket_formatted_ids(experiment_name, missing, n_workers, chunk_size)
+                self._write_segment(experiment_name, _unique(_sorted_segment(missing, buckets[rows])))
+        return buckets
+
+    def get_bucket(self, experiment_name: str, formatted_id: str) -> int:
+        """Single-unit lookup through the LRU layer; misses are hashed and buffered."""
+        if not self.is_registered(experiment_name):
+            return int(bucket_formatted_ids(experiment_name, [formatted_id])[0])
+        with self._lock:
+            bucket = self._units.get((experiment_name, formatted_id))
+            if bucket is not None:
+                return bucket
+            pending = self._pending.get(experiment_name, {})
+            bucket = pending.get(formatted_id)
+            if bucket is None:
+                stored, found = self._lookup(experiment_name, _encode([formatted_id]), include_pending=False)
+                if found[0]:
+                    bucket = int(stored[0])
+                else:
+                    bucket = int(bucket_formatted_ids(experiment_name, [formatted_id])[0])
+                    pending = self._pending.setdefault(experiment_name, {})
+                    pending[formatted_id] = bucket
+                    if len(pending) >= self.flush_threshold:
+                        self._flush_pending(experiment_name)
+            self._units.put((experiment_name, formatted_id), bucket)
+            return bucket
+
+    def flush(self):
+        """Write all buffered single-unit assignments to disk."""
+        with self._lock:
+            for experiment_name in list(self._pending):
+                self._flush_pending(experiment_name)
+
+    def size(self, experiment_name: str) -> int:
+        """Number of units stored on disk for an experiment."""
+        with self._lock:
+            return sum(len(segment.keys) for segment in self._open(experiment_name))
+
+    def _lookup(self, experiment_name: str, query: _Segment,
+                include_pending: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        n = len(query.keys)
+        buckets = np.zeros(n, dtype=np.uint8)
+        found = np.zeros(n, dtype=bool)
+        segments = list(self._open(experiment_name))
+        if include_pending and self._pending.get(experiment_name):
+            segments.append(self._pending_segment(experiment_name))
+        for start in range(0, n, _LOOKUP_CHUNK):
+            rows = np.arange(start, min(n, start + _LOOKUP_CHUNK))
+            for segment in segments:
+                todo = rows[~found[rows]]
+                if len(todo) == 0:
+                    break
+                positions, hit = _search(segment, query, todo)
+                buckets[todo[hit]] = segment.buckets[positions[hit]]
+                found[todo[hit]] = True
+        return buckets, found
+
+    # ------------------------------------------------------------------ storage
+
+    def _experiment_dir(self, experiment_name: str) -> str:
+        digest = hashlib.sha1(experiment_name.encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.root_dir, digest)
+
+    def _open(self, experiment_name: str) -> List[_Segment]:
+        segments = self._segments.get(experiment_name)
+        if segments is None:
+            segments = []
+            for keys_path in self._segment_paths(experiment_name):
+                prefix = keys_path[:-len('.keys.npy')]
+                try:
+                    segments.append(_Segment(*(np.load(f'{prefix}.{name}.npy', mmap_mode='r')
+                                               for name in _SEGMENT_FILES)))
+                except FileNotFoundError:
+                    # Merged away by another process; its IDs are in the merged segment
+                    continue
+            self._segments.put(experiment_name, segments)
+        return segments
+
+    def _write_segment(self, experiment_name: str, segment: _Segment):
+        exp_dir = self._experiment_dir(experiment_name)
+        try:
+            with _directory_lock(exp_dir):
+                if not self.is_registered(experiment_name):
+                    return
+                self._save_segment(experiment_name, segment)
+                if len(self._segment_paths(experiment_name)) > self.max_segments:
+                    self._compact(experiment_name)
+        except FileNotFoundError:
+            # Deleted concurrently: nothing to store
+            self._segments.pop(experiment_name)
+
+    def _compact(self, experiment_name: str):
+        """Merge all segments of an experiment into one; the caller holds the directory lock."""
+        self._segments.pop(experiment_name)
+        old_paths = self._segment_paths(experiment_name)
+        merged = _concat(self._open(experiment_name))
+        # The same ID may have been appended by several processes; keep one copy
+        self._save_segment(experiment_name, _unique(_take(merged, np.argsort(merged.keys, kind='stable'))))
+        for keys_path in old_paths:
+            prefix = keys_path[:-len('.keys.npy')]
+            for name in _SEGMENT_FILES:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(f'{prefix}.{name}.npy')
+        self._segments.pop(experiment_name)
+
+    def _save_segment(self, experiment_name: str, segment: _Segment):
+        name = f'seg_{time.time_ns():020d}_{os.getpid()}_{uuid.uuid4().hex[:8]}'
+        prefix = os.path.join(self._experiment_dir(experiment_name), name)
+        # 先写分桶列、偏移量与字节块，最后原子地放入键列；只有键文件存在的分段才会被读取
+        _atomic_save(prefix + '.buckets.npy', np.asarray(segment.buckets, dtype=np.uint8))
+        _atomic_save(prefix + '.offsets.npy', segment.offsets)
+        _atomic_save(prefix + '.blob.npy', segment.blob)
+        _atomic_save(prefix + '.keys.npy', segment.keys)
+        self._segments.pop(experiment_name)
+
+    def _segment_paths(self, experiment_name: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(self._experiment_dir(experiment_name), 'seg_*.keys.npy')))
+
+    def _pending_segment(self, experiment_name: str) -> _Segment:
+        pending = self._pending[experiment_name]
+        return _sorted_segment(list(pending), np.fromiter(pending.values(), dtype=np.uint8, count=len(pending)))
+
+    def _flush_pending(self, experiment_name: str):
+        if not self._pending.get(experiment_name):
+            return
+        segment = self._pending_segment(experiment_name)
+        del self._pending[experiment_name]
+        self._write_segment(experiment_name, segment)
+
+
+@contextlib.contextmanager
+def _directory_lock(exp_dir: str):
+    """Exclusive lock on an experiment directory shared by all server processes."""
+    fd = os.open(os.path.join(exp_dir, '.lock'), os.O_RDWR | os.O_CREAT)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _encode(formatted_ids: List[str]) -> _Segment:
+    """IDs as a UTF-8 blob with offsets and keys (in input order, without buckets)."""
+    joined = ''.join(formatted_ids)
+    if joined.isascii():
+        # One byte per character: encode once instead of per ID
+        lengths, data = map(len, formatted_ids), joined.encode('ascii')
+    else:
+        encoded = [s.encode('utf-8') for s in formatted_ids]
+        lengths, data = map(len, encoded), b''.join(encoded)
+    offsets = np.zeros(len(formatted_ids) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(lengths, dtype=np.int64, count=len(formatted_ids)), out=offsets[1:])
+    blob = np.frombuffer(data, dtype=np.uint8)
+    return _Segment(_key_hashes(offsets, blob), offsets, blob, None)
+
+
+def _sorted_segment(formatted_ids: List[str], buckets: np.ndarray) -> _Segment:
+    segment = _encode(formatted_ids)._replace(buckets=np.asarray(buckets, dtype=np.uint8))
+    return _take(segment, np.argsort(segment.keys, kind='stable'))
+
+
+def _unique(segment: _Segment) -> _Segment:
+    """Drop repeated IDs from a key-sorted segment (copies with equal keys and bytes that are adjacent)."""
+    adjacent = np.flatnonzero(segment.keys[1:] == segment.keys[:-1])
+    if len(adjacent) == 0:
+        return segment
+    duplicate = np.zeros(len(segment.keys), dtype=bool)
+    duplicate[adjacent[_same_bytes(segment, adjacent + 1, segment, adjacent)] + 1] = True
+    return _take(segment, np.flatnonzero(~duplicate))
+
+
+def _key_hashes(offsets: np.ndarray, blob: np.ndarray) -> np.ndarray:
+    """Vectorized 64-bit key of every ID: a polynomial hash of its bytes, finalized with splitmix64."""
+    n = len(offsets) - 1
+    keys = np.empty(n, dtype=np.uint64)
+    for start in range(0, n, _LOOKUP_CHUNK):
+        stop = min(n, start + _LOOKUP_CHUNK)
+        bounds = np.asarray(offsets[start:stop + 1])
+        lengths = np.diff(bounds)
+        h = np.zeros(stop - start, dtype=np.uint64)
+        if bounds[-1] > bounds[0]:
+            firsts = bounds[:-1] - bounds[0]
+            within = np.arange(bounds[-1] - bounds[0]) - np.repeat(firsts, lengths)
+            powers = np.full(int(lengths.max()), _KEY_MULTIPLIER, dtype=np.uint64)
+            powers[0] = 1
+            np.cumprod(powers, out=powers)
+            terms = (blob[bounds[0]:bounds[-1]].astype(np.uint64) + np.uint64(1)) * powers[within]
+            nonempty = lengths > 0
+            h[nonempty] = np.add.reduceat(terms, firsts[nonempty])
+        h ^= lengths.astype(np.uint64)
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xbf58476d1ce4e5b9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94d049bb133111eb)
+        h ^= h >> np.uint64(31)
+        keys[start:stop] = h
+    return keys
+
+
+def _same_bytes(a: _Segment, a_rows: np.ndarray, b: _Segment, b_rows: np.ndarray) -> np.ndarray:
+    """Whether ID ``a_rows[i]`` of ``a`` has the same bytes as ID ``b_rows[i]`` of ``b``."""
+    a_start = np.asarray(a.offsets[a_rows])
+    b_start = np.asarray(b.offsets[b_rows])
+    lengths = np.asarray(a.offsets[a_rows + 1]) - a_start
+    same = lengths == np.asarray(b.offsets[b_rows + 1]) - b_start
+    rows = np.flatnonzero(same & (lengths > 0))
+    if len(rows):
+        lengths = lengths[rows]
+        firsts = np.cumsum(lengths) - lengths
+        within = np.arange(firsts[-1] + lengths[-1]) - np.repeat(firsts, lengths)
+        equal = (a.blob[np.repeat(a_start[rows], lengths) + within]
+                 == b.blob[np.repeat(b_start[rows], lengths) + within])
+        same[rows] = np.logical_and.reduceat(equal, firsts)
+    return same
+
+
+def _search(segment: _Segment, query: _Segment, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions in ``segment`` of the query IDs ``rows`` and whether each was found."""
+    keys = query.keys[rows]
+    # Sorted needles keep the binary searches cache-friendly
+    order = np.argsort(keys)
+    positions = np.empty(len(rows), dtype=np.int64)
+    positions[order] = np.searchsorted(segment.keys, keys[order])
+    hit = np.zeros(len(rows), dtype=bool)
+    candidates = np.flatnonzero(positions < len(segment.keys))
+    candidates = candidates[segment.keys[positions[candidates]] == keys[candidates]]
+    same = _same_bytes(segment, positions[candidates], query, rows[candidates])
+    hit[candidates[same]] = True
+    # Key collisions: the ID may sit further along the run of equal keys
+    for i in candidates[~same]:
+        position = positions[i] + 1
+        while position < len(segment.keys) and segment.keys[position] == keys[i]:
+            if _same_bytes(segment, np.array([position]), query, rows[i:i + 1])[0]:
+                positions[i], hit[i] = position, True
+                break
+            position += 1
+    return positions, hit
+
+
+def _take(segment: _Segment, order: np.ndarray) -> _Segment:
+    """Segment with the IDs at ``order`` (blob and offsets rebuilt)."""
+    starts = np.asarray(segment.offsets[order])
+    lengths = np.asarray(segment.offsets[order + 1]) - starts
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    within = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+    blob = np.asarray(segment.blob)[np.repeat(starts, lengths) + within]
+    buckets = None if segment.buckets is None else np.asarray(segment.buckets)[order]
+    return _Segment(np.asarray(segment.keys)[order], offsets, blob, buckets)
+
+
+def _concat(segments: List[_Segment]) -> _Segment:
+    shifts = np.cumsum([0] + [len(segment.blob) for segment in segments])
+    offsets = [np.asarray(segment.offsets[:-1]) + shift for segment, shift in zip(segments, shifts)]
+    return _Segment(np.concatenate([np.asarray(segment.keys) for segment in segments] + [np.empty(0, np.uint64)]),
+                    np.concatenate(offsets + [np.array([shifts[-1]], dtype=np.int64)]),
+                    np.concatenate([np.asarray(segment.blob) for segment in segments] + [np.empty(0, np.uint8)]),
+                    np.concatenate([np.asarray(segment.buckets) for segment in segments] + [np.empty(0, np.uint8)]))
+
+
+def _atomic_save(path: str, array: np.ndarray):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+性能基准脚本
+用法: python benchmark.py bucketing --n 1000000
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from accumulators import ExperimentAccumulator
+from experiment_analysis_with_seedfinder import ExperimentAnalysisWithSeedFinder
+from group_stats import RESULT_MODES, GroupedMetricStats, critical_values
+from seed_search import SeedEvaluator, search_seeds, search_seeds_streaming
+
+SEARCH_METRICS = ['gmv', 'converted', ['orders', 'sessions']]
+SEARCH_METRIC_TYPES = ['mean', 'proportion', 'ratio']
+SEARCH_PROPORTIONS = {'control': 40, 'treatment_a': 30, 'treatment_b': 30}
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_bucketing(n: int):
+    """标量 apollo_bucket 与批量 apollo_bucket_bulk 的吞吐量对比"""
+    ids = np.random.default_rng(0).integers(10**9, 10**10, size=n)
+    id_list = ids.tolist()
+
+    scalar, scalar_time = _timed(
+        lambda: [ExperimentAnalysisWithSeedFinder.apollo_bucket('bench_exp', x) for x in id_list]
+    )
+    bulk, bulk_time = _timed(ExperimentAnalysisWithSeedFinder.apollo_bucket_bulk, 'bench_exp', ids)
+    assert bulk.tolist() == scalar
+
+    print(f"IDs: {n}")
+    print(f"  scalar apollo_bucket : {n / scalar_time:,.0f} IDs/sec")
+    print(f"  apollo_bucket_bulk   : {n / bulk_time:,.0f} IDs/sec ({scalar_time / bulk_time:.1f}x)")
+
+
+def bench_parallel_bucketing(n: int):
+    """多进程分块分桶在 1/2/4/8 个 worker 下的扩展性"""
+    ids = np.random.default_rng(0).integers(10**9, 10**10, size=n)
+    chunk_size = max(1, n // 32)
+    serial, serial_time = _timed(ExperimentAnalysisWithSeedFinder.apollo_bucket_bulk, 'bench_exp', ids)
+
+    print(f"IDs: {n}, chunk_size: {chunk_size}, cpu_count: {os.cpu_count()}")
+    print(f"  serial    : {n / serial_time:,.0f} IDs/sec")
+    for n_workers in (1, 2, 4, 8):
+        buckets, elapsed = _timed(
+            ExperimentAnalysisWithSeedFinder.apollo_bucket_bulk, 'bench_exp', ids,
+            n_workers=n_workers, chunk_size=chunk_size
+        )
+        assert np.array_equal(buckets, serial)
+        print(f"  workers={n_workers}: {n / elapsed:,.0f} IDs/sec ({serial_time / elapsed:.2f}x)")
+
+
+def make_search_dataset(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'user_id': [f'user_{i:09d}' for i in range(n)],
+        'gmv': rng.lognormal(4, 1, n),
+        'converted': rng.integers(0, 2, n),
+        'orders': rng.poisson(3, n).astype(float),
+        'sessions': rng.poisson(10, n) + 1.0,
+    })
+
+
+def bench_seed_evaluation(n: int, seeds: int = 20):
+    """每个候选种子的评估耗时：旧的 DataFrame 路径 vs 充分统计量路径"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_search_dataset(n)
+    allocator = analyzer.get_allocator(SEARCH_PROPORTIONS)
+    candidates = [f'rr{i}' for i in range(seeds)]
+
+    def legacy(seed):
+        df_copy = analyzer.assign_groups_with_seed(df, seed, 'user_id', 'group_name', allocator)
+        stats_df = analyzer.run_statistical_tests(
+            df_copy, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'group_name', ['treatment_a', 'treatment_b'], 'control'
+        )
+        return stats_df['T_Statistic'].abs().max()
+
+    evaluator, setup_time = _timed(
+        SeedEvaluator, df, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'user_id', allocator, 'control'
+    )
+    _, legacy_time = _timed(lambda: [legacy(seed) for seed in candidates])
+    _, engine_time = _timed(lambda: [evaluator.score(seed) for seed in candidates])
+
+    print(f"units: {n}, seeds: {seeds}")
+    print(f"  DataFrame path       : {legacy_time / seeds * 1000:.1f} ms/seed")
+    print(f"  sufficient statistics: {engine_time / seeds * 1000:.1f} ms/seed "
+          f"({legacy_time / engine_time:.1f}x, one-off setup {setup_time * 1000:.0f} ms)")
+
+
+def bench_pruning(n: int, iterations: int = 512):
+    """剪枝模式：相同结果下跳过的指标检验数量与耗时"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_search_dataset(n)
+    df['gmv_7d'] = df['gmv'] * 0.3 + np.random.default_rng(1).lognormal(3, 1, n)
+    df['orders_7d'] = np.random.default_rng(2).poisson(1, n).astype(float)
+    metrics = SEARCH_METRICS + ['gmv_7d', 'orders_7d']
+    metric_types = SEARCH_METRIC_TYPES + ['mean', 'mean']
+    evaluator = SeedEvaluator(df, metrics, metric_types, 'user_id',
+                              analyzer.get_allocator(SEARCH_PROPORTIONS), 'control')
+
+    full, full_time = _timed(search_seeds, evaluator, iterations, random_state=1)
+    pruned, pruned_time = _timed(search_seeds, evaluator, iterations, random_state=1, prune=True)
+    assert [s for s, _ in full.top_seeds] == [s for s, _ in pruned.top_seeds]
+
+    print(f"units: {n}, seeds: {iterations}, metrics: {len(metrics)}")
+    print(f"  full evaluation: {full_time:.2f}s")
+    print(f"  pruned         : {pruned_time:.2f}s ({full_time / pruned_time:.2f}x), "
+          f"prune rate {pruned.prune_rate:.1%}, {pruned.metrics_per_seed:.2f} metrics/seed")
+
+
+def bench_batched_kernel(n: int, iterations: int = 1024):
+    """逐种子引擎与批量多种子核（units x seeds 分块）的吞吐量对比"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    evaluator = SeedEvaluator(make_search_dataset(n), SEARCH_METRICS, SEARCH_METRIC_TYPES, 'user_id',
+                              analyzer.get_allocator(SEARCH_PROPORTIONS), 'control')
+    per_seed, per_seed_time = _timed(search_seeds, evaluator, iterations, random_state=1, engine='per-seed')
+    batched, batched_time = _timed(search_seeds, evaluator, iterations, random_state=1, engine='batched')
+    assert per_seed.top_seeds == batched.top_seeds
+
+    print(f"units: {n}, seeds: {iterations}")
+    print(f"  per-seed: {iterations / per_seed_time:,.1f} seeds/sec")
+    print(f"  batched : {iterations / batched_time:,.1f} seeds/sec ({per_seed_time / batched_time:.2f}x)")
+
+
+def bench_criterion(n: int, iterations: int = 1024):
+    """相同候选预算下 max-t 与马氏距离准则的耗时，以及各自最佳种子在两种准则下的得分"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_search_dataset(n)
+    df['arpu'] = df['gmv'] / df['sessions'] + np.random.default_rng(3).normal(0, 1, n)
+    metrics = SEARCH_METRICS + ['arpu']
+    metric_types = SEARCH_METRIC_TYPES + ['mean']
+    evaluator = SeedEvaluator(df, metrics, metric_types, 'user_id',
+                              analyzer.get_allocator(SEARCH_PROPORTIONS), 'control')
+    _, covariance_time = _timed(evaluator.inverse_covariance)
+
+    print(f"units: {n}, seeds: {iterations}, metrics: {len(metrics)}, "
+          f"covariance setup {covariance_time * 1000:.0f} ms")
+    for criterion in ('max-t', 'mahalanobis'):
+        result, elapsed = _timed(search_seeds, evaluator, iterations, random_state=1, criterion=criterion)
+        max_t = evaluator.score(result.best_seed)
+        distance = evaluator.mahalanobis_score(result.best_seed)
+        print(f"  {criterion:<11}: {elapsed:.2f}s ({iterations / elapsed:,.1f} seeds/sec), best {result.best_seed}: "
+              f"max|t| {max_t:.4f}, Mahalanobis {distance:.4f}")
+
+
+def bench_rerank(n: int, iterations: int = 2048):
+    """修改分组比例：从分桶立方体重新排序 vs 按新比例重新搜索"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_search_dataset(n)
+    new_proportions = {'control': 10, 'treatment_a': 10, 'treatment_b': 80}
+    search_kwargs = dict(random_state=1, progress_callback=lambda progress: None)
+    result = analyzer.search_seeds(df, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'user_id', iterations,
+                                   SEARCH_PROPORTIONS, keep_bucket_cube=True, **search_kwargs)
+    reranked, rerank_time = _timed(analyzer.rerank_seeds, result, new_proportions)
+    fresh, search_time = _timed(analyzer.search_seeds, df, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'user_id',
+                                iterations, new_proportions, **search_kwargs)
+    assert reranked.top_seeds[0][0] == fresh.best_seed
+
+    print(f"units: {n}, seeds: {iterations}, cube: {result.bucket_cube.nbytes / 2**20:.1f} MiB")
+    print(f"  new search: {search_time:.2f}s")
+    print(f"  rerank    : {rerank_time * 1000:.1f} ms ({search_time / rerank_time:,.0f}x)")
+
+
+def bench_accumulators(n: int, days: int = 30):
+    """每日增量分析：对累计数据整体重算 vs 只折叠当天数据到累加器后检验"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_search_dataset(n)
+    df['group_name'] = np.random.default_rng(4).choice(list(SEARCH_PROPORTIONS), n)
+    day_rows = np.array_split(np.arange(n), days)
+    treated = ['treatment_a', 'treatment_b']
+    state = ExperimentAccumulator(SEARCH_METRICS, SEARCH_METRIC_TYPES)
+    for rows in day_rows[:-1]:
+        state.update(df.iloc[rows], 'group_name')
+    blob = state.to_bytes()
+
+    def incremental():
+        today = ExperimentAccumulator.from_bytes(blob).update(df.iloc[day_rows[-1]], 'group_name')
+        return analyzer.run_statistical_tests(today, SEARCH_METRICS, SEARCH_METRIC_TYPES, None, treated, 'control')
+
+    full, full_time = _timed(analyzer.run_statistical_tests, df, SEARCH_METRICS, SEARCH_METRIC_TYPES,
+                             'group_name', treated, 'control')
+    folded, folded_time = _timed(incremental)
+    assert np.allclose(full['T_Statistic'], folded['T_Statistic'], atol=1e-6)
+
+    print(f"units: {n}, days: {days}, state: {len(blob)} bytes")
+    print(f"  full re-analysis : {full_time * 1000:.1f} ms")
+    print(f"  fold one day     : {folded_time * 1000:.1f} ms ({full_time / folded_time:.1f}x)")
+
+
+def bench_bootstrap(n: int, replicates: int = 1000):
+    """Poisson 权重 bootstrap（批量加权归约）vs 逐次重抽样 DataFrame 的朴素 bootstrap"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_search_dataset(n)
+    df['group_name'] = np.random.default_rng(4).choice(list(SEARCH_PROPORTIONS), n)
+    treated = ['treatment_a', 'treatment_b']
+    naive_replicates = 20
+
+    def naive():
+        rng = np.random.default_rng(0)
+        for _ in range(naive_replicates):
+            sample = df.iloc[rng.integers(0, n, n)]
+            analyzer.run_statistical_tests(sample, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'group_name',
+                                           treated, 'control')
+
+    _, naive_time = _timed(naive)
+    result, poisson_time = _timed(analyzer.bootstrap_tests, df, SEARCH_METRICS, SEARCH_METRIC_TYPES,
+                                  'group_name', treated, 'control', n_replicates=replicates, random_state=1)
+    naive_per_replicate = naive_time / naive_replicates
+    print(f"units: {n}, replicates: {replicates}")
+    print(f"  naive resampling : {naive_per_replicate * 1000:.1f} ms/replicate "
+          f"({naive_per_replicate * replicates:.1f}s for {replicates})")
+    print(f"  Poisson bootstrap: {poisson_time / replicates * 1000:.2f} ms/replicate ({poisson_time:.1f}s, "
+          f"{naive_per_replicate * replicates / poisson_time:.1f}x)")
+
+
+def bench_permutation(n: int, permutations: int = 1000):
+    """置换组编码 + 批量矩阵归约的置换检验 vs 逐次打乱 DataFrame 调用 run_statistical_tests 的朴素置换检验"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_search_dataset(n)
+    df['group_name'] = np.random.default_rng(4).choice(list(SEARCH_PROPORTIONS), n)
+    treated = ['treatment_a', 'treatment_b']
+    naive_permutations = 20
+
+    def naive():
+        rng = np.random.default_rng(0)
+        shuffled = df.copy()
+        for _ in range(naive_permutations):
+            shuffled['group_name'] = rng.permutation(df['group_name'].to_numpy())
+            analyzer.run_statistical_tests(shuffled, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'group_name',
+                                           treated, 'control')
+
+    _, naive_time = _timed(naive)
+    full, full_time = _timed(analyzer.permutation_tests, df, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'group_name',
+                             treated, 'control', max_permutations=permutations, stopping_confidence=None,
+                             random_state=1)
+    early, early_time = _timed(analyzer.permutation_tests, df, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'group_name',
+                               treated, 'control', max_permutations=permutations, random_state=1)
+    naive_per_permutation = naive_time / naive_permutations
+    print(f"units: {n}, permutations: {permutations} per treatment group")
+    print(f"  naive shuffling : {naive_per_permutation * 1000:.1f} ms/permutation "
+          f"({naive_per_permutation * permutations:.1f}s for {permutations})")
+    print(f"  group-code perm : {full_time / permutations * 1000:.2f} ms/permutation ({full_time:.1f}s, "
+          f"{naive_per_permutation * permutations / full_time:.1f}x)")
+    print(f"  early stopping  : {early_time:.2f}s, permutations used {early.n_permutations.tolist()}")
+
+
+def bench_result_modes(n: int, calls: int = 2000):
+    """单次检验调用：完整结果（p 值、临界值、置信区间）vs 只算统计量的 stats 模式；按自由度缓存临界值的命中率"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_search_dataset(min(n, 10000))
+    df['group_name'] = np.random.default_rng(4).choice(['control', 'treatment'], len(df))
+    engine = GroupedMetricStats(df, 'group_name', SEARCH_METRICS, SEARCH_METRIC_TYPES)
+    print(f"units: {len(df)}, calls: {calls}")
+    for mode in RESULT_MODES:
+        _, call_time = _timed(lambda: [analyzer.test_mean(df, 'group_name', 'treatment', 'control', 'gmv',
+                                                          result=mode) for _ in range(calls)])
+        _, compare_time = _timed(lambda: [engine.compare([('treatment', 'control')], result=mode)
+                                          for _ in range(calls)])
+        print(f"  {mode:<5}: test_mean {call_time / calls * 1e6:.0f} us/call, "
+              f"compare {compare_time / calls * 1e6:.0f} us/call")
+
+    # 实验数据逐步增长时反复分析：统计按自由度取键的临界值缓存能命中的比例
+    looks = min(calls, 500)
+    dof = np.concatenate([
+        GroupedMetricStats(df.iloc[:len(df) // 2 + i], 'group_name', SEARCH_METRICS, SEARCH_METRIC_TYPES)
+        .compare([('treatment', 'control')], result='stats').dof for i in range(looks)])
+    dof = dof[~np.isnan(dof)]
+    _, direct_time = _timed(lambda: [critical_values(0.05, True, dof[i:i + 2]) for i in range(0, len(dof), 2)])
+    print(f"critical values over {looks} looks at a growing dataset: "
+          f"{direct_time / looks * 1e6:.1f} us/look computed directly")
+    for decimals in (10, 2, 0):
+        hit_rate = 1 - len(np.unique(np.round(dof, decimals))) / len(dof)
+        print(f"  cache keyed on df rounded to {decimals:>2} decimals: hit rate {hit_rate:.1%}")
+
+
+def bench_segments(n: int):
+    """逐维度过滤后重复 run_statistical_tests vs segment_by 一次分组计算全部维度"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_search_dataset(n)
+    rng = np.random.default_rng(4)
+    df['group_name'] = rng.choice(list(SEARCH_PROPORTIONS), n)
+    df['platform'] = rng.choice(['ios', 'android', 'web'], n)
+    df['city_tier'] = rng.choice([1, 2, 3, 4], n)
+    df['new_user'] = rng.choice([True, False], n)
+    segment_by = ['platform', 'city_tier', 'new_user']
+    treated = ['treatment_a', 'treatment_b']
+
+    def filtered():
+        results = []
+        for platform, city_tier, new_user in df[segment_by].drop_duplicates().itertuples(index=False):
+            rows = df[(df['platform'] == platform) & (df['city_tier'] == city_tier) & (df['new_user'] == new_user)]
+            results.append(analyzer.run_statistical_tests(rows, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'group_name',
+                                                          treated, 'control'))
+        return results
+
+    per_segment, filtered_time = _timed(filtered)
+    one_pass, one_pass_time = _timed(analyzer.run_statistical_tests, df, SEARCH_METRICS, SEARCH_METRIC_TYPES,
+                                     'group_name', treated, 'control', segment_by=segment_by, bh_correction=True)
+    assert len(one_pass) == sum(len(results) for results in per_segment)
+    print(f"units: {n}, segments: {len(per_segment)}, tests: {len(one_pass)}")
+    print(f"  filter per segment: {filtered_time:.2f}s")
+    print(f"  segment_by        : {one_pass_time:.2f}s ({filtered_time / one_pass_time:.1f}x)")
+
+
+def bench_datasets(n: int, repeats: int = 3):
+    """每次请求携带 JSON 行数据 vs 先注册数据集、之后按 dataset_id 内存映射读取的重随机请求耗时"""
+    import app
+    from dataset_store import DatasetStore
+
+    df = make_search_dataset(n)
+    rows = df.to_dict(orient='records')
+    body = {'selectedMetrics': ['gmv', 'converted'], 'metricTypes': {'gmv': 'mean', 'converted': 'proportion'},
+            'userIdColumn': 'user_id', 'iterations': 1, 'randomState': 1}
+    payload = json.dumps({**body, 'data': rows})
+    client = app.app.test_client()
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.redirect_stdout(io.StringIO()):
+        app.dataset_store = DatasetStore(tmp_dir)
+        created, upload_time = _timed(client.post, '/datasets', data=json.dumps({'data': rows, 'userIdColumn': 'user_id'}),
+                                      content_type='application/json')
+        dataset_id = created.get_json()['dataset_id']
+        # 请求准备（JSON 解析、建表、列类型探测与清洗）与完整请求（含 1 个种子的搜索与分组）
+        _, inline_prepare = _timed(lambda: [app._prepare_rerandomization(json.loads(payload), 1)
+                                            for _ in range(repeats)])
+        _, registered_prepare = _timed(lambda: [app._prepare_rerandomization({**body, 'datasetId': dataset_id}, 1)
+                                                for _ in range(repeats)])
+        _, inline_time = _timed(lambda: [client.post('/rerandomization', data=payload, content_type='application/json')
+                                         for _ in range(repeats)])
+        _, registered_time = _timed(lambda: [client.post('/rerandomization', json={**body, 'datasetId': dataset_id})
+                                             for _ in range(repeats)])
+    print(f"units: {n}, payload {len(payload) / 2**20:.0f} MiB, one-time upload {upload_time:.2f}s")
+    print(f"  inline rows : prepare {inline_prepare / repeats:.3f}s, request {inline_time / repeats:.2f}s")
+    print(f"  dataset_id  : prepare {registered_prepare / repeats:.3f}s ({inline_prepare / registered_prepare:.0f}x), "
+          f"request {registered_time / repeats:.2f}s")
+
+
+def bench_streaming(n: int, iterations: int = 256):
+    """分块文件搜索与内存搜索的耗时与峰值内存（tracemalloc）对比"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    allocator = analyzer.get_allocator(SEARCH_PROPORTIONS)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'units.csv')
+        make_search_dataset(n).to_csv(path, index=False)
+
+        def in_memory():
+            evaluator = SeedEvaluator(pd.read_csv(path, dtype={'user_id': str}), SEARCH_METRICS,
+                                      SEARCH_METRIC_TYPES, 'user_id', allocator, 'control')
+            return search_seeds(evaluator, iterations, random_state=1)
+
+        def streaming():
+            return search_seeds_streaming(path, SEARCH_METRICS, SEARCH_METRIC_TYPES, 'user_id', allocator,
+                                          'control', iterations, random_state=1, chunk_size=50000)
+
+        print(f"units: {n}, seeds: {iterations}")
+        for name, run in (('in-memory', in_memory), ('streaming', streaming)):
+            tracemalloc.start()
+            result, elapsed = _timed(run)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {name:<10}: {elapsed:.2f}s, peak {peak / 2**20:.0f} MiB, best {result.best_seed}")
+
+
+BENCHMARKS = {
+    'bucketing': bench_bucketing,
+    'parallel-bucketing': bench_parallel_bucketing,
+    'seed-evaluation': bench_seed_evaluation,
+    'pruning': bench_pruning,
+    'batched-kernel': bench_batched_kernel,
+    'rerank': bench_rerank,
+    'criterion': bench_criterion,
+    'accumulators': bench_accumulators,
+    'bootstrap': bench_bootstrap,
+    'permutation': bench_permutation,
+    'result-modes': bench_result_modes,
+    'segments': bench_segments,
+    'datasets': bench_datasets,
+    'streaming': bench_streaming,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AB Testing Toolbox benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--n', type=int, default=1_000_000, help='number of units')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args.n)
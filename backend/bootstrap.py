@@ -0,0 +1,231 @@
+"""
+Poisson bootstrap
+泊松权重 bootstrap：每个重抽样是一次加权归约（权重矩阵 × 值矩阵）而不是按索引取样，
+权重按 (行块, 重抽样块) 确定性生成，结果与分块大小、进程数和内存预算无关，支持流式分块输入
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from chunked_input import DEFAULT_STREAM_CHUNK_SIZE, ChunkSource, iter_dataframe_chunks
+from sufficient_stats import MomentLayout
+
+DEFAULT_BOOTSTRAP_REPLICATES = 1000
+# Budget for the weight matrices materialized at once (per process)
+DEFAULT_BOOTSTRAP_MEMORY = 64 * 2 ** 20
+# Weights are generated per (row block, replicate block) from SeedSequence(random_state, spawn_key=(row block, replicate block))
+ROW_BLOCK = 8192
+REPLICATE_BLOCK = 64
+
+# Inverse CDF of Poisson(1) on a 2^-16 grid: a random uint16 indexes the weight (5x faster than Generator.poisson)
+_POISSON_TABLE = np.searchsorted(stats.poisson.cdf(np.arange(16), 1.0),
+                                 (np.arange(2 ** 16) + 0.5) / 2 ** 16, side='right').astype(np.uint8)
+
+
+@dataclass
+class BootstrapResult:
+    """
+    Poisson-bootstrap distribution of every treatment-vs-control difference, one entry
+    per (pair, metric) in pair-major order (the order of run_statistical_tests).
+
+    Attributes:
+        treated_labels, control_labels (List): Groups of every entry
+        metrics (List): Metric of every entry
+        metric_types (List[str]): Metric type of every entry
+        treatment_value, control_value, absolute_diff (np.ndarray): Full-sample estimates
+        standard_error (np.ndarray): Standard deviation of the replicate differences
+        ci_lower, ci_upper (np.ndarray): Percentile confidence interval of the difference
+        replicates (np.ndarray): Replicate differences, shape (n_replicates, entries)
+        random_state (int): Master seed of the weights
+    """
+    treated_labels: List
+    control_labels: List
+    metrics: List
+    metric_types: List[str]
+    treatment_value: np.ndarray
+    control_value: np.ndarray
+    absolute_diff: np.ndarray
+    standard_error: np.ndarray
+    ci_lower: np.ndarray
+    ci_upper: np.ndarray
+    replicates: np.ndarray
+    random_state: int
+
+    @property
+    def n_replicates(self) -> int:
+        return self.replicates.shape[0]
+
+
+def poisson_weights(random_state: int, row_block: int, replicate_block: int) -> np.ndarray:
+    """Poisson(1) weights of one (row block, replicate block), shape (REPLICATE_BLOCK, ROW_BLOCK), uint8."""
+    rng = np.random.default_rng(np.random.SeedSequence(random_state, spawn_key=(row_block, replicate_block)))
+    bits = rng.bit_generator.random_raw(REPLICATE_BLOCK * ROW_BLOCK // 4).view(np.uint16)
+    return _POISSON_TABLE[bits].reshape(REPLICATE_BLOCK, ROW_BLOCK)
+
+
+def bootstrap_columns(df: pd.DataFrame, layout: MomentLayout) -> np.ndarray:
+    """
+    N x 2M matrix whose weighted column sums give every metric estimate as a ratio.
+
+    Metric i owns columns (2i, 2i + 1): (x, 1) for mean and proportion metrics and
+    (x, y) for ratio metrics, with missing values contributing 0 to both, so the
+    weighted estimate is column 2i / column 2i + 1 (a mean over non-missing values,
+    or Σx / Σy).
+    """
+    values = np.zeros((len(df), 2 * layout.n_metrics))
+    for i, ((x_col, y_col), metric_type) in enumerate(zip(layout.sources, layout.metric_types)):
+        x = df[x_col].to_numpy(dtype=np.float64, na_value=np.nan)
+        if metric_type == 'ratio':
+            y = df[y_col].to_numpy(dtype=np.float64, na_value=np.nan)
+            values[:, 2 * i + 1] = np.nan_to_num(y)
+        else:
+            values[:, 2 * i + 1] = ~np.isnan(x)
+        values[:, 2 * i] = np.nan_to_num(x)
+    return values
+
+
+def bootstrap_chunk_sums(values: np.ndarray, codes: np.ndarray, offset: int, n_groups: int,
+                         n_replicates: int, random_state: int,
+                         memory_budget: int = DEFAULT_BOOTSTRAP_MEMORY) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-group weighted column sums of one chunk for every replicate.
+
+    Args:
+        values (np.ndarray): Chunk of the bootstrap_columns matrix, N x K
+        codes (np.ndarray): Group code per row (-1 = row not in any compared group)
+        offset (int): Global index of the chunk's first row (selects the weight blocks)
+        n_groups (int): Number of group codes
+        n_replicates (int): Number of replicates
+        random_state (int): Master seed of the weights
+        memory_budget (int): Bytes of weight matrices materialized at once
+
+    Returns:
+        Tuple of replicate sums (n_replicates, G, K) and unweighted sums (G, K)
+    """
+    n_columns = values.shape[1]
+    # One-hot expansion: column block g holds the values of group g's rows, so one
+    # matrix product yields the sums of every group
+    expanded = np.zeros((len(values), n_groups * n_columns))
+    for g in range(n_groups):
+        rows = codes == g
+        expanded[rows, g * n_columns:(g + 1) * n_columns] = values[rows]
+    point = expanded.sum(axis=0).reshape(n_groups, n_columns)
+
+    n_blocks = -(-n_replicates // REPLICATE_BLOCK)
+    blocks_per_pass = max(1, memory_budget // (REPLICATE_BLOCK * ROW_BLOCK * 9))
+    sums = np.zeros((n_blocks * REPLICATE_BLOCK, n_groups * n_columns))
+    first_block, stop = offset // ROW_BLOCK, offset + len(values)
+    for row_block in range(first_block, -(-stop // ROW_BLOCK)):
+        start = max(offset, row_block * ROW_BLOCK)
+        end = min(stop, (row_block + 1) * ROW_BLOCK)
+        block_values = expanded[start - offset:end - offset]
+        columns = slice(start - row_block * ROW_BLOCK, end - row_block * ROW_BLOCK)
+        for first in range(0, n_blocks, blocks_per_pass):
+            blocks = range(first, min(n_blocks, first + blocks_per_pass))
+            weights = np.concatenate([poisson_weights(random_state, row_block, b)[:, columns] for b in blocks])
+            sums[first * REPLICATE_BLOCK:(blocks[-1] + 1) * REPLICATE_BLOCK] += weights @ block_values
+    return sums[:n_replicates].reshape(n_replicates, n_groups, n_columns), point
+
+
+def _bootstrap_chunk_task(args) -> Tuple[np.ndarray, np.ndarray]:
+    return bootstrap_chunk_sums(*args)
+
+
+def _iter_chunk_tasks(source: ChunkSource, groupname: str, layout: MomentLayout, labels: List,
+                      n_replicates: int, random_state: int, memory_budget: int, chunk_size: int):
+    offset = 0
+    columns = [groupname] + layout.source_columns
+    for chunk in iter_dataframe_chunks(source, columns=columns, chunk_size=chunk_size):
+        codes = pd.Categorical(chunk[groupname], categories=labels).codes
+        yield (bootstrap_columns(chunk, layout), np.asarray(codes), offset, len(labels),
+               n_replicates, random_state, memory_budget)
+        offset += len(chunk)
+
+
+def poisson_bootstrap(source: ChunkSource, groupname: str, metrics: Sequence[Union[str, List[str]]],
+                      metric_types: Sequence[str], pairs: Sequence[Tuple[object, object]],
+                      n_replicates: int = DEFAULT_BOOTSTRAP_REPLICATES, alpha: float = 0.05,
+                      random_state: Optional[int] = None, n_workers: int = 1,
+                      memory_budget: int = DEFAULT_BOOTSTRAP_MEMORY,
+                      chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> BootstrapResult:
+    """
+    Poisson-bootstrap confidence intervals for every (treated, control) pair and metric.
+
+    Each replicate gives every row an independent Poisson(1) weight; per-group weighted
+    sums are matrix products of a weight block with the value block, accumulated over
+    chunks of the source, so the data is read once for all replicates and is never
+    fully loaded. Chunks are processed in a process pool with ``n_workers > 1``. The
+    weights depend only on ``random_state`` and the global row index, so results do
+    not depend on ``chunk_size``, ``n_workers`` or ``memory_budget``, and the first R
+    replicates of a larger run equal an R-replicate run.
+
+    Args:
+        source: DataFrame, CSV/Parquet path or iterable of DataFrame chunks
+        groupname (str): Column name containing group labels
+        metrics (List): Metrics; ratio metrics as [x, y] or 'x/y'
+        metric_types (List[str]): 'mean', 'proportion' or 'ratio' per metric
+        pairs (List[Tuple]): (treated label, control label) pairs
+        n_replicates (int): Number of bootstrap replicates
+        alpha (float): 1 - confidence level of the percentile intervals
+        random_state (int): Master seed (None draws fresh entropy and reports it)
+        n_workers (int): Number of worker processes (1 = serial)
+        memory_budget (int): Bytes of weight matrices materialized at once per process
+        chunk_size (int): Rows per chunk
+
+    Returns:
+        BootstrapResult: Point estimates, bootstrap standard errors and percentile intervals
+    """
+    if n_replicates < 2:
+        raise ValueError("n_replicates must be at least 2")
+    if random_state is None:
+        random_state = int(np.random.SeedSequence().entropy % (2 ** 53))
+    layout = MomentLayout(metrics, metric_types)
+    labels = list(dict.fromkeys(label for pair in pairs for label in pair))
+    tasks = _iter_chunk_tasks(source, groupname, layout, labels, n_replicates, random_state,
+                              memory_budget, chunk_size)
+
+    sums = np.zeros((n_replicates, len(labels), 2 * layout.n_metrics))
+    point = np.zeros((len(labels), 2 * layout.n_metrics))
+    if n_workers > 1:
+        # Chunks are summed in source order; at most 2 chunks per worker are in flight
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            pending = []
+            for task in tasks:
+                pending.append(executor.submit(_bootstrap_chunk_task, task))
+                if len(pending) >= 2 * n_workers:
+                    chunk_sums, chunk_point = pending.pop(0).result()
+                    sums += chunk_sums
+                    point += chunk_point
+            for future in pending:
+                chunk_sums, chunk_point = future.result()
+                sums += chunk_sums
+                point += chunk_point
+    else:
+        for task in tasks:
+            chunk_sums, chunk_point = bootstrap_chunk_sums(*task)
+            sums += chunk_sums
+            point += chunk_point
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        estimates = point[:, 0::2] / point[:, 1::2]                  # (G, M)
+        replicate_estimates = sums[:, :, 0::2] / sums[:, :, 1::2]    # (R, G, M)
+    treated = [labels.index(t) for t, _ in pairs]
+    control = [labels.index(c) for _, c in pairs]
+    diff = (estimates[treated] - estimates[control]).ravel()
+    replicates = (replicate_estimates[:, treated] - replicate_estimates[:, control]).reshape(n_replicates, -1)
+    lower, upper = np.nanquantile(replicates, [alpha / 2, 1 - alpha / 2], axis=0)
+    n_metrics = layout.n_metrics
+    return BootstrapResult(
+        treated_labels=[t for t, _ in pairs for _ in range(n_metrics)],
+        control_labels=[c for _, c in pairs for _ in range(n_metrics)],
+        metrics=[metric for _ in pairs for metric in layout.metrics],
+        metric_types=[metric_type for _ in pairs for metric_type in layout.metric_types],
+        treatment_value=estimates[treated].ravel(), control_value=estimates[control].ravel(),
+        absolute_diff=diff, standard_error=np.nanstd(replicates, axis=0, ddof=1),
+        ci_lower=lower, ci_upper=upper, replicates=replicates, random_state=random_state,
+    )
@@ -0,0 +1,303 @@
+"""
+Bulk bucketing kernels
+批量分桶计算：与 ExperimentAnalysisWithSeedFinder.apollo_bucket 逐位一致的向量化实现
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Callable, Dict, Iterator, List, Optional, Union
+
+BUCKET_COUNT = 100
+BUCKET_SUFFIX = 'exp_bucket'
+DEFAULT_CHUNK_SIZE = 1000000
+# Integers up to this magnitude survive the float64 round trip of '{:.0f}', so str() gives the same text
+_EXACT_FLOAT_INT = 2 ** 53
+
+_sha1 = hashlib.sha1
+
+
+def format_unit_id(ind_id) -> str:
+    """Format a single unit identifier exactly like the scalar apollo_bucket path."""
+    if isinstance(ind_id, (float, int)):
+        return '{:.0f}'.format(ind_id)
+    return str(ind_id)
+
+
+def format_unit_ids(individual_ids) -> List[str]:
+    """
+    Format an array-like of unit identifiers into the strings used as hash keys.
+
+    Numeric arrays are formatted with '{:.0f}' without per-element type checks (like
+    the scalar path, integers beyond 2**53 round through float64); object/string arrays fall back to the per-element rule of the scalar path, so
+    the output always equals ``[format_unit_id(x) for x in ids.tolist()]``.
+
+    Args:
+        individual_ids: NumPy array, pandas Series/Index, Arrow (Chunked)Array or list
+
+    Returns:
+        List[str]: Formatted identifiers, in input order
+    """
+    values = _to_numpy(individual_ids)
+    kind = values.dtype.kind
+    if kind == 'b':
+        return list(map(str, values.astype(np.uint8).tolist()))
+    if kind in 'iu':
+        if len(values) and max(abs(int(values.min())), abs(int(values.max()))) > _EXACT_FLOAT_INT:
+            return list(map('{:.0f}'.format, values.tolist()))
+        return list(map(str, values.tolist()))
+    if kind == 'f':
+        return list(map('{:.0f}'.format, values.astype(np.float64).tolist()))
+    if kind == 'U':
+        return values.tolist()
+    return [format_unit_id(x) for x in values.tolist()]
+
+
+def _to_numpy(individual_ids) -> np.ndarray:
+    """Convert supported ID containers to a 1-D NumPy array without importing pyarrow."""
+    if isinstance(individual_ids, np.ndarray):
+        values = individual_ids
+    elif isinstance(individual_ids, (pd.Series, pd.Index)):
+        values = individual_ids.to_numpy()
+    elif hasattr(individual_ids, 'to_numpy') and hasattr(individual_ids, 'type'):
+        # pyarrow.Array / pyarrow.ChunkedArray
+        values = individual_ids.to_numpy(zero_copy_only=False)
+    else:
+        values = np.asarray(list(individual_ids), dtype=object)
+    if values.ndim != 1:
+        raise ValueError("Unit IDs must be a one-dimensional array")
+    return values
+
+
+def hash_keys_to_buckets(keys: List[bytes]) -> np.ndarray:
+    """
+    Hash pre-built keys with SHA1 and reduce the last 4 digest bytes modulo 100.
+
+    The digests are concatenated into a single buffer so the big-endian decode and
+    the modulo run as one vectorized NumPy operation.
+    """
+    if not keys:
+        return np.empty(0, dtype=np.uint8)
+    digests = np.frombuffer(b''.join([_sha1(k).digest() for k in keys]), dtype=np.uint8)
+    tails = digests.reshape(-1, 20)[:, 16:].copy().view('>u4').ravel()
+    return (tails % BUCKET_COUNT).astype(np.uint8)
+
+
+def bucket_encoded_ids(experiment_name: str, encoded_ids: List[bytes]) -> np.ndarray:
+    """Bucket UTF-8 encoded, already-formatted IDs (the cheapest path for repeated seeds)."""
+    suffix = (experiment_name + BUCKET_SUFFIX).encode('utf-8')
+    return hash_keys_to_buckets([k + suffix for k in encoded_ids])
+
+
+def bucket_formatted_ids(experiment_name: str, formatted_ids: List[str], n_workers: int = 1,
+                         chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """Bucket identifiers that have already been passed through format_unit_ids."""
+    if n_workers > 1 and len(formatted_ids) > chunk_size:
+        return _map_chunks(_bucket_formatted_chunk, experiment_name, formatted_ids, n_workers, chunk_size)
+    suffix = experiment_name + BUCKET_SUFFIX
+    return hash_keys_to_buckets([(s + suffix).encode('utf-8') for s in formatted_ids])
+
+
+def apollo_bucket_bulk(experiment_name: str, individual_ids, n_workers: int = 1,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """
+    Vectorized apollo_bucket over many unit identifiers.
+
+    With ``n_workers > 1`` the IDs are split into ``chunk_size`` slices that are
+    formatted and hashed in a process pool and reassembled in input order; the
+    result is identical to the serial path.
+
+    Args:
+        experiment_name (str): Name of the experiment (or rerandomization seed)
+        individual_ids: NumPy array, pandas Series, Arrow array or list of IDs
+        n_workers (int): Number of worker processes (1 = serial)
+        chunk_size (int): Number of IDs per task in parallel mode
+
+    Returns:
+        np.ndarray: uint8 bucket numbers (0-99) aligned with the input
+    """
+    if n_workers > 1:
+        values = _to_numpy(individual_ids)
+        if len(values) > chunk_size:
+            return _map_chunks(_bucket_raw_chunk, experiment_name, values, n_workers, chunk_size)
+        individual_ids = values
+    return bucket_formatted_ids(experiment_name, format_unit_ids(individual_ids))
+
+
+def _bucket_raw_chunk(experiment_name: str, chunk) -> np.ndarray:
+    return bucket_formatted_ids(experiment_name, format_unit_ids(chunk))
+
+
+def _bucket_formatted_chunk(experiment_name: str, chunk) -> np.ndarray:
+    return bucket_formatted_ids(experiment_name, chunk)
+
+
+def _map_chunks(func: Callable, experiment_name: str, values, n_workers: int, chunk_size: int) -> np.ndarray:
+    """Run ``func`` over consecutive slices in a process pool, keeping input order."""
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+    chunks = [values[start:start + chunk_size] for start in range(0, len(values), chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(func, [experiment_name] * len(chunks), chunks))
+    return np.concatenate(results).astype(np.uint8, copy=False)
+
+
+def extract_percentage(input_value: Union[str, float, int]) -> int:
+    """Parse a group proportion ('50%', '0.5', 0.5 or 50) into an integer percentage."""
+    if isinstance(input_value, str):
+        if input_value.endswith('%'):
+            return int(input_value[:-1])
+        try:
+            float_value = float(input_value)
+            return int(float_value * 100) if 0 <= float_value <= 1 else int(float_value)
+        except ValueError:
+            raise ValueError(f"Invalid input string: {input_value}")
+    elif isinstance(input_value, (float, int)):
+        return int(input_value * 100) if 0 <= input_value <= 1 else int(input_value)
+    raise ValueError("Input must be a string, integer, or float.")
+
+
+class GroupAllocator:
+    """
+    Compiled bucket -> group mapping for one set of group proportions.
+
+    The proportions are parsed and validated once; afterwards every assignment is a
+    single hash plus a lookup in a 100-entry table. Groups are returned as integer
+    codes indexing ``labels`` (or as a pandas Categorical).
+    """
+
+    def __init__(self, group_proportions: Dict[str, Union[str, float, int]]):
+        """
+        Args:
+            group_proportions (dict): Dictionary of group names and their proportions
+        """
+        self.group_proportions = dict(group_proportions)
+        self.labels = list(self.group_proportions.keys())
+        self.percentages = [extract_percentage(val) for val in self.group_proportions.values()]
+        if sum(self.percentages) != 100:
+            raise ValueError("The sum of all proportions must equal 100")
+        if len(self.labels) > np.iinfo(np.uint8).max:
+            raise ValueError("At most 255 groups are supported")
+
+        # Same first-match rule as the original assign_groups loop, last group as fallback
+        lookup = np.full(BUCKET_COUNT, len(self.labels) - 1, dtype=np.uint8)
+        for bucket in range(BUCKET_COUNT):
+            start_bucket = 0
+            for code, prop in enumerate(self.percentages):
+                if start_bucket <= bucket < start_bucket + prop:
+                    lookup[bucket] = code
+                    break
+                start_bucket += prop
+        self.lookup = lookup
+        self.lookup.setflags(write=False)
+
+    @property
+    def n_groups(self) -> int:
+        return len(self.labels)
+
+    def membership_matrix(self) -> np.ndarray:
+        """G x 100 0/1 matrix mapping bucket-level sums to group-level sums."""
+        return (self.lookup[None, :] == np.arange(self.n_groups)[:, None]).astype(np.float64)
+
+    def codes_from_buckets(self, buckets: np.ndarray) -> np.ndarray:
+        """Map bucket numbers (0-99) to group codes."""
+        return self.lookup[buckets]
+
+    def assign_codes(self, experiment_name: str, individual_ids, n_workers: int = 1,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        """Assign a whole array of IDs in one hash-plus-lookup pass; returns uint8 group codes."""
+        return self.lookup[apollo_bucket_bulk(experiment_name, individual_ids, n_workers, chunk_size)]
+
+    def assign_categorical(self, experiment_name: str, individual_ids, n_workers: int = 1,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE) -> pd.Categorical:
+        """Assign a whole array of IDs and return the groups as a pandas Categorical."""
+        return self.to_categorical(self.assign_codes(experiment_name, individual_ids, n_workers, chunk_size))
+
+    def assign(self, experiment_name: str, individual_id: Union[str, int, float]) -> str:
+        """Assign a single ID and return its group label."""
+        return self.labels[self.assign_codes(experiment_name, [individual_id])[0]]
+
+    def to_categorical(self, codes: np.ndarray) -> pd.Categorical:
+        return pd.Categorical.from_codes(codes.astype(np.int16), categories=self.labels)
+
+
+def iter_unit_id_chunks(stream: IO[bytes], file_format: str = 'csv', id_column: Optional[str] = None,
+                        chunk_size: int = 100000) -> Iterator[List]:
+    """
+    Read unit IDs incrementally from a CSV or NDJSON byte stream.
+
+    Gzip input is detected from its magic bytes. Only one chunk of IDs is held in
+    memory at a time.
+
+    Args:
+        stream: Binary file-like object (e.g. an uploaded file)
+        file_format (str): 'csv' (header row required) or 'ndjson'
+        id_column (str): Column/key holding the unit ID (default: first column/key)
+        chunk_size (int): Number of IDs per yielded chunk
+
+    Yields:
+        List: Unit IDs, in file order
+    """
+    if file_format not in ('csv', 'ndjson'):
+        raise ValueError(f"Unsupported file format: {file_format}")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer")
+
+    if stream.seekable():
+        magic = stream.read(2)
+        stream.seek(0)
+    else:
+        stream = io.BufferedReader(stream)
+        magic = stream.peek(2)[:2]
+    if magic == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+
+    lines = (line.decode('utf-8') for line in stream)
+    values = _iter_csv_ids(lines, id_column) if file_format == 'csv' else _iter_ndjson_ids(lines, id_column)
+
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_csv_ids(lines: Iterator[str], id_column: Optional[str]) -> Iterator[str]:
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [name.lstrip('\ufeff').strip() for name in header]
+    if id_column is None:
+        index = 0
+    elif id_column in header:
+        index = header.index(id_column)
+    else:
+        raise ValueError(f'ID column "{id_column}" not found')
+    for row in reader:
+        if row:
+            yield row[index]
+
+
+def _iter_ndjson_ids(lines: Iterator[str], id_column: Optional[str]) -> Iterator:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, dict):
+            if id_column is None:
+                record = next(iter(record.values()))
+            elif id_column in record:
+                record = record[id_column]
+            else:
+                raise ValueError(f'ID column "{id_column}" not found')
+        yield record
@@ -0,0 +1,195 @@
+"""
+Dataset registry
+数据集注册表：上传时只解析一次，按列写成磁盘文件（数值列保留类型，ID 等文本列做字典编码），
+之后各接口按数据集ID以内存映射方式只读取需要的列，重复请求不再解析 JSON
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from assignment_store import LRUCache
+
+DATASET_FORMAT_VERSION = 1
+
+
+@dataclass
+class DatasetInfo:
+    """
+    Metadata of a registered dataset.
+
+    Attributes:
+        dataset_id (str): Registry key
+        n_rows (int): Number of rows
+        columns (List[str]): All columns in upload order
+        numeric_columns (List[str]): Columns stored as typed numeric arrays
+        encoded_columns (List[str]): Columns stored dictionary-encoded (values as strings)
+        id_column (str): Unit ID column (dictionary-encoded, stringified like str(value))
+    """
+    dataset_id: str
+    n_rows: int
+    columns: List[str] = field(default_factory=list)
+    numeric_columns: List[str] = field(default_factory=list)
+    encoded_columns: List[str] = field(default_factory=list)
+    id_column: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+class DatasetStore:
+    """
+    On-disk registry of uploaded datasets, referenced by ID.
+
+    Every dataset is a directory with meta.json and one .npy file per column: numeric
+    columns keep the dtype pd.to_numeric gives them; every other column is
+    dictionary-encoded as int32 codes (-1 = missing) plus a dictionary of distinct
+    values as fixed-width UTF-8 bytes. The ID column is always encoded, after str()
+    like the request handlers cast IDs. Datasets are written to a temporary directory
+    and renamed into place, and are immutable afterwards.
+
+    Reading opens the needed column files with np.load(mmap_mode='r'), so a request
+    on a registered dataset does no parsing and only pages in the columns it uses.
+    Opened column maps are kept in a bounded LRU.
+    """
+
+    def __init__(self, root_dir: str, max_open_datasets: int = 16):
+        """
+        Args:
+            root_dir (str): Directory holding one sub-directory per dataset
+            max_open_datasets (int): Datasets whose metadata and column maps stay open
+        """
+        self.root_dir = root_dir
+        self._open = LRUCache(max_open_datasets)
+        self._lock = threading.RLock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def create(self, df: pd.DataFrame, id_column: Optional[str] = None) -> DatasetInfo:
+        """
+        Parse a DataFrame once and register it.
+
+        Args:
+            df (pd.DataFrame): Dataset, e.g. pd.DataFrame(rows) of a JSON upload
+            id_column (str, optional): Unit ID column
+
+        Returns:
+            DatasetInfo: Metadata including the new dataset ID
+        """
+        if id_column is not None and id_column not in df.columns:
+            raise ValueError(f'User ID column "{id_column}" not found')
+        info = DatasetInfo(dataset_id=uuid.uuid4().hex, n_rows=len(df), columns=[str(c) for c in df.columns],
+                           id_column=id_column)
+        tmp_dir = os.path.join(self.root_dir, f'.{info.dataset_id}.tmp')
+        os.makedirs(tmp_dir)
+        try:
+            for i, column in enumerate(df.columns):
+                prefix = os.path.join(tmp_dir, f'col_{i:05d}')
+                values = None if column == id_column else _numeric_values(df[column])
+                if values is not None:
+                    np.save(prefix + '.npy', values)
+                    info.numeric_columns.append(str(column))
+                else:
+                    codes, dictionary = _dictionary_encode(df[column], stringify_missing=column == id_column)
+                    np.save(prefix + '.codes.npy', codes)
+                    np.save(prefix + '.dict.npy', dictionary)
+                    info.encoded_columns.append(str(column))
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump({'version': DATASET_FORMAT_VERSION, **info.to_dict()}, f)
+            os.replace(tmp_dir, self._dataset_dir(info.dataset_id))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return info
+
+    def info(self, dataset_id: str) -> DatasetInfo:
+        """Metadata of a dataset; raises KeyError if it is not registered."""
+        return self._opened(dataset_id)[0]
+
+    def load(self, dataset_id: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Memory-mapped DataFrame with the requested columns (default: all).
+
+        Numeric columns are read-only views of the column files; encoded columns are
+        Categoricals over the mapped codes. Unknown columns are skipped, so callers
+        keep reporting missing columns themselves.
+        """
+        with self._lock:
+            info, arrays = self._opened(dataset_id)
+            wanted = info.columns if columns is None else [c for c in dict.fromkeys(columns) if c in info.columns]
+            data = {}
+            for column in wanted:
+                if column not in arrays:
+                    arrays[column] = self._map_column(info, column)
+                data[column] = arrays[column]
+        return pd.DataFrame(data, copy=False)
+
+    def delete(self, dataset_id: str) -> bool:
+        """Remove a dataset; returns False if it was not registered."""
+        with self._lock:
+            self._open.pop(dataset_id)
+            path = self._dataset_dir(dataset_id)
+            if not _valid_id(dataset_id) or not os.path.isdir(path):
+                return False
+            shutil.rmtree(path)
+            return True
+
+    def __contains__(self, dataset_id: str) -> bool:
+        return _valid_id(dataset_id) and os.path.isdir(self._dataset_dir(dataset_id))
+
+    def _dataset_dir(self, dataset_id: str) -> str:
+        return os.path.join(self.root_dir, dataset_id)
+
+    def _opened(self, dataset_id: str):
+        with self._lock:
+            entry = self._open.get(dataset_id)
+            if entry is None:
+                if dataset_id not in self:
+                    raise KeyError(f'Dataset "{dataset_id}" not found')
+                with open(os.path.join(self._dataset_dir(dataset_id), 'meta.json')) as f:
+                    meta = json.load(f)
+                if meta.pop('version', None) != DATASET_FORMAT_VERSION:
+                    raise ValueError(f'Dataset "{dataset_id}" has an unsupported format version')
+                entry = (DatasetInfo(**meta), {})
+                self._open.put(dataset_id, entry)
+            return entry
+
+    def _map_column(self, info: DatasetInfo, column: str):
+        prefix = os.path.join(self._dataset_dir(info.dataset_id), f'col_{info.columns.index(column):05d}')
+        if column in info.numeric_columns:
+            return np.load(prefix + '.npy', mmap_mode='r')
+        codes = np.load(prefix + '.codes.npy', mmap_mode='r')
+        dictionary = np.char.decode(np.load(prefix + '.dict.npy'), 'utf-8')
+        return pd.Categorical.from_codes(codes, categories=dictionary)
+
+
+def _valid_id(dataset_id: str) -> bool:
+    return isinstance(dataset_id, str) and len(dataset_id) == 32 and all(c in '0123456789abcdef' for c in dataset_id)
+
+
+def _numeric_values(series: pd.Series) -> Optional[np.ndarray]:
+    """Typed array of a column that pd.to_numeric accepts entirely, else None."""
+    try:
+        numeric = pd.to_numeric(series, errors='raise')
+    except (ValueError, TypeError):
+        return None
+    values = numeric.to_numpy()
+    if values.dtype.kind not in 'biuf':
+        values = numeric.to_numpy(dtype=np.float64, na_value=np.nan)
+    return values
+
+
+def _dictionary_encode(series: pd.Series, stringify_missing: bool = False):
+    """int32 codes (-1 = missing) and the distinct values as fixed-width UTF-8 bytes."""
+    strings = series.astype(str)
+    if not stringify_missing:
+        strings = strings.where(series.notna())
+    codes, uniques = pd.factorize(strings)
+    dictionary = np.array([u.encode('utf-8') for u in uniques], dtype=bytes) if len(uniques) else np.empty(0, 'S1')
+    return codes.astype(np.int32), dictionary
@@ -7,18 +7,44 @@ import pandas as pd
 import numpy as np
 from scipy import stats
 import hashlib
+import threading
 from statsmodels.stats.multitest import multipletests
-from typing import Dict, List, Union, Tuple
+from typing import Callable, Dict, List, Union, Tuple
 from tqdm import tqdm
 
+from accumulators import ExperimentAccumulator
+from assignment_store import LRUCache
+from bootstrap import DEFAULT_BOOTSTRAP_MEMORY, DEFAULT_BOOTSTRAP_REPLICATES, BootstrapResult, poisson_bootstrap
+from bucketing import DEFAULT_CHUNK_SIZE, GroupAllocator, apollo_bucket_bulk, format_unit_id, format_unit_ids
+from chunked_input import DEFAULT_STREAM_CHUNK_SIZE, ChunkSource
+from group_stats import ComparisonTable, GroupedMetricStats
+from permutation import DEFAULT_MAX_PERMUTATIONS, DEFAULT_STOPPING_CONFIDENCE, PermutationResult, permutation_test
+from seed_search import (DEFAULT_CHECKPOINT_EVERY, DEFAULT_SEED_BATCH_SIZE, BucketCube, SearchProgress,
+                         SeedEvaluator, SeedSearchResult, search_seeds as _search_seeds, search_seeds_streaming)
+from sequential import DEFAULT_RELATIVE_EFFECT, SequentialTest
+from sufficient_stats import MomentLayout, summary_moments
+
+# Compiled allocators kept per analyzer; proportions come from clients, so the cache is bounded
+DEFAULT_ALLOCATOR_CACHE_ENTRIES = 64
+
 class ExperimentAnalysisWithSeedFinder:
+    # Optional assignment_store.AssignmentStore consulted before hashing registered experiments (None = always hash)
+    assignment_store = None
+    # Optional score_cache.SeedScoreCache shared by seed searches (None = no caching)
+    score_cache = None
+
     def __init__(self):
         self.alpha = 0.05  # Default significance level
+        self._allocators = LRUCache(DEFAULT_ALLOCATOR_CACHE_ENTRIES)  # Compiled GroupAllocator per group_proportions
+        self._allocators_lock = threading.Lock()  # Shared by request and job threads
     
-    @staticmethod
-    def apollo_bucket(experiment_name: str, individual_id: Union[str, List[str], int, float]) -> Union[int, Tuple[List[int], List]]:
+    @classmethod
+    def apollo_bucket(cls, experiment_name: str, individual_id: Union[str, List[str], int, float]) -> Union[int, Tuple[List[int], List]]:
         """
         Generate consistent bucket numbers (0-99) for experimental units.
+
+        When an assignment store is configured, stored buckets are returned without
+        hashing and newly hashed units are added to the store.
         
         Args:
             experiment_name (str): Name of the experiment for consistent bucketing
@@ -29,19 +55,62 @@ class ExperimentAnalysisWithSeedFinder:
         """
         def _single_apollo_bucket(exp_name: str, ind_id: Union[str, int, float]) -> int:
             sha1 = hashlib.sha1()
-            if isinstance(ind_id, (float, int)):
-                ind_id = '{:.0f}'.format(ind_id)
-            else:
-                ind_id = str(ind_id)
-            raw_key = ind_id + exp_name + 'exp_bucket'
+            raw_key = format_unit_id(ind_id) + exp_name + 'exp_bucket'
             sha1.update(bytes(raw_key, encoding='UTF-8'))
             sha1_int = int.from_bytes(sha1.digest()[-4:], byteorder='big')
             return sha1_int % 100
 
         if isinstance(individual_id, list):
-            return [_single_apollo_bucket(experiment_name, x) for x in individual_id], individual_id
+            return cls.apollo_bucket_bulk(experiment_name, individual_id).tolist(), individual_id
+        if cls.assignment_store is not None:
+            return cls.assignment_store.get_bucket(experiment_name, format_unit_id(individual_id))
         return _single_apollo_bucket(experiment_name, individual_id)
 
+    @classmethod
+    def apollo_bucket_bulk(cls, experiment_name: str, individual_ids, n_workers: int = 1,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+        """
+        Bucket many experimental units at once.
+
+        Bit-identical to calling apollo_bucket on every element of ``individual_ids``
+        (after ``.tolist()``), but formats and hashes the IDs in one pass.
+
+        Args:
+            experiment_name (str): Name of the experiment for consistent bucketing
+            individual_ids: NumPy array, pandas Series or Arrow array of identifiers
+            n_workers (int): Opt-in process pool size for hashing (1 = serial)
+            chunk_size (int): Number of IDs per worker task in parallel mode
+
+        Returns:
+            np.ndarray: uint8 bucket numbers (0-99), aligned with the input
+        """
+        if cls.assignment_store is not None:
+            return cls.assignment_store.get_buckets(
+                experiment_name, format_unit_ids(individual_ids), n_workers, chunk_size
+            )
+        return apollo_bucket_bulk(experiment_name, individual_ids, n_workers, chunk_size)
+
+    def get_allocator(self, group_proportions: Union[Dict[str, Union[str, float, int]], GroupAllocator]) -> GroupAllocator:
+        """
+        Return a compiled GroupAllocator for the given proportions, reusing cached ones.
+
+        Args:
+            group_proportions (dict or GroupAllocator): Group names and their proportions
+
+        Returns:
+            GroupAllocator: Allocator holding the precomputed bucket -> group table
+        """
+        if isinstance(group_proportions, GroupAllocator):
+            return group_proportions
+        key = tuple(group_proportions.items())
+        with self._allocators_lock:
+            allocator = self._allocators.get(key)
+        if allocator is None:
+            allocator = GroupAllocator(group_proportions)
+            with self._allocators_lock:
+                self._allocators.put(key, allocator)
+        return allocator
+
     def assign_groups(self, experiment_name: str, individual_id: str, group_proportions: Dict[str, Union[str, float, int]]) -> str:
         """
         Assign groups based on bucket number and group proportions.
@@ -49,41 +118,21 @@ class ExperimentAnalysisWithSeedFinder:
         Args:
             experiment_name (str): Name of the experiment
             individual_id (str): Individual identifier
-            group_proportions (dict): Dictionary of group names and their proportions
+            group_proportions (dict or GroupAllocator): Dictionary of group names and their proportions
         
         Returns:
             str: Assigned group name
         """
-        def extract_percentage(input_value: Union[str, float, int]) -> int:
-            if isinstance(input_value, str):
-                if input_value.endswith('%'):
-                    return int(input_value[:-1])
-                try:
-                    float_value = float(input_value)
-                    return int(float_value * 100) if 0 <= float_value <= 1 else int(float_value)
-                except ValueError:
-                    raise ValueError(f"Invalid input string: {input_value}")
-            elif isinstance(input_value, (float, int)):
-                return int(input_value * 100) if 0 <= input_value <= 1 else int(input_value)
-            raise ValueError("Input must be a string, integer, or float.")
-
-        total_percentage = sum(extract_percentage(val) for val in group_proportions.values())
-        if total_percentage != 100:
-            raise ValueError("The sum of all proportions must equal 100")
-
-        start_bucket = 0
-        for group, prop in group_proportions.items():
-            prop = extract_percentage(prop)
-            if start_bucket <= self.apollo_bucket(experiment_name, individual_id) < start_bucket + prop:
-                return group
-            start_bucket += prop
-        # Return last group if no match found
-        return list(group_proportions.keys())[-1]
-
-    def generate_best_seed(self, df: pd.DataFrame, metrics: List[str], metric_types: List[str], 
+        allocator = self.get_allocator(group_proportions)
+        return allocator.labels[allocator.lookup[self.apollo_bucket(experiment_name, individual_id)]]
+
+    def generate_best_seed(self, df: Union[pd.DataFrame, ChunkSource], metrics: List[str], metric_types: List[str], 
                           group_name: str, unit_id: str, iterations: int, 
-                          group_proportions: Dict[str, Union[str, float, int]], 
-                          control_label: str = None) -> str:
+                          group_proportions: Union[Dict[str, Union[str, float, int]], GroupAllocator],
+                          control_label: str = None, random_state: int = None, n_workers: int = 1,
+                          prune: bool = False, checkpoint_path: str = None,
+                          checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY, engine: str = 'per-seed',
+                          criterion: str = 'max-t') -> str:
         """
         Find the best random seed using re-randomization to minimize imbalance across metrics.
         
@@ -92,78 +141,173 @@ class ExperimentAnalysisWithSeedFinder:
         2. For each seed, assign groups and calculate t-statistics for all metrics
         3. Find the maximum absolute t-statistic for each seed (worst case imbalance)
         4. Select the seed with the minimum maximum t-statistic
+
+        With ``criterion='mahalanobis'`` steps 2-4 instead score each seed by the
+        Mahalanobis distance of its treatment-control mean differences, using a
+        pooled covariance computed once for the dataset (accounts for correlated metrics).
+
+        Seeds are scored by SeedEvaluator from per-group sufficient statistics, so no
+        DataFrame is copied or filtered per seed. See search_seeds for the full result.
+        A file path or chunk iterator instead of a DataFrame selects the out-of-core search.
         
         Args:
-            df (pd.DataFrame): Input dataset
+            df (pd.DataFrame, path or chunk iterator): Input dataset
             metrics (List[str]): List of metrics to test
             metric_types (List[str]): List of metric types ('mean', 'ratio', or 'proportion')
-            group_name (str): Column name for group assignments
+            group_name (str): Column name for group assignments (not materialized during the search)
             unit_id (str): Column name containing unit identifiers
             iterations (int): Number of random seeds to try
-            group_proportions (dict): Dictionary of group names and their proportions
+            group_proportions (dict or GroupAllocator): Dictionary of group names and their proportions
             control_label (str): Label for control group (if None, will auto-detect)
+            random_state (int): Master seed for the candidate streams (None = fresh entropy)
+            n_workers (int): Number of worker processes for the search (1 = serial)
+            prune (bool): Abort candidates early once they cannot beat the best seeds
+            checkpoint_path (str): Local file to persist progress to; an existing file is resumed
+            checkpoint_every (int): Number of candidates between checkpoint writes
+            engine (str): 'per-seed' or 'batched' (multi-seed kernel, see search_seeds)
+            criterion (str): Balance criterion, 'max-t' or 'mahalanobis'
         
         Returns:
             str: The best random seed for group assignment
         """
-        # Auto-detect control label if not provided
-        if control_label is None:
-            control_keys = [k for k in group_proportions.keys() if "control" in k.lower()]
-            if control_keys:
-                control_label = control_keys[0]
+        return self.search_seeds(
+            df, metrics, metric_types, unit_id, iterations, group_proportions,
+            control_label=control_label, random_state=random_state, n_workers=n_workers, prune=prune,
+            checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every, engine=engine,
+            criterion=criterion
+        ).best_seed
+
+    def search_seeds(self, df: Union[pd.DataFrame, ChunkSource], metrics: List[str], metric_types: List[str],
+                     unit_id: str, iterations: int,
+                     group_proportions: Union[Dict[str, Union[str, float, int]], GroupAllocator],
+                     control_label: str = None, random_state: int = None, n_workers: int = 1,
+                     top_k: int = 10, prune: bool = False, checkpoint_path: str = None,
+                     checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+                     progress_callback: Callable[[SearchProgress], None] = None,
+                     seed_batch_size: int = DEFAULT_SEED_BATCH_SIZE,
+                     chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE, engine: str = 'per-seed',
+                     keep_bucket_cube: bool = False, criterion: str = 'max-t') -> SeedSearchResult:
+        """
+        Run the SeedFinder search and return the best seed together with the top-K list.
+
+        Candidate seeds are derived from ``random_state`` through independent
+        SeedSequence child streams, so the same master seed gives the same result for
+        any ``n_workers``. With ``checkpoint_path`` the search can be interrupted and
+        resumed; the checkpoint is refused if the data or metric configuration changed.
+
+        Instead of a DataFrame, ``df`` may be a CSV/Parquet file path or an iterable of
+        DataFrame chunks; the search then runs out of core (see
+        seed_search.search_seeds_streaming) and ``n_workers``, ``prune`` and the
+        checkpoint options do not apply.
+
+        Args:
+            df (pd.DataFrame, path or chunk iterator): Input dataset
+            metrics (List[str]): List of metrics to balance
+            metric_types (List[str]): List of metric types ('mean', 'ratio', or 'proportion')
+            unit_id (str): Column name containing unit identifiers
+            iterations (int): Number of random seeds to try
+            group_proportions (dict or GroupAllocator): Dictionary of group names and their proportions
+            control_label (str): Label for control group (if None, will auto-detect)
+            random_state (int): Master seed for the candidate streams (None = fresh entropy)
+            n_workers (int): Number of worker processes (1 = serial)
+            top_k (int): Number of best seeds to keep
+            prune (bool): Abort a candidate as soon as one metric's |t| rules it out
+            checkpoint_path (str): Local file to persist progress to; an existing file is resumed
+            checkpoint_every (int): Number of candidates between checkpoint writes
+            progress_callback (Callable): Receives a SearchProgress after every block of
+                candidates (default: a console progress bar)
+            seed_batch_size (int): Out-of-core mode: candidates per pass over the source
+            chunk_size (int): Out-of-core mode: rows read per chunk
+            engine (str): 'per-seed' or 'batched' (hashes and reduces a units x seeds tile
+                per kernel call, within SeedEvaluator's memory budget)
+            keep_bucket_cube (bool): Keep the 100-bucket moments of every candidate in
+                ``result.bucket_cube`` so rerank_seeds can re-rank them (not with prune)
+            criterion (str): 'max-t' (worst per-metric |t|) or 'mahalanobis' (distance of the
+                mean-difference vector under the pooled covariance; in-memory data only)
+
+        Returns:
+            SeedSearchResult: Best seed, top-K seeds, pruning statistics and the master seed used
+        """
+        allocator = self.get_allocator(group_proportions)
+        control_label = self._resolve_control_label(allocator, control_label)
+        
+        with tqdm(total=iterations, desc="Testing random seeds", disable=progress_callback is not None) as bar:
+            if progress_callback is None:
+                progress_callback = lambda progress: bar.update(progress.completed - bar.n)
+            if isinstance(df, pd.DataFrame):
+                # Metric columns are extracted once; each seed only costs hashing plus bincount reductions
+                evaluator = SeedEvaluator(df, metrics, metric_types, unit_id, allocator, control_label)
+                result = _search_seeds(evaluator, iterations, random_state=random_state,
+                                       n_workers=n_workers, top_k=top_k, prune=prune,
+                                       checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every,
+                                       progress_callback=progress_callback, score_cache=self.score_cache,
+                                       engine=engine, keep_bucket_cube=keep_bucket_cube, criterion=criterion)
             else:
-                control_label = list(group_proportions.keys())[0]
-        
-        # Get treatment labels
-        treatment_labels = [k for k in group_proportions.keys() if k != control_label]
-        
-        seed_scores = []
-        
-        for _ in tqdm(range(iterations), desc="Testing random seeds"):
-            # Generate random seed
-            random_seed = 'rr' + str(int(np.random.rand() * 1000000))
-            
-            # Create a copy of the dataframe for this iteration
-            df_copy = df.copy()
-            
-            # Assign groups based on current seed
-            df_copy[group_name] = df_copy[unit_id].apply(
-                lambda x: self.assign_groups(random_seed, str(x), group_proportions)
-            )
-            
-            # Run statistical tests for all metrics and treatment groups
-            try:
-                stats_df = self.run_statistical_tests(
-                    df_copy, metrics, metric_types, group_name, 
-                    treatment_labels, control_label, is_two_sided=True
-                )
-                
-                # Find the maximum absolute t-statistic (worst case imbalance)
-                max_t_stat = stats_df['T_Statistic'].abs().max()
-                seed_scores.append((random_seed, max_t_stat))
-                
-            except Exception as e:
-                # Skip this seed if there's an error
-                print(f"Error with seed {random_seed}: {e}")
-                continue
-        
-        if not seed_scores:
-            raise ValueError("No valid seeds found. Please check your data and parameters.")
-        
-        # Select the seed with minimum maximum t-statistic
-        best_seed, best_score = min(seed_scores, key=lambda x: x[1])
+                # File path or chunk iterator: out-of-core search, memory independent of the unit count
+                if criterion != 'max-t':
+                    raise ValueError("The out-of-core search only supports the max-t criterion")
+                result = search_seeds_streaming(df, metrics, metric_types, unit_id, allocator, control_label,
+                                                iterations, random_state=random_state, top_k=top_k,
+                                                seed_batch_size=seed_batch_size, chunk_size=chunk_size,
+                                                progress_callback=progress_callback,
+                                                keep_bucket_cube=keep_bucket_cube)
         
         # Print top 3 seeds for reference
-        print("\nTop 3 candidate seeds by max T-statistic (lower is better):")
-        for s, t in sorted(seed_scores, key=lambda x: x[1])[:3]:
-            print(f"Seed: {s}, Max T-statistic: {t:.4f}")
-        
-        print(f"\nSelected Best Seed: {best_seed}, with Max T-statistic: {best_score:.4f}")
-        
-        return best_seed
+        score_name = "Mahalanobis distance" if criterion == 'mahalanobis' else "Max T-statistic"
+        print(f"\nTop 3 candidate seeds by {score_name} (lower is better):")
+        for s, t in result.top_seeds[:3]:
+            print(f"Seed: {s}, {score_name}: {t:.4f}")
+        
+        print(f"\nSelected Best Seed: {result.best_seed}, with {score_name}: {result.best_score:.4f}")
+        if result.cached_metric_evaluations:
+            print(f"Score cache: {result.cached_seeds} seeds and "
+                  f"{result.cached_metric_evaluations} metric tests reused")
+        if prune:
+            print(f"Pruned {result.prune_rate:.1%} of seeds, "
+                  f"{result.metrics_per_seed:.2f}/{result.n_metrics} metrics tested per seed")
+        
+        return result
+
+    def rerank_seeds(self, bucket_cube: Union[BucketCube, SeedSearchResult],
+                     group_proportions: Union[Dict[str, Union[str, float, int]], GroupAllocator],
+                     control_label: str = None, top_k: int = 10) -> SeedSearchResult:
+        """
+        Re-rank the candidates of an earlier search for different group proportions.
+
+        Groups depend only on the 0-99 bucket, so the bucket cube kept by
+        ``search_seeds(..., keep_bucket_cube=True)`` scores every candidate under the
+        new split (e.g. 50/50 -> 10/10/80) in O(seeds x 100) without re-hashing or
+        touching the data.
+
+        Args:
+            bucket_cube (BucketCube or SeedSearchResult): Cube, or a search result holding one
+            group_proportions (dict or GroupAllocator): New group names and proportions
+            control_label (str): Label for control group (if None, will auto-detect)
+            top_k (int): Number of best seeds to keep
+
+        Returns:
+            SeedSearchResult: Best seed and top-K seeds under the new proportions
+        """
+        if isinstance(bucket_cube, SeedSearchResult):
+            if bucket_cube.bucket_cube is None:
+                raise ValueError("Search result has no bucket cube; run search_seeds with keep_bucket_cube=True")
+            bucket_cube = bucket_cube.bucket_cube
+        allocator = self.get_allocator(group_proportions)
+        return bucket_cube.rerank(allocator, self._resolve_control_label(allocator, control_label), top_k=top_k)
+
+    @staticmethod
+    def _resolve_control_label(allocator: GroupAllocator, control_label: str = None) -> str:
+        """Return ``control_label`` or auto-detect it (first label containing 'control', else the first group)."""
+        if control_label is not None:
+            return control_label
+        control_keys = [k for k in allocator.labels if "control" in k.lower()]
+        if control_keys:
+            return control_keys[0]
+        return allocator.labels[0]
 
     def assign_groups_with_seed(self, df: pd.DataFrame, seed: str, unit_id: str, 
-                               group_name: str, group_proportions: Dict[str, Union[str, float, int]]) -> pd.DataFrame:
+                               group_name: str, group_proportions: Union[Dict[str, Union[str, float, int]], GroupAllocator],
+                               n_workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE) -> pd.DataFrame:
         """
         Assign groups to a dataframe using a specific seed.
         
@@ -172,191 +316,191 @@ class ExperimentAnalysisWithSeedFinder:
             seed (str): Random seed for group assignment
             unit_id (str): Column name containing unit identifiers
             group_name (str): Column name for group assignments
-            group_proportions (dict): Dictionary of group names and their proportions
+            group_proportions (dict or GroupAllocator): Dictionary of group names and their proportions
+            n_workers (int): Opt-in process pool size for hashing (1 = serial)
+            chunk_size (int): Number of IDs per worker task in parallel mode
         
         Returns:
-            pd.DataFrame: DataFrame with group assignments added
+            pd.DataFrame: DataFrame with group assignments added as a categorical column
         """
+        allocator = self.get_allocator(group_proportions)
         df_copy = df.copy()
-        df_copy[group_name] = df_copy[unit_id].apply(
-            lambda x: self.assign_groups(seed, str(x), group_proportions)
-        )
+        buckets = self.apollo_bucket_bulk(seed, df_copy[unit_id].astype(str), n_workers, chunk_size)
+        df_copy[group_name] = allocator.to_categorical(allocator.codes_from_buckets(buckets))
         return df_copy
 
-    def test_mean(self, data: pd.DataFrame, groupname: str, treated_label: str, 
-                  control_label: str, test_metric: str, is_two_sided: bool = True, 
-                  alternative: str = 'two-sided') -> List:
-        """Conduct t-test for mean metrics."""
-        treated = data[data[groupname] == treated_label][test_metric]
-        control = data[data[groupname] == control_label][test_metric]
-        treated_mean = treated.mean()
-        control_mean = control.mean()
-        
-        # Calculate variance and standard error
-        var_treated = np.var(treated, ddof=1)
-        var_control = np.var(control, ddof=1)
-        n_treated = len(treated)
-        n_control = len(control)
-        std_error = np.sqrt(var_treated/n_treated + var_control/n_control)
-
-        # Calculate mean
-        mae = treated_mean - control_mean
-        mape = treated_mean / control_mean - 1
-        
-        # Welch-Satterthwaite degrees of freedom
-        df = (
-             (var_treated / n_treated + var_control / n_control) ** 2 /
-             (
-                ((var_treated / n_treated) ** 2) / (n_treated - 1) +
-                ((var_control / n_control) ** 2) / (n_control - 1)
-            )
-            )
+    def compare_groups(self, data: Union[pd.DataFrame, ExperimentAccumulator], metrics: List[str], metric_types: List[str],
+                       groupname: str, pairs: List[Tuple[str, str]], is_two_sided: bool = True,
+                       alternative: str = 'two-sided', on_error: str = 'raise',
+                       result: str = 'full') -> ComparisonTable:
+        """
+        Test every metric for every (treated, control) pair from one grouped pass over the data.
 
-        # Calculate T Statistic
-        t_stat = (treated_mean - control_mean) / std_error
-        
-        # 计算 p 值
-        if is_two_sided:
-            p_value = stats.t.sf(np.abs(t_stat), df) * 2
-        else:
-            if alternative == 'greater':
-                p_value = stats.t.sf(np.abs(t_stat), df)
-            elif alternative == 'less':
-                p_value = stats.t.cdf(np.abs(t_stat), df)
-
-        # 构建置信区间
-        if alternative == 'two-sided':
-            t_value = stats.t.ppf(1 - self.alpha/2, df)
-            margin = t_value * std_error
-            ci = [round(mae - margin, 6), round(mae + margin, 6)]
-        else:
-            t_value = stats.t.ppf(1 - self.alpha, df)
-            if alternative == 'less':
-                ci = [float('-inf'), round(mae + t_value * std_error, 6)]
-            else:  # alternative == 'greater'
-                ci = [round(mae - t_value * std_error, 6), float('inf')]
-
-        # 计算显著性
-        sig = "显著" if p_value < self.alpha else "不显著"
-        
-        return [treated_mean, control_mean, mae, mape, t_stat, p_value, sig, ci]
-
-    def _get_ratio_variance(self, x: np.ndarray, y: np.ndarray) -> float:
-        """Calculate variance for ratio metrics."""
-        x_var = np.var(x, ddof=1)/len(x)
-        y_var = np.var(y, ddof=1)/len(y)
-        x_mean, y_mean = np.mean(x), np.mean(y)
-        cov = np.cov(x, y)[0,1]/len(x)
-        
-        return (1/pow(y_mean,2)*x_var + 
-                pow(x_mean,2)/pow(y_mean,4)*y_var - 
-                2*x_mean/pow(y_mean,3)*cov)
+        Per-group statistics of all metrics are computed once (see
+        group_stats.GroupedMetricStats); each comparison is a broadcast over those group
+        aggregates. Results equal the per-test functions, which are implemented on top
+        of this method.
 
-    def test_ratio(self, data: pd.DataFrame, groupname: str, treated_label: str,
-                   control_label: str, x_var: str, y_var: str, is_two_sided: bool = True,
-                   alternative: str = 'two-sided') -> List:
-        """Conduct statistical test for ratio metrics."""
-        treated_data = data[data[groupname] == treated_label]
-        control_data = data[data[groupname] == control_label]
-        
-        x_treated, y_treated = treated_data[x_var], treated_data[y_var]
-        x_control, y_control = control_data[x_var], control_data[y_var]
-        
-        treated_ratio = np.sum(x_treated) / np.sum(y_treated)
-        control_ratio = np.sum(x_control) / np.sum(y_control)
-        
-        diff = treated_ratio - control_ratio
-        relative_diff = diff / control_ratio
-        
-        var_treat = self._get_ratio_variance(x_treated, y_treated)
-        var_control = self._get_ratio_variance(x_control, y_control)
-        n_treat,n_control = len(treated_data),len(control_data)
+        ``data`` may also be an accumulators.ExperimentAccumulator holding the merged
+        state of earlier batches; the tests then run on that state (``groupname`` is
+        unused), so the per-test functions accept accumulators as well.
 
-        std_error = np.sqrt(
-            self._get_ratio_variance(x_treated, y_treated) +
-            self._get_ratio_variance(x_control, y_control)
-        )
+        Args:
+            data (pd.DataFrame or ExperimentAccumulator): Input dataset or accumulated state
+            metrics (List[str]): Metrics to test; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): List of metric types ('mean', 'ratio', or 'proportion')
+            groupname (str): Column name containing group labels
+            pairs (List[Tuple[str, str]]): (treated label, control label) pairs
+            is_two_sided (bool): Whether to perform two-sided test
+            alternative (str): 'two-sided', 'less', or 'greater'
+            on_error (str): 'raise', or 'collect' to report per-metric errors in the table
+            result (str): 'full', or 'stats' for estimates and test statistics only (no
+                p-values, significance or confidence intervals), for callers that only rank by |t|
 
-        df = (var_treat + var_control) ** 2 / ((var_treat ** 2) / (n_treat - 1) + (var_control ** 2) / (n_control - 1))
-        
-        t_stat = diff / std_error
-        
-        # 计算P值
-        if is_two_sided:
-            p_value = stats.t.sf(np.abs(t_stat), df) * 2
-        else:
-            if alternative == 'greater':
-                p_value = stats.t.sf(np.abs(t_stat), df)
-            elif alternative == 'less':
-                p_value = stats.t.cdf(np.abs(t_stat), df)
-
-        # 构建增量delta的置信区间
-        # 置信区间与显著性判断
-        if is_two_sided:
-            t_value = stats.t.ppf(1 - self.alpha/2, df)
-            margin = t_value * std_error
-            ci = [round(diff - margin, 6), round(diff + margin, 6)]
+        Returns:
+            ComparisonTable: One entry per (pair, metric), pair-major
+        """
+        if isinstance(data, ExperimentAccumulator):
+            group_stats = data.group_stats(metrics)
+            if list(group_stats.metric_types) != list(metric_types):
+                raise ValueError("metric_types do not match the accumulated metrics")
         else:
-            t_value = stats.t.ppf(1 - self.alpha, df)
-            if alternative == 'less':
-                ci = [float('-inf'), round(diff + t_value * std_error, 6)]
-            else:  # alternative == 'greater'
-                ci = [round(diff - t_value * std_error, 6), float('inf')]
-        
-        sig = "显著" if p_value < self.alpha else "不显著"
-        
-        return [treated_ratio, control_ratio, diff, relative_diff, t_stat, p_value, sig, ci]
+            group_stats = GroupedMetricStats(data, groupname, metrics, metric_types, on_error=on_error)
+        return group_stats.compare(pairs, is_two_sided, alternative, self.alpha, result)
 
-    def test_proportion(self, data: pd.DataFrame, groupname: str, treated_label: str,
-                       control_label: str, metric: str, is_two_sided: bool = True,
-                       alternative: str = 'two-sided') -> List:
-        
-        """Conduct binomial test for proportion metrics."""
+    def compare_segments(self, data: pd.DataFrame, metrics: List[str], metric_types: List[str], groupname: str,
+                         segment_by: List[str], pairs: List[Tuple[str, str]], is_two_sided: bool = True,
+                         alternative: str = 'two-sided', result: str = 'full') -> ComparisonTable:
+        """
+        Test every metric for every (treated, control) pair within every segment, in one grouped pass.
 
-        treated = data[data[groupname] == treated_label][metric]
-        control = data[data[groupname] == control_label][metric]
-        
-        treated_rate = treated.mean()
-        control_rate = control.mean()
-        
-        diff = treated_rate - control_rate
-        relative_diff = diff / control_rate
-        
-        std_error = np.sqrt(
-            treated_rate*(1-treated_rate)/len(treated) +
-            control_rate*(1-control_rate)/len(control)
-        )
-        
-        t_stat = diff / std_error
-        
-        if is_two_sided:
-            p_value = 2 * stats.norm.sf(abs(t_stat))
-        else:
-            if alternative == 'greater':
-                p_value = stats.norm.sf(np.abs(t_stat))
-            elif alternative == 'less':
-                p_value = stats.norm.cdf(np.abs(t_stat))
-
-        if is_two_sided:
-            z_value = stats.norm.ppf(1 - self.alpha/2)
-            ci = [round(diff - z_value * std_error, 6),round(diff + z_value * std_error, 6)]
-        else:
-            if alternative == 'greater':
-                z_value = stats.norm.ppf(1 - self.alpha)
-                ci = [round(diff - z_value * std_error, 6), float('inf')]
-            elif alternative == 'less':
-                z_value = stats.norm.ppf(1 - self.alpha)
-                ci = [float('-inf'), round(diff + z_value * std_error, 6)]
-        
-        sig = "显著" if p_value < self.alpha else "不显著"
+        The rows are grouped once by (group, *segment) keys, so the cost grows with the
+        number of rows and not with rows x segments; every within-segment comparison is
+        then a broadcast over those group aggregates. Segments are ordered by first
+        appearance; a pair is compared in a segment only if both groups have rows there,
+        and rows with a missing segment value are left out.
+
+        Args:
+            data (pd.DataFrame): Input dataset
+            metrics (List[str]): Metrics to test; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): List of metric types ('mean', 'ratio', or 'proportion')
+            groupname (str): Column name containing group labels
+            segment_by (List[str]): Segment columns, e.g. ['platform', 'city_tier']
+            pairs (List[Tuple[str, str]]): (treated label, control label) pairs
+            is_two_sided (bool): Whether to perform two-sided test
+            alternative (str): 'two-sided', 'less', or 'greater'
+            result (str): 'full', or 'stats' for estimates and test statistics only
+
+        Returns:
+            ComparisonTable: Segment-major entries whose labels are (group, *segment values) tuples
+        """
+        if isinstance(data, ExperimentAccumulator):
+            raise ValueError("Segment breakdowns need row-level data, not an accumulated state")
+        group_stats = GroupedMetricStats(data, [groupname] + list(segment_by), metrics, metric_types)
+        present = set(group_stats.labels)
+        segment_pairs = [((treated,) + segment, (control,) + segment)
+                         for segment in dict.fromkeys(label[1:] for label in group_stats.labels)
+                         for treated, control in pairs
+                         if (treated,) + segment in present and (control,) + segment in present]
+        return group_stats.compare(segment_pairs, is_two_sided, alternative, self.alpha, result)
+
+    def create_sequential_test(self, metrics: List[str], metric_types: List[str], control_label: str,
+                               relative_effect: float = DEFAULT_RELATIVE_EFFECT,
+                               mixing_variance: List[float] = None) -> SequentialTest:
+        """
+        Always-valid (mSPRT) test state for continuously monitored experiments.
+
+        Feed it batches of new rows with ``update(data, groupname)``; p-values and
+        confidence sequences stay valid however often the results are looked at.
+
+        Args:
+            metrics (List[str]): Metrics to test; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): List of metric types ('mean', 'ratio', or 'proportion')
+            control_label (str): Label for control group
+            relative_effect (float): Mixing standard deviation relative to the control estimate
+            mixing_variance (List[float], optional): Explicit mixing variance per metric
+
+        Returns:
+            SequentialTest: Empty sequential test state
+        """
+        return SequentialTest(metrics, metric_types, control_label, self.alpha, relative_effect, mixing_variance)
+
+    def compare_summary_stats(self, summaries: Dict[str, Dict[str, float]], metric_type: str,
+                              pairs: List[Tuple[str, str]], is_two_sided: bool = True,
+                              alternative: str = 'two-sided') -> ComparisonTable:
+        """
+        Test one metric for every (treated, control) pair from pre-aggregated group statistics.
+
+        Cost and payload size do not depend on the number of units: each group is
+        described by its size and sums (see sufficient_stats.SUMMARY_FIELDS).
+
+        Args:
+            summaries (Dict[str, Dict]): Group label -> summary statistics, e.g.
+                {'n': 1000, 'sum': 5230.5, 'sum_sq': 40110.2} for mean and proportion
+                metrics, or n, sum_x, sum_y, sum_x_sq, sum_y_sq, sum_xy for ratio metrics
+            metric_type (str): 'mean', 'ratio', or 'proportion'
+            pairs (List[Tuple[str, str]]): (treated label, control label) pairs
+            is_two_sided (bool): Whether to perform two-sided test
+            alternative (str): 'two-sided', 'less', or 'greater'
+
+        Returns:
+            ComparisonTable: One entry per pair
+        """
+        layout = MomentLayout(['x/y' if metric_type == 'ratio' else 'x'], [metric_type])
+        moments = summary_moments(list(summaries.values()), metric_type)
+        group_stats = GroupedMetricStats.from_moments(list(summaries), layout, moments)
+        return group_stats.compare(pairs, is_two_sided, alternative, self.alpha)
+
+    def _test_summary(self, treated_stats: Dict[str, float], control_stats: Dict[str, float],
+                      metric_type: str, is_two_sided: bool, alternative: str) -> List:
+        summaries = {'treatment': treated_stats, 'control': control_stats}
+        return self.compare_summary_stats(summaries, metric_type, [('treatment', 'control')],
+                                          is_two_sided, alternative).test_result(0)
+
+    def test_mean_summary(self, treated_stats: Dict[str, float], control_stats: Dict[str, float],
+                          is_two_sided: bool = True, alternative: str = 'two-sided') -> List:
+        """Conduct t-test for mean metrics from group summaries (n, sum, sum_sq)."""
+        return self._test_summary(treated_stats, control_stats, 'mean', is_two_sided, alternative)
+
+    def test_ratio_summary(self, treated_stats: Dict[str, float], control_stats: Dict[str, float],
+                           is_two_sided: bool = True, alternative: str = 'two-sided') -> List:
+        """Conduct statistical test for ratio metrics from group summaries (n, sum_x, sum_y, sum_x_sq, sum_y_sq, sum_xy)."""
+        return self._test_summary(treated_stats, control_stats, 'ratio', is_two_sided, alternative)
+
+    def test_proportion_summary(self, treated_stats: Dict[str, float], control_stats: Dict[str, float],
+                                is_two_sided: bool = True, alternative: str = 'two-sided') -> List:
+        """Conduct binomial test for proportion metrics from group summaries (n, sum)."""
+        return self._test_summary(treated_stats, control_stats, 'proportion', is_two_sided, alternative)
+
+    def test_mean(self, data: Union[pd.DataFrame, ExperimentAccumulator], groupname: str, treated_label: str, 
+                  control_label: str, test_metric: str, is_two_sided: bool = True, 
+                  alternative: str = 'two-sided', result: str = 'full') -> List:
+        """Conduct t-test for mean metrics (``result='stats'`` skips p-value, significance and CI)."""
+        return self.compare_groups(data, [test_metric], ['mean'], groupname, [(treated_label, control_label)],
+                                   is_two_sided, alternative, result=result).test_result(0)
+
+    def test_ratio(self, data: Union[pd.DataFrame, ExperimentAccumulator], groupname: str, treated_label: str,
+                   control_label: str, x_var: str, y_var: str, is_two_sided: bool = True,
+                   alternative: str = 'two-sided', result: str = 'full') -> List:
+        """Conduct statistical test for ratio metrics (``result='stats'`` skips p-value, significance and CI)."""
+        return self.compare_groups(data, [[x_var, y_var]], ['ratio'], groupname, [(treated_label, control_label)],
+                                   is_two_sided, alternative, result=result).test_result(0)
+
+    def test_proportion(self, data: Union[pd.DataFrame, ExperimentAccumulator], groupname: str, treated_label: str,
+                       control_label: str, metric: str, is_two_sided: bool = True,
+                       alternative: str = 'two-sided', result: str = 'full') -> List:
         
-        return [treated_rate, control_rate, diff, relative_diff, t_stat, p_value, sig, ci]
+        """Conduct binomial test for proportion metrics (``result='stats'`` skips p-value, significance and CI)."""
+        return self.compare_groups(data, [metric], ['proportion'], groupname, [(treated_label, control_label)],
+                                   is_two_sided, alternative, result=result).test_result(0)
 
     def run_statistical_tests(self, data: pd.DataFrame, metrics: List[str], 
                             metric_types: List[str], groupname: str,
                             treated_labels: Union[str, List[str]], control_label: str,
                             is_two_sided: bool = True, alternative: str = 'two-sided',
-                            bh_correction: bool = False) -> pd.DataFrame:
+                            bh_correction: bool = False, bootstrap_replicates: int = 0,
+                            random_state: int = None, n_workers: int = 1,
+                            permutations: int = 0, segment_by: Union[str, List[str]] = None) -> pd.DataFrame:
         """
         Run statistical tests for multiple metrics and multiple treatment groups.
         
@@ -369,6 +513,16 @@ class ExperimentAnalysisWithSeedFinder:
             control_label (str): Label for control group
             is_two_sided (bool): Whether to perform two-sided test
             alternative (str): 'two-sided', 'less', or 'greater'
+            bh_correction (bool): Add Benjamini-Hochberg adjusted p-values
+            bootstrap_replicates (int): With > 0, add Poisson-bootstrap standard errors and
+                percentile intervals of the differences (see bootstrap_tests)
+            random_state (int): Master seed of the bootstrap weights and permutations
+            n_workers (int): Bootstrap and permutation worker processes
+            permutations (int): With > 0, add permutation p-values from at most this many
+                permutations per treatment group (see permutation_tests)
+            segment_by (str or List[str]): Segment columns; with them every test is run within
+                every segment in one grouped pass (see compare_segments), the result gains one
+                column per segment column and bh_correction adjusts across all segment tests
         
         Returns:
             pd.DataFrame: Statistical test results
@@ -377,42 +531,38 @@ class ExperimentAnalysisWithSeedFinder:
         if isinstance(treated_labels, str):
             treated_labels = [treated_labels]
         
-        results = []
-        for treated_label in treated_labels:
-            for metric, metric_type in zip(metrics, metric_types):
-                if metric_type == 'mean':
-                    result = self.test_mean(data, groupname, treated_label, control_label,
-                                          metric, is_two_sided, alternative)
-                elif metric_type == 'ratio':
-                    # 支持数组格式和字符串格式的比率指标
-                    if isinstance(metric, list) and len(metric) == 2:
-                        # 数组格式：[numerator, denominator]
-                        x_var, y_var = metric[0], metric[1]
-                    else:
-                        # 字符串格式：x_var/y_var
-                        x_var, y_var = metric.split('/')
-                    result = self.test_ratio(data, groupname, treated_label, control_label,
-                                           x_var, y_var, is_two_sided, alternative)
-                elif metric_type == 'proportion':
-                    result = self.test_proportion(data, groupname, treated_label, control_label,
-                                               metric, is_two_sided, alternative)
-                else:
-                    raise ValueError(f"Unsupported metric type: {metric_type}")
-                
-                results.append([treated_label, metric] + result)
-        
-        results_df = pd.DataFrame(
-            results,
-            columns=['Treatment_Group', 'Metric', 'Treatment_Value', 'Control_Value',
-                    'Absolute_Diff', 'Relative_Diff', 'T_Statistic', 'P_Value',
-                    'Significance','Confidence_Interval']
-        )
+        # One grouped pass for all metrics; every treatment-vs-control test is broadcast from it
+        pairs = [(treated_label, control_label) for treated_label in treated_labels]
+        segments = {}
+        if segment_by:
+            segment_by = [segment_by] if isinstance(segment_by, str) else list(segment_by)
+            if bootstrap_replicates > 0 or permutations > 0:
+                raise ValueError("segment_by cannot be combined with bootstrap or permutation tests")
+            table = self.compare_segments(data, metrics, metric_types, groupname, segment_by, pairs,
+                                          is_two_sided, alternative)
+            segments = {column: [label[k + 1] for label in table.treated_labels]
+                        for k, column in enumerate(segment_by)}
+            table.treated_labels = [label[0] for label in table.treated_labels]
+        else:
+            table = self.compare_groups(data, metrics, metric_types, groupname, pairs, is_two_sided, alternative)
+        results_df = pd.DataFrame({
+            **segments,
+            'Treatment_Group': table.treated_labels,
+            'Metric': table.metrics,
+            'Treatment_Value': table.treatment_value,
+            'Control_Value': table.control_value,
+            'Absolute_Diff': table.absolute_diff,
+            'Relative_Diff': table.relative_diff,
+            'T_Statistic': table.t_statistic,
+            'P_Value': table.p_value,
+            'Significance': table.significance,
+            'Confidence_Interval': [[lower, upper] for lower, upper in zip(table.ci_lower, table.ci_upper)],
+        })
         
         # Round all numeric columns to 6 decimal places
         numeric_columns = ['Treatment_Value', 'Control_Value', 'Absolute_Diff', 
                          'Relative_Diff', 'T_Statistic', 'P_Value']
-        for col in numeric_columns:
-            results_df[col] = results_df[col].apply(lambda x: round(x, 6) if isinstance(x, (int, float)) else x)
+        results_df[numeric_columns] = results_df[numeric_columns].round(6)
 
         if bh_correction:
             _, p_values, _, _ = multipletests(results_df['P_Value'], method='fdr_bh')
@@ -422,4 +572,100 @@ class ExperimentAnalysisWithSeedFinder:
                 lambda x: "显著" if x else "不显著"
             )
         
-        return results_df 
\ No newline at end of file
+        if bootstrap_replicates > 0:
+            bootstrap = self.bootstrap_tests(data, metrics, metric_types, groupname, treated_labels, control_label,
+                                             n_replicates=bootstrap_replicates, random_state=random_state,
+                                             n_workers=n_workers)
+            results_df['Bootstrap_SE'] = np.round(bootstrap.standard_error, 6)
+            results_df['Bootstrap_CI'] = [[round(lower, 6), round(upper, 6)]
+                                          for lower, upper in zip(bootstrap.ci_lower, bootstrap.ci_upper)]
+
+        if permutations > 0:
+            permutation = self.permutation_tests(data, metrics, metric_types, groupname, treated_labels,
+                                                 control_label, is_two_sided, alternative,
+                                                 max_permutations=permutations, random_state=random_state,
+                                                 n_workers=n_workers)
+            results_df['Permutation_P_Value'] = np.round(permutation.p_value, 6)
+            results_df['Permutations'] = permutation.n_permutations
+        
+        return results_df
+
+    def bootstrap_tests(self, data: ChunkSource, metrics: List[str], metric_types: List[str], groupname: str,
+                        treated_labels: Union[str, List[str]], control_label: str,
+                        n_replicates: int = DEFAULT_BOOTSTRAP_REPLICATES, random_state: int = None,
+                        n_workers: int = 1, memory_budget: int = DEFAULT_BOOTSTRAP_MEMORY,
+                        chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> BootstrapResult:
+        """
+        Poisson-bootstrap confidence intervals for heavy-tailed metrics.
+
+        Every replicate is a weighted reduction with Poisson(1) row weights, computed in
+        batches as matrix products over chunks of the data (see bootstrap.poisson_bootstrap),
+        so files are streamed and never fully loaded.
+
+        Args:
+            data: Input dataset, CSV/Parquet path or iterable of DataFrame chunks
+            metrics (List[str]): Metrics to test; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): List of metric types ('mean', 'ratio', or 'proportion')
+            groupname (str): Column name containing group labels
+            treated_labels (str or List[str]): Label(s) for treatment group(s)
+            control_label (str): Label for control group
+            n_replicates (int): Number of bootstrap replicates
+            random_state (int): Master seed (None draws fresh entropy and reports it)
+            n_workers (int): Number of worker processes (1 = serial)
+            memory_budget (int): Bytes of weight matrices materialized at once per process
+            chunk_size (int): Rows per chunk
+
+        Returns:
+            BootstrapResult: Entries in the order of run_statistical_tests
+        """
+        if isinstance(data, ExperimentAccumulator):
+            raise ValueError("The bootstrap needs row-level data, not an accumulated state")
+        if isinstance(treated_labels, str):
+            treated_labels = [treated_labels]
+        return poisson_bootstrap(data, groupname, metrics, metric_types,
+                                 [(treated_label, control_label) for treated_label in treated_labels],
+                                 n_replicates=n_replicates, alpha=self.alpha, random_state=random_state,
+                                 n_workers=n_workers, memory_budget=memory_budget, chunk_size=chunk_size)
+
+    def permutation_tests(self, data: pd.DataFrame, metrics: List[str], metric_types: List[str], groupname: str,
+                          treated_labels: Union[str, List[str]], control_label: str,
+                          is_two_sided: bool = True, alternative: str = 'two-sided',
+                          max_permutations: int = DEFAULT_MAX_PERMUTATIONS,
+                          stopping_confidence: float = DEFAULT_STOPPING_CONFIDENCE,
+                          random_state: int = None, n_workers: int = 1) -> PermutationResult:
+        """
+        Permutation p-values for small or skewed experiments.
+
+        Only a group indicator is shuffled; the permuted group sums of all metrics are
+        batched matrix products and the Welch / delta-method statistics are recomputed
+        from them (see permutation.permutation_test). A comparison stops early once the
+        Monte Carlo interval of its p-value is clearly on one side of alpha.
+
+        Args:
+            data (pd.DataFrame): Input dataset
+            metrics (List[str]): Metrics to test; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): List of metric types ('mean', 'ratio', or 'proportion')
+            groupname (str): Column name containing group labels
+            treated_labels (str or List[str]): Label(s) for treatment group(s)
+            control_label (str): Label for control group
+            is_two_sided (bool): Whether to perform two-sided tests
+            alternative (str): 'less' or 'greater' for one-sided tests
+            max_permutations (int): Permutations per treatment group without early stopping
+            stopping_confidence (float): Confidence of the early-stopping rule (None disables it)
+            random_state (int): Master seed (None draws fresh entropy and reports it)
+            n_workers (int): Number of worker processes (1 = serial)
+
+        Returns:
+            PermutationResult: Entries in the order of run_statistical_tests
+        """
+        if isinstance(data, ExperimentAccumulator):
+            raise ValueError("Permutation tests need row-level data, not an accumulated state")
+        if isinstance(treated_labels, str):
+            treated_labels = [treated_labels]
+        if not is_two_sided and alternative not in ('less', 'greater'):
+            raise ValueError("One-sided tests need alternative='less' or 'greater'")
+        return permutation_test(data, groupname, metrics, metric_types,
+                                [(treated_label, control_label) for treated_label in treated_labels],
+                                alternative='two-sided' if is_two_sided else alternative, alpha=self.alpha,
+                                max_permutations=max_permutations, stopping_confidence=stopping_confidence,
+                                random_state=random_state, n_workers=n_workers)
@@ -0,0 +1,394 @@
+"""
+Grouped test engine
+一次分组计算所有指标的组级统计量，通过广播得到对照组-实验组及任意两组之间的检验结果
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy import special
+
+from sufficient_stats import MomentLayout, group_estimates, parse_ratio_metric
+
+# 'full' computes p-values, significance and confidence intervals; 'stats' stops at the
+# estimates and test statistics (hot paths that only rank by |t|)
+RESULT_MODES = ('full', 'stats')
+
+
+def factorize_keys(data: pd.DataFrame, columns: Union[str, List[str]]) -> Tuple[np.ndarray, List]:
+    """
+    Integer code of every row's key and the key of every code, in order of first appearance.
+
+    ``columns`` is one column (keys are its values) or a list of columns (keys are tuples,
+    e.g. (group, platform)); rows with a missing key value get code -1. Each column is
+    factorized once and the codes are combined arithmetically, so the cost is linear in
+    the rows whatever the number of distinct keys.
+    """
+    if not isinstance(columns, (list, tuple)):
+        codes, uniques = pd.factorize(data[columns])
+        return codes, list(uniques)
+    combined = np.zeros(len(data), dtype=np.int64)
+    missing = np.zeros(len(data), dtype=bool)
+    levels = []
+    for column in columns:
+        codes, uniques = pd.factorize(data[column])
+        combined = combined * max(len(uniques), 1) + codes
+        missing |= codes < 0
+        levels.append(uniques)
+    codes = np.full(len(data), -1, dtype=np.intp)
+    codes[~missing], unique_keys = pd.factorize(combined[~missing])
+    parts = []
+    for uniques in reversed(levels):
+        unique_keys, position = np.divmod(unique_keys, max(len(uniques), 1))
+        parts.append(np.asarray(uniques, dtype=object)[position])
+    return codes, list(zip(*reversed(parts)))
+
+
+def tail_probabilities(abs_t: np.ndarray, dof: np.ndarray, is_normal: np.ndarray, is_two_sided: bool,
+                       alternative: str) -> np.ndarray:
+    """
+    p-values of many tests with one vectorized call per distribution family.
+
+    Calls the scipy.special kernels behind stats.t / stats.norm directly (same values,
+    without the per-call dispatch of the distribution objects). One-sided tests are
+    evaluated at |t| (the convention of the per-test functions).
+
+    Args:
+        abs_t (np.ndarray): Absolute test statistics
+        dof (np.ndarray): Degrees of freedom of the t tests
+        is_normal (np.ndarray): Tests using the normal distribution (proportions)
+        is_two_sided (bool): Whether the tests are two-sided
+        alternative (str): 'less' or 'greater' for one-sided tests
+    """
+    # sf(|t|) = cdf(-|t|)
+    x = -abs_t if is_two_sided or alternative == 'greater' else abs_t
+    p_value = np.empty(len(abs_t))
+    p_value[is_normal] = special.ndtr(x[is_normal])
+    p_value[~is_normal] = special.stdtr(dof[~is_normal], x[~is_normal])
+    if is_two_sided:
+        p_value *= 2
+    return p_value
+
+
+def critical_values(alpha: float, two_sided: np.ndarray, dof: np.ndarray) -> np.ndarray:
+    """
+    Critical values of many tests with one vectorized quantile call per distribution family.
+
+    Like tail_probabilities this calls the scipy.special kernels directly; the function
+    keeps no state, so request and job threads share it freely.
+
+    Args:
+        alpha (float): Significance level
+        two_sided (np.ndarray): Whether each interval is two-sided (quantile 1 - alpha / 2)
+        dof (np.ndarray): Degrees of freedom per test (inf = normal, NaN = undefined)
+
+    Returns:
+        np.ndarray: Critical values (NaN where dof is NaN)
+    """
+    dof = np.asarray(dof, dtype=np.float64)
+    level = np.where(np.broadcast_to(two_sided, dof.shape), 1 - alpha / 2, 1 - alpha)
+    out = np.full(dof.shape, np.nan)
+    normal = np.isinf(dof)
+    student = ~normal & ~np.isnan(dof)
+    out[normal] = special.ndtri(level[normal])
+    out[student] = special.stdtrit(dof[student], level[student])
+    return out
+
+
+@dataclass
+class ComparisonTable:
+    """
+    Results of several group comparisons for several metrics, one entry per
+    (pair, metric) in pair-major order.
+
+    Attributes:
+        treated_labels (List): Treated group of every entry
+        control_labels (List): Control group of every entry
+        metrics (List): Metric of every entry (as given; ratio metrics may be lists)
+        metric_types (List[str]): Metric type of every entry
+        treatment_value, control_value (np.ndarray): Group means, rates or ratios
+        absolute_diff, relative_diff (np.ndarray): Treated minus control, and relative to control
+        t_statistic, p_value, dof (np.ndarray): Test statistic, p-value and Welch degrees of
+            freedom (NaN for proportion metrics, which use the normal distribution)
+        significance (np.ndarray): "显著" / "不显著"
+        ci_lower, ci_upper (np.ndarray): Confidence interval of the difference (rounded to 6
+            decimals, ±inf on the open side of one-sided tests)
+        treatment_size, control_size (np.ndarray): Non-missing observations per group
+        errors (List[Optional[str]]): Error message of entries whose metric could not be computed
+    """
+    treated_labels: List
+    control_labels: List
+    metrics: List
+    metric_types: List[str]
+    treatment_value: np.ndarray
+    control_value: np.ndarray
+    absolute_diff: np.ndarray
+    relative_diff: np.ndarray
+    t_statistic: np.ndarray
+    p_value: np.ndarray
+    dof: np.ndarray
+    significance: np.ndarray
+    ci_lower: np.ndarray
+    ci_upper: np.ndarray
+    treatment_size: np.ndarray
+    control_size: np.ndarray
+    errors: List[Optional[str]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.metrics)
+
+    def test_result(self, i: int) -> List:
+        """Entry ``i`` in the per-test format of test_mean/test_ratio/test_proportion."""
+        return [self.treatment_value[i], self.control_value[i], self.absolute_diff[i], self.relative_diff[i],
+                self.t_statistic[i], self.p_value[i], self.significance[i], [self.ci_lower[i], self.ci_upper[i]]]
+
+
+class GroupedMetricStats:
+    """
+    Per-group statistics of several metrics from one grouping of the rows.
+
+    The rows are partitioned once (a stable sort on the group codes keeps every
+    group's rows in their original order), then each metric costs one reduction per
+    group and statistic: row count, non-missing count, mean and variance, plus Σx,
+    Σy and cov(x, y) for ratio metrics. Any comparison is then a broadcast over these
+    group aggregates (see compare).
+
+    Missing values are treated exactly like the per-test functions did: means,
+    sums and variances skip them (pandas skipna), the group row count is used as n,
+    and a ratio metric with a missing value in a group has an undefined covariance.
+    """
+
+    def __init__(self, data: pd.DataFrame, groupname: Union[str, List[str]], metrics: Sequence[Union[str, List[str]]],
+                 metric_types: Sequence[str], on_error: str = 'raise'):
+        """
+        Args:
+            data (pd.DataFrame): Input dataset
+            groupname (str or List[str]): Column name containing group labels, or several
+                columns whose value tuples are the groups (e.g. group and segment columns)
+            metrics (List): Metrics; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): 'mean', 'proportion' or 'ratio' per metric
+            on_error (str): 'raise', or 'collect' to record the error of a metric that cannot
+                be computed (missing column, unknown type) or of a comparison with an empty
+                group in ``errors`` and continue
+        """
+        if len(metrics) != len(metric_types):
+            raise ValueError("metrics and metric_types must have the same length")
+        self.metrics = list(metrics)
+        self.metric_types = list(metric_types)
+        self.on_error = on_error
+        codes, self.labels = factorize_keys(data, groupname)
+        self._index = {label: i for i, label in enumerate(self.labels)}
+        n_groups = len(self.labels)
+        # Rows of group g are order[bounds[g]:bounds[g + 1]]; the extra last group is empty
+        # and stands for labels without rows
+        self._order = np.argsort(codes, kind='stable')
+        self._bounds = np.append(np.searchsorted(codes[self._order], np.arange(n_groups + 1)), len(codes))
+        self.rows = np.diff(self._bounds).astype(np.float64)
+
+        shape = (len(self.metrics), n_groups + 1)
+        self.estimate = np.full(shape, np.nan)       # mean, rate or Σx / Σy
+        self.variance = np.full(shape, np.nan)       # variance of the estimate
+        self.counts = np.zeros(shape, dtype=np.int64)  # non-missing observations (numerator column)
+        self.errors: Dict[int, str] = {}
+        for i, (metric, metric_type) in enumerate(zip(self.metrics, self.metric_types)):
+            try:
+                self._compute(i, data, metric, metric_type)
+            except Exception as e:
+                if on_error != 'collect':
+                    raise
+                self.errors[i] = str(e)
+
+    @classmethod
+    def from_estimates(cls, labels: Sequence, metrics: Sequence, metric_types: Sequence[str],
+                       estimate: np.ndarray, variance: np.ndarray, counts: np.ndarray) -> 'GroupedMetricStats':
+        """
+        Engine over precomputed per-group statistics instead of rows.
+
+        Used for pre-aggregated inputs (summary statistics, accumulators) whose rows
+        never reach this process.
+
+        Args:
+            labels (List): Group labels
+            metrics (List): Metrics; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): 'mean', 'proportion' or 'ratio' per metric
+            estimate, variance (np.ndarray): Estimate and variance of the estimate, shape (M, G)
+            counts (np.ndarray): Observations per metric and group, shape (M, G)
+        """
+        self = cls.__new__(cls)
+        self.metrics = list(metrics)
+        self.metric_types = list(metric_types)
+        self.on_error = 'raise'
+        self.labels = list(labels)
+        self._index = {label: i for i, label in enumerate(self.labels)}
+        # A group's size is its largest metric count; the extra last group is empty
+        counts = np.asarray(counts, dtype=np.float64).reshape(len(self.metrics), len(self.labels))
+        self.rows = np.append(counts.max(axis=0, initial=0.0), 0.0)
+        shape = (len(self.metrics), len(self.labels) + 1)
+        self.estimate = np.full(shape, np.nan)
+        self.variance = np.full(shape, np.nan)
+        self.counts = np.zeros(shape, dtype=np.int64)
+        self.estimate[:, :-1] = estimate
+        self.variance[:, :-1] = variance
+        self.counts[:, :-1] = counts
+        self.errors = {}
+        return self
+
+    @classmethod
+    def from_moments(cls, labels: Sequence, layout: MomentLayout, moments: np.ndarray) -> 'GroupedMetricStats':
+        """
+        Engine over per-group sufficient statistics (see from_estimates).
+
+        Estimates and variances follow sufficient_stats.group_estimates, so the
+        comparisons match the row-level tests up to floating-point rounding.
+
+        Args:
+            labels (List): Group labels, one per row of ``moments``
+            layout (MomentLayout): Metric layout of the moment columns (uncentered)
+            moments (np.ndarray): Group moments, shape (G, C) with n in column 0
+        """
+        estimates = [group_estimates(moments, columns, metric_type)
+                     for columns, metric_type in zip(layout.metric_columns, layout.metric_types)]
+        return cls.from_estimates(labels, layout.metrics, layout.metric_types,
+                                  np.array([e[0] for e in estimates]), np.array([e[1] for e in estimates]),
+                                  np.tile(moments[:, 0], (layout.n_metrics, 1)))
+
+    def group_index(self, label) -> int:
+        """Position of ``label`` in the group arrays (the empty group if it has no rows)."""
+        return self._index.get(label, len(self.labels))
+
+    def _group_slices(self, data: pd.DataFrame, column: str):
+        values = data[column].to_numpy(dtype=np.float64, na_value=np.nan)[self._order]
+        for g in range(len(self.labels)):
+            yield g, values[self._bounds[g]:self._bounds[g + 1]]
+
+    @staticmethod
+    def _skipna_moments(values: np.ndarray) -> Tuple[int, float, float, float]:
+        """Non-missing count, sum, mean and ddof=1 variance, computed like pandas with skipna."""
+        mask = np.isnan(values)
+        count = int(len(values) - mask.sum())
+        filled = np.where(mask, 0.0, values)
+        total = filled.sum()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / count if count else np.nan
+            if count <= 1:
+                return count, total, mean, np.nan
+            squares = (total / count - filled) ** 2
+            squares[mask] = 0.0
+            return count, total, mean, squares.sum() / (count - 1)
+
+    def _compute(self, i: int, data: pd.DataFrame, metric, metric_type: str):
+        rows = self.rows
+        if metric_type in ('mean', 'proportion'):
+            for g, x in self._group_slices(data, metric):
+                count, _, mean, var = self._skipna_moments(x)
+                self.counts[i, g] = count
+                self.estimate[i, g] = mean
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    if metric_type == 'mean':
+                        self.variance[i, g] = var / rows[g]
+                    else:
+                        self.variance[i, g] = mean * (1 - mean) / rows[g]
+        elif metric_type == 'ratio':
+            x_column, y_column = parse_ratio_metric(metric)
+            for (g, x), (_, y) in zip(self._group_slices(data, x_column), self._group_slices(data, y_column)):
+                x_count, x_sum, x_mean, x_var = self._skipna_moments(x)
+                _, y_sum, y_mean, y_var = self._skipna_moments(y)
+                n = rows[g]
+                if len(x) > 1:
+                    cov = np.cov(x, y)[0, 1] / n
+                else:
+                    cov = np.nan
+                self.counts[i, g] = x_count
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    self.estimate[i, g] = x_sum / y_sum
+                    x_var, y_var = x_var / n, y_var / n
+                    # Delta-method variance of Σx / Σy
+                    self.variance[i, g] = (1 / y_mean ** 2 * x_var + x_mean ** 2 / y_mean ** 4 * y_var
+                                           - 2 * x_mean / y_mean ** 3 * cov)
+        else:
+            raise ValueError(f"Unknown metric type: {metric_type}")
+
+    def compare(self, pairs: Sequence[Tuple[object, object]], is_two_sided: bool = True,
+                alternative: str = 'two-sided', alpha: float = 0.05, result: str = 'full') -> ComparisonTable:
+        """
+        Compare every (treated, control) pair on every metric by broadcasting over the group aggregates.
+
+        Mean and ratio metrics use a Welch t-test (delta-method variance for ratios),
+        proportion metrics a normal test; p-values and critical values are one
+        vectorized call per distribution.
+
+        Args:
+            pairs (List[Tuple]): (treated label, control label) pairs
+            is_two_sided (bool): Whether to perform two-sided tests
+            alternative (str): 'two-sided', 'less', or 'greater'
+            alpha (float): Significance level
+            result (str): 'full', or 'stats' to skip p-values, significance and confidence
+                intervals (left NaN / None)
+
+        Returns:
+            ComparisonTable: One entry per (pair, metric), pair-major
+
+        Raises:
+            ZeroDivisionError: A group of a pair has no rows (unless on_error='collect')
+        """
+        if not is_two_sided and alternative not in ('less', 'greater'):
+            raise ValueError("One-sided tests need alternative='less' or 'greater'")
+        if result not in RESULT_MODES:
+            raise ValueError(f"result must be one of {RESULT_MODES}")
+        n_metrics = len(self.metrics)
+        treated = np.array([self.group_index(t) for t, _ in pairs], dtype=np.intp)
+        control = np.array([self.group_index(c) for _, c in pairs], dtype=np.intp)
+        metric_types = np.tile(np.array(self.metric_types, dtype=object), len(pairs))
+        is_mean = metric_types == 'mean'
+        is_proportion = metric_types == 'proportion'
+
+        # (pairs, metrics) -> flat pair-major entries
+        def take(values, groups):
+            return values[:, groups].T.ravel()
+
+        est_t, est_c = take(self.estimate, treated), take(self.estimate, control)
+        var_t, var_c = take(self.variance, treated), take(self.variance, control)
+        n_t, n_c = np.repeat(self.rows[treated], n_metrics), np.repeat(self.rows[control], n_metrics)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diff = est_t - est_c
+            relative = np.where(is_mean, est_t / est_c - 1, diff / est_c)
+            std_error = np.sqrt(var_t + var_c)
+            t_stat = diff / std_error
+            dof = (var_t + var_c) ** 2 / (var_t ** 2 / (n_t - 1) + var_c ** 2 / (n_c - 1))
+        dof[is_proportion] = np.nan
+
+        # Like the per-test functions, a comparison with an empty group is an error
+        empty = (self.rows[treated] == 0) | (self.rows[control] == 0)
+        if empty.any() and self.on_error != 'collect':
+            raise ZeroDivisionError("float division by zero")
+        errors = [self.errors.get(i, "float division by zero" if empty[p] else None)
+                  for p in range(len(pairs)) for i in range(n_metrics)]
+
+        if result == 'full':
+            p_value = tail_probabilities(np.abs(t_stat), dof, is_proportion, is_two_sided, alternative)
+            # Confidence intervals; mean metrics choose the interval type from ``alternative``,
+            # ratio and proportion metrics from ``is_two_sided``
+            two_sided_ci = np.where(is_mean, alternative == 'two-sided', is_two_sided)
+            critical = critical_values(alpha, two_sided_ci, np.where(is_proportion, np.inf, dof))
+            margin = critical * std_error
+            lower_open = ~two_sided_ci & (alternative == 'less')
+            upper_open = ~two_sided_ci & ~lower_open
+            ci_lower = np.where(lower_open, -np.inf, np.round(diff - margin, 6))
+            ci_upper = np.where(upper_open, np.inf, np.round(diff + margin, 6))
+            significance = np.where(p_value < alpha, "显著", "不显著").astype(object)
+        else:
+            p_value, ci_lower, ci_upper = (np.full(len(diff), np.nan) for _ in range(3))
+            significance = np.full(len(diff), None, dtype=object)
+        return ComparisonTable(
+            treated_labels=[t for t, _ in pairs for _ in range(n_metrics)],
+            control_labels=[c for _, c in pairs for _ in range(n_metrics)],
+            metrics=[metric for _ in pairs for metric in self.metrics],
+            metric_types=list(metric_types),
+            treatment_value=est_t, control_value=est_c, absolute_diff=diff, relative_diff=relative,
+            t_statistic=t_stat, p_value=p_value, dof=dof, significance=significance,
+            ci_lower=ci_lower, ci_upper=ci_upper,
+            treatment_size=take(self.counts, treated), control_size=take(self.counts, control),
+            errors=errors,
+        )
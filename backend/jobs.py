@@ -0,0 +1,180 @@
+"""
+Background job manager
+后台任务管理：在有界线程池中执行长时间任务，提供进度、取消以及按 TTL 淘汰的结果存储
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class JobCancelled(Exception):
+    """Raised from Job.report when the job has been cancelled; aborts the running work."""
+
+
+class Job:
+    """
+    State of one background job.
+
+    The job function receives the Job and calls ``report`` to publish progress; the
+    call raises JobCancelled once a cancellation has been requested.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = Job.QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.completed = 0
+        self.total = None
+        self.best = None
+        self.result = None
+        self.error = None
+        self.future = None
+        self._cancel_requested = threading.Event()
+        self._rate_origin = None    # (time, completed) the ETA extrapolates from
+
+    @property
+    def finished(self) -> bool:
+        return self.status in Job.FINISHED_STATES
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_requested.is_set()
+
+    def report(self, completed: int, total: int, best: Optional[Dict[str, Any]] = None):
+        """Publish progress (units of work done out of ``total``) and the best result so far."""
+        if self._rate_origin is None:
+            self._rate_origin = (self.started_at or time.time(), 0)
+        self.completed = completed
+        self.total = total
+        if best is not None:
+            self.best = best
+        self.raise_if_cancelled()
+
+    def raise_if_cancelled(self):
+        if self._cancel_requested.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def eta_seconds(self) -> Optional[float]:
+        """Remaining time extrapolated from the average progress rate since the job started."""
+        if self.status != Job.RUNNING or self._rate_origin is None or not self.total:
+            return None
+        origin_time, origin_completed = self._rate_origin
+        done = self.completed - origin_completed
+        if done <= 0:
+            return None
+        return (self.total - self.completed) * (time.time() - origin_time) / done
+
+    def to_dict(self, include_result: bool = True) -> Dict[str, Any]:
+        status = {
+            'jobId': self.id,
+            'type': self.kind,
+            'status': self.status,
+            'cancelRequested': self.cancel_requested,
+            'completed': self.completed,
+            'total': self.total,
+            'percentComplete': round(100.0 * self.completed / self.total, 2) if self.total else 0.0,
+            'best': self.best,
+            'etaSeconds': self.eta_seconds(),
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+        }
+        if self.error is not None:
+            status['error'] = self.error
+        if include_result and self.status == Job.COMPLETED:
+            status['result'] = self.result
+        return status
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool and keeps finished jobs for ``result_ttl`` seconds.
+
+    At most ``max_workers`` jobs run at once; further jobs wait in the queue, and
+    submissions beyond ``max_pending`` unfinished jobs are refused. Finished jobs are
+    evicted lazily on the next submit/get after their TTL has expired.
+    """
+
+    def __init__(self, max_workers: int = 2, result_ttl: float = 3600, max_pending: int = 100):
+        """
+        Args:
+            max_workers (int): Jobs executed concurrently
+            result_ttl (float): Seconds a finished job (and its result) stays retrievable
+            max_pending (int): Maximum number of queued or running jobs
+        """
+        self.result_ttl = result_ttl
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, func: Callable[[Job], Any]) -> Job:
+        """Queue ``func(job)``; its return value becomes the job result."""
+        with self._lock:
+            self._evict_expired()
+            if sum(not job.finished for job in self._jobs.values()) >= self.max_pending:
+                raise RuntimeError("Too many pending jobs, please retry later")
+            job = Job(kind)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job, func)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._evict_expired()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued job immediately or ask a running job to stop at its next report."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job._cancel_requested.set()
+            if job.future.cancel():
+                job.status = Job.CANCELLED
+                job.finished_at = time.time()
+            return job
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: Job, func: Callable[[Job], Any]):
+        if job.cancel_requested:
+            job.status = Job.CANCELLED
+            job.finished_at = time.time()
+            return
+        job.status = Job.RUNNING
+        job.started_at = time.time()
+        try:
+            result = func(job)
+        except JobCancelled:
+            job.status = Job.CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            job.status = Job.FAILED
+        else:
+            job.result = result
+            job.status = Job.COMPLETED
+        finally:
+            job.finished_at = time.time()
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at is not None and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,228 @@
+"""
+Permutation tests
+置换检验：只打乱整数组编码，所有指标的置换组和由一次批量矩阵乘法得到；
+按置换块确定性生成随机数，可多进程并行，p 值的蒙特卡洛置信区间明确落在 alpha 一侧时提前停止
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from sufficient_stats import MomentLayout, comparison_t_stats
+
+DEFAULT_MAX_PERMUTATIONS = 10000
+# Early stopping once the Clopper-Pearson interval of the p-value at this level excludes alpha
+DEFAULT_STOPPING_CONFIDENCE = 0.999
+# Budget for the permuted membership matrix materialized at once (per process)
+DEFAULT_PERMUTATION_MEMORY = 64 * 2 ** 20
+# Permutations are drawn per block from SeedSequence(random_state, spawn_key=(pair, block)),
+# so they do not depend on the worker count or the memory budget
+PERMUTATION_BLOCK = 100
+# Permuted statistics within this relative distance of the observed one count as ties (exceedances)
+_TIE_TOLERANCE = 1e-9
+
+
+@dataclass
+class PermutationResult:
+    """
+    Permutation p-values of every treatment-vs-control comparison, one entry per
+    (pair, metric) in pair-major order (the order of run_statistical_tests).
+
+    Attributes:
+        treated_labels, control_labels (List): Groups of every entry
+        metrics (List): Metric of every entry
+        metric_types (List[str]): Metric type of every entry
+        t_statistic (np.ndarray): Observed Welch / delta-method statistic
+        p_value (np.ndarray): Permutation p-value (k + 1) / (n + 1)
+        p_value_ci_lower, p_value_ci_upper (np.ndarray): Monte Carlo (Clopper-Pearson)
+            interval of the exact permutation p-value
+        n_permutations (np.ndarray): Permutations used per entry
+        stopped_early (np.ndarray): Whether the entry stopped before max_permutations
+        random_state (int): Master seed of the permutations
+    """
+    treated_labels: List
+    control_labels: List
+    metrics: List
+    metric_types: List[str]
+    t_statistic: np.ndarray
+    p_value: np.ndarray
+    p_value_ci_lower: np.ndarray
+    p_value_ci_upper: np.ndarray
+    n_permutations: np.ndarray
+    stopped_early: np.ndarray
+    random_state: int
+
+
+def monte_carlo_interval(exceedances: np.ndarray, n: np.ndarray, confidence: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Clopper-Pearson interval of the exceedance probability after ``n`` permutations."""
+    tail = (1 - confidence) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.where(exceedances > 0, stats.beta.ppf(tail, exceedances, n - exceedances + 1), 0.0)
+        upper = np.where(exceedances < n, stats.beta.ppf(1 - tail, exceedances + 1, n - exceedances), 1.0)
+    return lower, upper
+
+
+class PairPermuter:
+    """
+    Permutation distribution of the statistics of one (treated, control) pair.
+
+    The rows of both groups are turned into the moment matrix of MomentLayout once;
+    a permutation is a shuffled 0/1 treated indicator, so the treated moments of a
+    block of permutations are one (permutations x rows) @ (rows x columns) product and
+    the control moments are the totals minus those. The t-statistics then come from
+    comparison_t_stats exactly as in the seed search. Rows with a missing metric value
+    are dropped.
+    """
+
+    def __init__(self, data: pd.DataFrame, groupname: str, layout: MomentLayout, treated_label, control_label):
+        rows = data[data[groupname].isin([treated_label, control_label]).to_numpy()]
+        rows = rows.dropna(subset=layout.source_columns)
+        self.layout = layout
+        self.values = layout.build(rows)
+        self.treated = (rows[groupname] == treated_label).to_numpy(dtype=np.float64)
+        self.totals = self.values.sum(axis=0)
+
+    def t_stats(self, treated_moments: np.ndarray) -> np.ndarray:
+        """Treated-vs-control statistics from treated moments (..., C); returns (..., n_metrics)."""
+        moments = np.stack([treated_moments, self.totals - treated_moments], axis=-2)
+        return comparison_t_stats(self.layout, moments, 1, [0])[..., 0]
+
+    def observed(self) -> np.ndarray:
+        return self.t_stats(self.treated @ self.values)
+
+    def block_t_stats(self, random_state: int, pair_index: int, block: int, size: int,
+                      memory_budget: int = DEFAULT_PERMUTATION_MEMORY) -> np.ndarray:
+        """Statistics of the first ``size`` permutations of one block, shape (size, n_metrics)."""
+        rng = np.random.default_rng(np.random.SeedSequence(random_state, spawn_key=(pair_index, block)))
+        n_rows = len(self.treated)
+        tile = int(max(1, min(size, memory_budget // (8 * max(n_rows, 1)))))
+        out = np.empty((size, self.layout.n_metrics))
+        for start in range(0, size, tile):
+            membership = np.stack([rng.permutation(self.treated) for _ in range(min(tile, size - start))])
+            out[start:start + len(membership)] = self.t_stats(membership @ self.values)
+        return out
+
+
+_worker_permuters = None
+
+
+def _init_worker(permuters: List[PairPermuter]):
+    global _worker_permuters
+    _worker_permuters = permuters
+
+
+def _block_in_worker(args) -> np.ndarray:
+    pair_index = args[1]
+    return _worker_permuters[pair_index].block_t_stats(*args)
+
+
+def _exceeds(permuted: np.ndarray, observed: np.ndarray, alternative: str) -> np.ndarray:
+    tolerance = _TIE_TOLERANCE * np.abs(observed)
+    if alternative == 'two-sided':
+        return np.abs(permuted) >= np.abs(observed) - tolerance
+    if alternative == 'greater':
+        return permuted >= observed - tolerance
+    return permuted <= observed + tolerance
+
+
+def permutation_test(data: pd.DataFrame, groupname: str, metrics: Sequence[Union[str, List[str]]],
+                     metric_types: Sequence[str], pairs: Sequence[Tuple[object, object]],
+                     alternative: str = 'two-sided', alpha: float = 0.05,
+                     max_permutations: int = DEFAULT_MAX_PERMUTATIONS,
+                     stopping_confidence: Optional[float] = DEFAULT_STOPPING_CONFIDENCE,
+                     random_state: Optional[int] = None, n_workers: int = 1,
+                     memory_budget: int = DEFAULT_PERMUTATION_MEMORY) -> PermutationResult:
+    """
+    Monte Carlo permutation tests of every (treated, control) pair on every metric.
+
+    The statistic is the Welch t (delta method for ratios, unpooled normal statistic for
+    proportions), so the tests are studentized and robust to unequal variances.
+    Permutations are evaluated in blocks of PERMUTATION_BLOCK; after every block each
+    pending entry is stopped once the Clopper-Pearson interval of its p-value lies
+    entirely below or above ``alpha``, and a pair stops when all its metrics have.
+    Blocks are processed in order (``n_workers`` blocks in flight in a process pool),
+    so the result depends only on ``random_state``.
+
+    Args:
+        data (pd.DataFrame): Input dataset
+        groupname (str): Column name containing group labels
+        metrics (List): Metrics; ratio metrics as [x, y] or 'x/y'
+        metric_types (List[str]): 'mean', 'proportion' or 'ratio' per metric
+        pairs (List[Tuple]): (treated label, control label) pairs
+        alternative (str): 'two-sided', 'less', or 'greater'
+        alpha (float): Significance level the early stopping decides against
+        max_permutations (int): Permutations per pair without early stopping
+        stopping_confidence (float): Confidence of the stopping rule (None disables it)
+        random_state (int): Master seed (None draws fresh entropy and reports it)
+        n_workers (int): Number of worker processes (1 = serial)
+        memory_budget (int): Bytes of permuted indicators materialized at once per process
+
+    Returns:
+        PermutationResult: One entry per (pair, metric), pair-major
+    """
+    if alternative not in ('two-sided', 'less', 'greater'):
+        raise ValueError("alternative must be 'two-sided', 'less' or 'greater'")
+    if max_permutations < 1:
+        raise ValueError("max_permutations must be positive")
+    if random_state is None:
+        random_state = int(np.random.SeedSequence().entropy % (2 ** 53))
+    layout = MomentLayout(metrics, metric_types)
+    permuters = [PairPermuter(data, groupname, layout, treated, control) for treated, control in pairs]
+    n_metrics = layout.n_metrics
+    observed = np.array([permuter.observed() for permuter in permuters]).reshape(len(pairs), n_metrics)
+    exceedances = np.zeros((len(pairs), n_metrics))
+    counts = np.zeros((len(pairs), n_metrics))
+    # Entries with an undefined statistic have nothing to permute
+    pending = np.isfinite(observed)
+    sizes = [min(PERMUTATION_BLOCK, max_permutations - start) for start in range(0, max_permutations, PERMUTATION_BLOCK)]
+
+    def fold(p: int, t_stats: np.ndarray):
+        active = pending[p]
+        exceedances[p, active] += _exceeds(t_stats[:, active], observed[p, active], alternative).sum(axis=0)
+        counts[p, active] += len(t_stats)
+        if stopping_confidence is not None:
+            lower, upper = monte_carlo_interval(exceedances[p], counts[p], stopping_confidence)
+            pending[p] &= (lower <= alpha) & (upper >= alpha)
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(permuters,)) as executor:
+            for p in range(len(pairs)):
+                futures = []
+                block = 0
+                try:
+                    while pending[p].any() and (futures or block < len(sizes)):
+                        while block < len(sizes) and len(futures) < n_workers:
+                            futures.append(executor.submit(_block_in_worker, (random_state, p, block, sizes[block],
+                                                                              memory_budget)))
+                            block += 1
+                        fold(p, futures.pop(0).result())
+                finally:
+                    for future in futures:
+                        future.cancel()
+    else:
+        for p, permuter in enumerate(permuters):
+            for block, size in enumerate(sizes):
+                if not pending[p].any():
+                    break
+                fold(p, permuter.block_t_stats(random_state, p, block, size, memory_budget))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_value = np.where(np.isfinite(observed), (exceedances + 1) / (counts + 1), np.nan)
+    lower, upper = monte_carlo_interval(exceedances, counts, stopping_confidence or 0.99)
+    undefined = ~np.isfinite(observed)
+    lower[undefined], upper[undefined] = np.nan, np.nan
+    return PermutationResult(
+        treated_labels=[t for t, _ in pairs for _ in range(n_metrics)],
+        control_labels=[c for _, c in pairs for _ in range(n_metrics)],
+        metrics=[metric for _ in pairs for metric in layout.metrics],
+        metric_types=[metric_type for _ in pairs for metric_type in layout.metric_types],
+        t_statistic=observed.ravel(), p_value=p_value.ravel(),
+        p_value_ci_lower=lower.ravel(), p_value_ci_upper=upper.ravel(),
+        n_permutations=counts.ravel().astype(np.int64),
+        stopped_early=(np.isfinite(observed) & (counts < max_permutations)).ravel(),
+        random_state=random_state,
+    )
@@ -0,0 +1,56 @@
+"""
+Seed score cache
+按内容寻址的种子得分缓存：键为 (数据与指标内容指纹, 种子)，值为该指标在该种子下的 T 统计量
+"""
+
+import threading
+from typing import Dict, List
+
+import numpy as np
+
+from assignment_store import LRUCache
+
+
+class SeedScoreCache:
+    """
+    Size-bounded LRU cache of per-metric seed t-statistics.
+
+    Entries are keyed by (metric content key, seed), where the metric content key
+    (SeedEvaluator.metric_fingerprints) covers the unit IDs, group proportions, metric
+    spec and metric values. Because every metric is cached separately, re-running a
+    search with an extra metric or more iterations only computes what is new.
+    """
+
+    def __init__(self, max_entries: int = 200000):
+        """
+        Args:
+            max_entries (int): Maximum number of (metric, seed) entries kept
+        """
+        self._entries = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, metric_keys: List[str], seeds: List[str]) -> Dict[str, Dict[int, np.ndarray]]:
+        """Return {seed: {metric index: t-statistics}} for the cached (seed, metric) pairs."""
+        found = {}
+        with self._lock:
+            for seed in seeds:
+                for i, key in enumerate(metric_keys):
+                    t_stats = self._entries.get((key, seed))
+                    if t_stats is None:
+                        self.misses += 1
+                        continue
+                    self.hits += 1
+                    found.setdefault(seed, {})[i] = t_stats
+        return found
+
+    def store(self, metric_keys: List[str], computed: Dict[str, Dict[int, np.ndarray]]):
+        """Insert {seed: {metric index: t-statistics}} computed by a search."""
+        with self._lock:
+            for seed, metrics in computed.items():
+                for i, t_stats in metrics.items():
+                    self._entries.put((metric_keys[i], seed), t_stats)
+
+    def __len__(self):
+        return len(self._entries)
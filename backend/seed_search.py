@@ -0,0 +1,1114 @@
+"""
+SeedFinder search engine
+重随机种子搜索：基于充分统计量评估候选种子，不再为每个种子复制 DataFrame
+"""
+
+import hashlib
+import heapq
+import json
+import os
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from bucketing import (BUCKET_COUNT, BUCKET_SUFFIX, GroupAllocator, bucket_encoded_ids, format_unit_ids,
+                       hash_keys_to_buckets)
+from chunked_input import DEFAULT_STREAM_CHUNK_SIZE, ChunkSource, is_reiterable, iter_dataframe_chunks
+from score_cache import SeedScoreCache
+from sufficient_stats import MomentLayout, comparison_mahalanobis, comparison_t_stats, metric_comparison_t_stats
+
+# Candidate seeds are drawn in fixed-size blocks; block b always uses the b-th spawned
+# stream of the master seed, so the candidates do not depend on the worker count.
+SEED_BLOCK_SIZE = 256
+DEFAULT_CHECKPOINT_EVERY = 2048
+# Candidates accumulated per pass over the source in the out-of-core search
+DEFAULT_SEED_BATCH_SIZE = 4096
+# Batched kernel: memory budget for one units x seeds tile and the approximate cost of one
+# (unit, seed) cell (hash key and digest objects, bucket, flat bincount index and weight)
+DEFAULT_MEMORY_BUDGET = 256 * 2 ** 20
+BATCH_BYTES_PER_CELL = 200
+SEARCH_ENGINES = ('per-seed', 'batched')
+# Seed balance criteria: worst per-metric |t|, or the Mahalanobis distance of the mean differences
+BALANCE_CRITERIA = ('max-t', 'mahalanobis')
+
+
+@dataclass
+class SeedSearchResult:
+    """Outcome of a rerandomization seed search.
+
+    Scores are the maximum |t| over metrics and arms, or with
+    ``criterion='mahalanobis'`` the largest Mahalanobis distance over the arms.
+
+    Attributes:
+        best_seed (str): Seed with the smallest score
+        best_score (float): Score of the best seed
+        top_seeds (List[Tuple[str, float]]): Best (seed, score) pairs, ascending by score
+        iterations (int): Number of candidate seeds drawn
+        n_evaluated (int): Candidates that produced a valid score
+        random_state (int): Master seed; the same value reproduces the search
+        n_pruned (int): Candidates abandoned early by pruning
+        metric_evaluations (int): Metric-level tests actually computed
+        n_metrics (int): Number of metrics per seed
+        scores (np.ndarray): Score of every candidate in draw order; NaN where no score
+            exists (undefined statistics, repeated seeds and, with pruning, pruned seeds)
+        top_t_stats (List[np.ndarray]): Per-metric t-statistics of each top seed,
+            shaped (n_metrics, n_treatments)
+        metric_labels (List[str]): Row labels of ``top_t_stats``
+        treatment_labels (List[str]): Column labels of ``top_t_stats``
+        cached_seeds (int): Candidates scored entirely from the score cache (no hashing)
+        cached_metric_evaluations (int): Metric-level tests served from the score cache
+        bucket_cube (BucketCube): Per-bucket moments of every candidate, kept on request
+            for re-ranking under other group proportions (None otherwise)
+        criterion (str): Balance criterion the candidates were scored with
+    """
+    best_seed: str
+    best_score: float
+    top_seeds: List[Tuple[str, float]] = field(default_factory=list)
+    iterations: int = 0
+    n_evaluated: int = 0
+    random_state: int = None
+    n_pruned: int = 0
+    metric_evaluations: int = 0
+    n_metrics: int = 0
+    scores: np.ndarray = None
+    top_t_stats: List[np.ndarray] = field(default_factory=list)
+    metric_labels: List[str] = field(default_factory=list)
+    treatment_labels: List[str] = field(default_factory=list)
+    cached_seeds: int = 0
+    cached_metric_evaluations: int = 0
+    bucket_cube: Optional['BucketCube'] = None
+    criterion: str = 'max-t'
+
+    @property
+    def score_distribution(self) -> np.ndarray:
+        """Scores of all candidates that were fully evaluated, in draw order."""
+        return self.scores[~np.isnan(self.scores)]
+
+    @property
+    def prune_rate(self) -> float:
+        """Share of valid candidates rejected before all metrics were tested."""
+        return self.n_pruned / self.n_evaluated if self.n_evaluated else 0.0
+
+    @property
+    def metrics_per_seed(self) -> float:
+        """Average number of metrics tested per valid candidate."""
+        return self.metric_evaluations / self.n_evaluated if self.n_evaluated else 0.0
+
+
+@dataclass
+class SearchProgress:
+    """
+    Progress snapshot passed to a search progress callback.
+
+    Attributes:
+        completed (int): Candidate seeds processed so far (including resumed ones)
+        total (int): Candidate seeds in the whole search
+        best_seed (str): Best seed found so far (None before the first valid score)
+        best_score (float): Maximum |t| of ``best_seed``
+    """
+    completed: int
+    total: int
+    best_seed: Optional[str] = None
+    best_score: Optional[float] = None
+
+    @property
+    def fraction(self) -> float:
+        return self.completed / self.total if self.total else 1.0
+
+
+class BucketCube:
+    """
+    Per-bucket sufficient statistics of every candidate seed of a search.
+
+    Groups are a pure function of the 0-99 bucket, so the (n_seeds, 100, C) moment
+    cube (n, Σx, Σx², Σy, Σy², Σxy per bucket, see MomentLayout) scores the same
+    candidates under any other group proportions: a re-rank costs one
+    (G x 100) @ (100 x C) product per seed and never hashes or reads a unit again.
+    The cube takes n_seeds x 100 x C x 8 bytes. Candidates are re-ranked with the
+    criterion of the original search (the pooled covariance does not depend on groups).
+    """
+
+    def __init__(self, layout: MomentLayout, seeds: List[str], moments: np.ndarray,
+                 random_state: Optional[int] = None, criterion: str = 'max-t',
+                 inverse_covariance: Optional[np.ndarray] = None):
+        """
+        Args:
+            layout (MomentLayout): Metric layout the moments were built with
+            seeds (List[str]): Candidate seeds in draw order (repeats are ignored when ranking)
+            moments (np.ndarray): Bucket moments, shape (n_seeds, 100, C)
+            random_state (int): Master seed of the search the candidates came from
+            criterion (str): Balance criterion used for ranking (see BALANCE_CRITERIA)
+            inverse_covariance (np.ndarray): Required for the 'mahalanobis' criterion
+        """
+        if criterion == 'mahalanobis' and inverse_covariance is None:
+            raise ValueError("The mahalanobis criterion needs the inverse pooled covariance")
+        if moments.shape != (len(seeds), BUCKET_COUNT, layout.n_columns):
+            raise ValueError(f"Expected moments of shape {(len(seeds), BUCKET_COUNT, layout.n_columns)}, "
+                             f"got {moments.shape}")
+        self.layout = layout
+        self.seeds = list(seeds)
+        self.moments = moments
+        self.random_state = random_state
+        self.criterion = criterion
+        self.inverse_covariance = inverse_covariance
+
+    @property
+    def n_seeds(self) -> int:
+        return len(self.seeds)
+
+    @property
+    def nbytes(self) -> int:
+        return self.moments.nbytes
+
+    def t_stats(self, allocator: GroupAllocator, control_label: str) -> np.ndarray:
+        """t-statistics of every candidate under ``allocator``, shape (n_seeds, n_metrics, n_treatments)."""
+        if control_label not in allocator.labels:
+            raise ValueError(f"Control group {control_label!r} is not one of {allocator.labels}")
+        control_code = allocator.labels.index(control_label)
+        treatment_codes = [code for code in range(allocator.n_groups) if code != control_code]
+        # (G, 100) @ (S, 100, C) -> (S, G, C)
+        group_moments = np.matmul(allocator.membership_matrix(), self.moments)
+        return comparison_t_stats(self.layout, group_moments, control_code, treatment_codes)
+
+    def rerank(self, allocator: GroupAllocator, control_label: str, top_k: int = 10) -> SeedSearchResult:
+        """
+        Score all candidates under other group proportions and return the new ranking.
+
+        The rules match search_seeds: score = max |t|, ties go to the earlier
+        candidate and a repeated seed only counts once.
+
+        Args:
+            allocator (GroupAllocator): Compiled new group proportions
+            control_label (str): Label of the control group in ``allocator``
+            top_k (int): Number of best seeds to keep
+
+        Returns:
+            SeedSearchResult: Ranking under the new proportions (carrying this cube)
+        """
+        t_stats = self.t_stats(allocator, control_label)
+        if self.criterion == 'mahalanobis':
+            control_code = allocator.labels.index(control_label)
+            distances = comparison_mahalanobis(
+                self.layout, np.matmul(allocator.membership_matrix(), self.moments), self.inverse_covariance,
+                control_code, [code for code in range(allocator.n_groups) if code != control_code]
+            )
+            scores = np.fmax.reduce(distances, axis=1)
+        else:
+            scores = np.fmax.reduce(np.abs(t_stats).reshape(self.n_seeds, -1), axis=1)
+        seen = set()
+        for index, seed in enumerate(self.seeds):
+            if seed in seen:
+                scores[index] = np.nan
+            seen.add(seed)
+        valid = np.flatnonzero(~np.isnan(scores))
+        if len(valid) == 0:
+            raise ValueError("No valid seeds found. Please check your data and parameters.")
+        best = valid[np.lexsort((valid, scores[valid]))][:top_k]
+        top_seeds = [(self.seeds[index], float(scores[index])) for index in best]
+        control_code = allocator.labels.index(control_label)
+        return SeedSearchResult(best_seed=top_seeds[0][0], best_score=top_seeds[0][1], top_seeds=top_seeds,
+                                iterations=self.n_seeds, n_evaluated=len(valid), random_state=self.random_state,
+                                metric_evaluations=len(valid) * self.layout.n_metrics,
+                                n_metrics=self.layout.n_metrics, scores=scores,
+                                top_t_stats=[t_stats[index] for index in best],
+                                metric_labels=list(self.layout.labels),
+                                treatment_labels=[label for code, label in enumerate(allocator.labels)
+                                                  if code != control_code],
+                                bucket_cube=self, criterion=self.criterion)
+
+
+class SeedEvaluator:
+    """
+    Scores rerandomization seeds from sufficient statistics.
+
+    The metric columns are extracted once into a contiguous moment matrix (see
+    MomentLayout). A candidate seed then costs one hash pass over the unit IDs, one
+    np.bincount per moment column over the 100 buckets and a 100 -> group
+    aggregation; Welch and delta-method t-statistics are computed from the group
+    aggregates and no DataFrame is materialized per seed. ``batch_t_stats`` scores
+    many seeds at once with the batched kernel (see bucket_moments_batch).
+
+    For the Mahalanobis criterion the pooled covariance of the metrics is computed
+    once per dataset; a seed then only needs the first-moment columns and one
+    quadratic form per arm (see mahalanobis_score).
+    """
+
+    def __init__(self, df: pd.DataFrame, metrics: List[Union[str, List[str]]], metric_types: List[str],
+                 unit_id: str, allocator: GroupAllocator, control_label: str,
+                 memory_budget: int = DEFAULT_MEMORY_BUDGET):
+        """
+        Args:
+            df (pd.DataFrame): Input dataset; rows with missing metric values are ignored
+            metrics (List): Metrics to balance; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): 'mean', 'proportion' or 'ratio' per metric
+            unit_id (str): Column name containing unit identifiers
+            allocator (GroupAllocator): Compiled group proportions
+            control_label (str): Label of the control group
+            memory_budget (int): Bytes one tile of the batched kernel may use
+        """
+        self.memory_budget = memory_budget
+        self.layout = MomentLayout(metrics, metric_types)
+        data = df.dropna(subset=self.layout.source_columns)
+        # IDs are stringified exactly like assign_groups_with_seed before hashing
+        self.unit_ids = [s.encode('utf-8') for s in format_unit_ids(data[unit_id].astype(str))]
+        self.values = self.layout.build(data)
+        self.allocator = allocator
+        self.membership = allocator.membership_matrix()
+        self.control_code = allocator.labels.index(control_label)
+        self.treatment_codes = [code for code in range(allocator.n_groups) if code != self.control_code]
+        self.treatment_labels = [allocator.labels[code] for code in self.treatment_codes]
+        self._metric_fingerprints = None
+        self._inverse_covariance = None
+
+    @property
+    def n_units(self) -> int:
+        return len(self.unit_ids)
+
+    def buckets(self, seed: str) -> np.ndarray:
+        """Bucket numbers of all units under ``seed``."""
+        return bucket_encoded_ids(seed, self.unit_ids)
+
+    def bucket_moments(self, buckets: np.ndarray, columns=None) -> np.ndarray:
+        """
+        Sum moment columns per bucket; returns a (100, C) array.
+
+        Only the group-size column and ``columns`` (default: all) are filled.
+        """
+        moments = np.zeros((BUCKET_COUNT, self.layout.n_columns))
+        moments[:, 0] = np.bincount(buckets, minlength=BUCKET_COUNT)
+        for c in (range(1, self.layout.n_columns) if columns is None else columns):
+            moments[:, c] = np.bincount(buckets, weights=self.values[:, c], minlength=BUCKET_COUNT)
+        return moments
+
+    def group_moments(self, bucket_moments: np.ndarray) -> np.ndarray:
+        """Aggregate bucket-level moments to group level; returns a (G, C) array."""
+        return self.membership @ bucket_moments
+
+    def t_stats(self, seed: str) -> np.ndarray:
+        """Treatment-vs-control t-statistics, shape (n_metrics, n_treatments)."""
+        return self.moments_t_stats(self.bucket_moments(self.buckets(seed)))
+
+    def moments_t_stats(self, bucket_moments: np.ndarray) -> np.ndarray:
+        """t-statistics from bucket moments (..., 100, C); returns (..., n_metrics, n_treatments)."""
+        group_moments = np.matmul(self.membership, bucket_moments)
+        return comparison_t_stats(self.layout, group_moments, self.control_code, self.treatment_codes)
+
+    def inverse_covariance(self) -> np.ndarray:
+        """
+        Pseudo-inverse of the pooled unit-level covariance of the metrics (M x M).
+
+        Computed once from all units (ratio metrics linearized, see
+        MomentLayout.linearized); the pseudo-inverse tolerates constant or collinear metrics.
+        """
+        if self._inverse_covariance is None:
+            covariance = np.atleast_2d(np.cov(self.layout.linearized(self.values), rowvar=False))
+            self._inverse_covariance = np.linalg.pinv(covariance)
+        return self._inverse_covariance
+
+    def moments_mahalanobis(self, bucket_moments: np.ndarray) -> np.ndarray:
+        """Mahalanobis distances from bucket moments (..., 100, C); returns (..., n_treatments)."""
+        group_moments = np.matmul(self.membership, bucket_moments)
+        return comparison_mahalanobis(self.layout, group_moments, self.inverse_covariance(),
+                                      self.control_code, self.treatment_codes)
+
+    def mahalanobis_score(self, seed: str) -> float:
+        """Largest treatment-vs-control Mahalanobis distance of ``seed`` (NaN if none is defined)."""
+        distances = self.moments_mahalanobis(self.bucket_moments(self.buckets(seed), self.layout.mean_columns))
+        return float(np.fmax.reduce(distances))
+
+    def batch_t_stats(self, seeds: List[str], metric_indices: Optional[List[int]] = None) -> np.ndarray:
+        """
+        t-statistics of many seeds at once, shape (n_seeds, n_metrics, n_treatments).
+
+        With ``metric_indices`` only those metrics are computed (other rows are NaN).
+        """
+        if metric_indices is None:
+            metric_indices = range(self.layout.n_metrics)
+        columns = [c for i in metric_indices for c in self.layout.metric_columns[i]]
+        moments = bucket_moments_batch(self.unit_ids, self.values, seeds, self.memory_budget, columns)
+        # (G, 100) @ (S, 100, C) -> (S, G, C)
+        group_moments = np.matmul(self.membership, moments)
+        out = np.full((len(seeds), self.layout.n_metrics, len(self.treatment_codes)), np.nan)
+        for i in metric_indices:
+            out[:, i, :] = metric_comparison_t_stats(group_moments, self.layout.metric_columns[i],
+                                                     self.layout.metric_types[i], self.control_code,
+                                                     self.treatment_codes)
+        return out
+
+    def metric_t_stats(self, seed: str, metric_indices: List[int],
+                       buckets: Optional[np.ndarray] = None) -> Dict[int, np.ndarray]:
+        """t-statistics (n_treatments,) of the selected metrics only, from one hash pass."""
+        if buckets is None:
+            buckets = self.buckets(seed)
+        columns = [c for i in metric_indices for c in self.layout.metric_columns[i]]
+        moments = self.group_moments(self.bucket_moments(buckets, columns))
+        return {
+            i: metric_comparison_t_stats(moments, self.layout.metric_columns[i], self.layout.metric_types[i],
+                                         self.control_code, self.treatment_codes)
+            for i in metric_indices
+        }
+
+    def metric_fingerprints(self) -> List[str]:
+        """
+        One content key per metric: BLAKE2 over the unit IDs, the group proportions,
+        the metric spec and the metric's own source columns (rows in dataset order).
+
+        The IDs and columns are fed to the hash in slices, so no giant intermediate
+        string is built. Keys are computed once and reused.
+        """
+        if self._metric_fingerprints is None:
+            base = hashlib.blake2b(digest_size=20)
+            for start in range(0, self.n_units, 65536):
+                base.update(b'\x00'.join(self.unit_ids[start:start + 65536]) + b'\x00')
+            base.update(json.dumps([str(label) for label in self.allocator.labels]).encode('utf-8'))
+            base.update(self.allocator.lookup.tobytes())
+            base.update(str(self.control_code).encode('utf-8'))
+            keys = []
+            for i, (metric_type, columns) in enumerate(zip(self.layout.metric_types, self.layout.metric_columns)):
+                digest = base.copy()
+                digest.update(json.dumps([self.layout.labels[i], metric_type]).encode('utf-8'))
+                digest.update(self.layout.shifts[i:i + 1].tobytes())
+                for c in columns:
+                    digest.update(self.values[:, c].tobytes())
+                keys.append(digest.hexdigest())
+            self._metric_fingerprints = keys
+        return self._metric_fingerprints
+
+    def fingerprint(self) -> str:
+        """
+        Content key of the whole search input (IDs, proportions and all metrics, in order).
+
+        Identifies the exact data a seed search ran on (used to validate checkpoints).
+        """
+        return hashlib.blake2b('|'.join(self.metric_fingerprints()).encode('utf-8'), digest_size=20).hexdigest()
+
+    def score(self, seed: str, known: Optional[Dict[int, np.ndarray]] = None,
+              computed: Optional[Dict[int, np.ndarray]] = None) -> float:
+        """
+        Maximum absolute t-statistic over all metrics and treatment arms (NaN if none is defined).
+
+        Args:
+            seed (str): Candidate seed
+            known (dict): Metric index -> t-statistics already available (e.g. cached);
+                only the other metrics are computed, and none at all if every metric is known
+            computed (dict): Receives the t-statistics computed here, by metric index
+        """
+        if not known:
+            t_stats = self.t_stats(seed)
+            if computed is not None:
+                computed.update(enumerate(t_stats))
+            return _max_abs(t_stats)
+        missing = [i for i in range(self.layout.n_metrics) if i not in known]
+        new = self.metric_t_stats(seed, missing) if missing else {}
+        if computed is not None:
+            computed.update(new)
+        return _max_abs(np.concatenate([known[i] if i in known else new[i] for i in range(self.layout.n_metrics)]))
+
+    def score_pruned(self, seed: str, bound: float, order: List[int], metric_abs_t: np.ndarray,
+                     known: Optional[Dict[int, np.ndarray]] = None,
+                     computed: Optional[Dict[int, np.ndarray]] = None) -> Tuple[float, int, bool]:
+        """
+        Score a seed metric by metric and stop once the running max |t| exceeds ``bound``.
+
+        Args:
+            seed (str): Candidate seed
+            bound (float): Score a candidate must beat to be kept
+            order (List[int]): Metric indices in evaluation order
+            metric_abs_t (np.ndarray): Per-metric |t| of this seed, filled in place (NaN if skipped)
+            known (dict): Metric index -> t-statistics already available (not recomputed)
+            computed (dict): Receives the t-statistics computed here, by metric index
+
+        Returns:
+            Tuple[float, int, bool]: running max |t| (NaN if no metric was defined),
+            number of metrics tested and whether the seed was pruned
+        """
+        known = known or {}
+        buckets = counts = None
+        running = float('nan')
+        for n_tested, i in enumerate(order, start=1):
+            if i in known:
+                t_stats = known[i]
+            else:
+                if buckets is None:
+                    # Hash lazily: a seed whose leading metrics are all cached may never need it
+                    buckets = self.buckets(seed)
+                    counts = np.bincount(buckets, minlength=BUCKET_COUNT).astype(np.float64)
+                columns = self.layout.metric_columns[i]
+                bucket_moments = np.empty((BUCKET_COUNT, len(columns) + 1))
+                bucket_moments[:, 0] = counts
+                for j, c in enumerate(columns, start=1):
+                    bucket_moments[:, j] = np.bincount(buckets, weights=self.values[:, c], minlength=BUCKET_COUNT)
+                t_stats = metric_comparison_t_stats(
+                    self.group_moments(bucket_moments), np.arange(1, len(columns) + 1),
+                    self.layout.metric_types[i], self.control_code, self.treatment_codes
+                )
+                if computed is not None:
+                    computed[i] = t_stats
+            metric_abs_t[i] = _max_abs(t_stats)
+            if not np.isnan(metric_abs_t[i]) and not metric_abs_t[i] <= running:
+                running = metric_abs_t[i]
+            if running > bound:
+                return running, n_tested, True
+        return running, len(order), False
+
+
+def batch_tile_sizes(n_units: int, n_seeds: int, memory_budget: int = DEFAULT_MEMORY_BUDGET) -> Tuple[int, int]:
+    """
+    Units and seeds per tile of the batched kernel so that one tile fits ``memory_budget``.
+
+    All units go into one tile when possible (the bincount sums then follow the same
+    order as the per-seed path); the seed tile fills the remaining budget.
+    """
+    cells = max(1, memory_budget // BATCH_BYTES_PER_CELL)
+    unit_tile = max(1, min(n_units, cells))
+    seed_tile = max(1, min(n_seeds, cells // unit_tile))
+    return unit_tile, seed_tile
+
+
+def bucket_moments_batch(unit_ids: List[bytes], values: np.ndarray, seeds: List[str],
+                         memory_budget: int = DEFAULT_MEMORY_BUDGET, columns=None) -> np.ndarray:
+    """
+    Per-seed, per-bucket moment sums of many seeds; returns a (n_seeds, 100, C) array.
+
+    Each tile hashes the keys of ``seed_tile`` seeds x ``unit_tile`` units in one
+    call, giving a seeds x units bucket matrix. Offsetting every seed's buckets by
+    100 * seed turns the whole tile into a single np.bincount per moment column.
+
+    Args:
+        unit_ids (List[bytes]): UTF-8 encoded, formatted unit IDs
+        values (np.ndarray): N x C moment matrix (see MomentLayout.build)
+        seeds (List[str]): Candidate seeds
+        memory_budget (int): Bytes one tile may use (see batch_tile_sizes)
+        columns: Moment columns to sum besides the count in column 0 (default: all)
+    """
+    n_units, n_columns = values.shape
+    if columns is None:
+        columns = range(1, n_columns)
+    moments = np.zeros((len(seeds), BUCKET_COUNT, n_columns))
+    unit_tile, seed_tile = batch_tile_sizes(n_units, len(seeds), memory_budget)
+    for seed_start in range(0, len(seeds), seed_tile):
+        tile_seeds = seeds[seed_start:seed_start + seed_tile]
+        suffixes = [(seed + BUCKET_SUFFIX).encode('utf-8') for seed in tile_seeds]
+        n_bins = len(tile_seeds) * BUCKET_COUNT
+        tile_moments = moments[seed_start:seed_start + len(tile_seeds)].reshape(n_bins, n_columns)
+        for unit_start in range(0, n_units, unit_tile):
+            ids = unit_ids[unit_start:unit_start + unit_tile]
+            buckets = hash_keys_to_buckets([k + suffix for suffix in suffixes for k in ids])
+            index = buckets.reshape(len(tile_seeds), len(ids)).astype(np.intp)
+            index += (np.arange(len(tile_seeds)) * BUCKET_COUNT)[:, None]
+            index = index.ravel()
+            tile_moments[:, 0] += np.bincount(index, minlength=n_bins)
+            for c in columns:
+                weights = np.tile(values[unit_start:unit_start + len(ids), c], len(tile_seeds))
+                tile_moments[:, c] += np.bincount(index, weights=weights, minlength=n_bins)
+    return moments
+
+
+def _max_abs(t_stats: np.ndarray) -> float:
+    abs_t = np.abs(t_stats)
+    if np.isnan(abs_t).all():
+        return float('nan')
+    return float(np.nanmax(abs_t))
+
+
+def candidate_seeds(random_state: int, block: int, size: int) -> List[str]:
+    """
+    Candidate seeds of one block, drawn from an independent child stream of the master seed.
+
+    ``SeedSequence(random_state, spawn_key=(block,))`` is the ``block``-th child of
+    ``SeedSequence(random_state).spawn(...)``.
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(random_state, spawn_key=(block,)))
+    return ['rr' + str(int(x * 1000000)) for x in rng.random(size)]
+
+
+def _block_sizes(iterations: int) -> List[int]:
+    full, rest = divmod(iterations, SEED_BLOCK_SIZE)
+    return [SEED_BLOCK_SIZE] * full + ([rest] if rest else [])
+
+
+@dataclass
+class _BlockResult:
+    """Outcome of one block of candidates (see _evaluate_block)."""
+    entries: List[Tuple[float, int, str]]     # local top-K (score, candidate index, seed)
+    n_evaluated: int
+    n_pruned: int
+    metric_evaluations: int
+    scores: np.ndarray                        # per candidate, NaN where no score was computed
+    computed: Dict[str, Dict[int, np.ndarray]] = field(default_factory=dict)
+    cached_seeds: int = 0                     # seeds scored without hashing
+    cached_metric_evaluations: int = 0        # metric tests served from the score cache
+    bucket_moments: Optional[np.ndarray] = None  # (size, 100, C) when requested; zero for repeats
+
+
+def _evaluate_block(evaluator: SeedEvaluator, random_state: int, block: int, size: int,
+                    top_k: int, prune: bool = False,
+                    cached: Optional[Dict[str, Dict[int, np.ndarray]]] = None,
+                    engine: str = 'per-seed', keep_moments: bool = False,
+                    criterion: str = 'max-t') -> _BlockResult:
+    """
+    Score one block; keeps a local top-K heap of (score, candidate index, seed).
+
+    With ``prune`` the metrics are tested most-imbalanced first (by the running mean
+    |t| seen so far in this block) and a seed is abandoned as soon as its running max
+    |t| exceeds the worst score in a full heap. Such a seed can never enter the top-K,
+    so pruning changes only the amount of work, not the result.
+
+    ``cached`` maps seeds to per-metric t-statistics known from earlier searches; those
+    metrics are not recomputed. Newly computed t-statistics are returned in
+    ``computed`` so the caller can store them.
+
+    ``engine='batched'`` scores the block's seeds together (see _evaluate_block_batched);
+    pruning is sequential by nature and always uses the per-seed path.
+
+    ``keep_moments`` returns every seed's full bucket moments; all metrics are then
+    computed from them (the caller disables pruning and cache lookups).
+
+    ``criterion='mahalanobis'`` scores seeds by their largest Mahalanobis distance
+    (no pruning, no cache).
+    """
+    cached = cached or {}
+    if engine == 'batched' and not prune:
+        return _evaluate_block_batched(evaluator, random_state, block, size, top_k, cached, keep_moments,
+                                       criterion)
+    n_metrics = evaluator.layout.n_metrics
+    result = _BlockResult([], 0, 0, 0, np.full(size, np.nan))
+    if keep_moments:
+        result.bucket_moments = np.zeros((size, BUCKET_COUNT, evaluator.layout.n_columns))
+    heap = []  # max-heap on (score, index) via negation
+    seen = set()
+    abs_t_sum = np.zeros(n_metrics)
+    abs_t_count = np.zeros(n_metrics)
+    for offset, seed in enumerate(candidate_seeds(random_state, block, size)):
+        if seed in seen:
+            continue
+        seen.add(seed)
+        known = cached.get(seed, {})
+        computed = {}
+        if prune:
+            bound = -heap[0][0] if len(heap) == top_k else float('inf')
+            with np.errstate(invalid='ignore', divide='ignore'):
+                order = np.argsort(-(abs_t_sum / np.maximum(abs_t_count, 1)), kind='stable')
+            metric_abs_t = np.full(n_metrics, np.nan)
+            score, n_tested, pruned = evaluator.score_pruned(seed, bound, order, metric_abs_t, known, computed)
+            tested = ~np.isnan(metric_abs_t)
+            abs_t_sum[tested] += metric_abs_t[tested]
+            abs_t_count[tested] += 1
+        elif keep_moments:
+            result.bucket_moments[offset] = evaluator.bucket_moments(evaluator.buckets(seed))
+            t_stats = evaluator.moments_t_stats(result.bucket_moments[offset])
+            computed.update(enumerate(t_stats))
+            if criterion == 'mahalanobis':
+                score = float(np.fmax.reduce(evaluator.moments_mahalanobis(result.bucket_moments[offset])))
+            else:
+                score = _max_abs(t_stats)
+            n_tested, pruned = n_metrics, False
+        elif criterion == 'mahalanobis':
+            score, n_tested, pruned = evaluator.mahalanobis_score(seed), n_metrics, False
+        else:
+            score, n_tested, pruned = evaluator.score(seed, known, computed), n_metrics, False
+        if computed:
+            result.computed[seed] = computed
+        elif known:
+            result.cached_seeds += 1
+        if known:
+            result.cached_metric_evaluations += n_tested - len(computed)
+        if np.isnan(score):
+            continue
+        result.n_evaluated += 1
+        result.metric_evaluations += n_tested
+        if pruned:
+            result.n_pruned += 1
+            continue
+        result.scores[offset] = score
+        entry = (-score, -(block * SEED_BLOCK_SIZE + offset), seed)
+        if len(heap) < top_k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+    result.entries = [(-score, -index, seed) for score, index, seed in heap]
+    return result
+
+
+def _evaluate_block_batched(evaluator: SeedEvaluator, random_state: int, block: int, size: int,
+                            top_k: int, cached: Dict[str, Dict[int, np.ndarray]],
+                            keep_moments: bool = False, criterion: str = 'max-t') -> _BlockResult:
+    """
+    Score a block with batched kernel calls.
+
+    Seeds with every metric cached are not hashed; the others are grouped by their set
+    of missing metrics (normally one group) and only those metrics are computed.
+    With ``keep_moments`` every distinct seed is reduced over all moment columns and
+    the bucket moments are returned with the result. The Mahalanobis criterion only
+    reduces the first-moment columns.
+    """
+    n_metrics = evaluator.layout.n_metrics
+    seeds = candidate_seeds(random_state, block, size)
+    if keep_moments or criterion == 'mahalanobis':
+        offsets, seen = [], set()
+        for offset, seed in enumerate(seeds):
+            if seed not in seen:
+                seen.add(seed)
+                offsets.append(offset)
+        moments = np.zeros((size, BUCKET_COUNT, evaluator.layout.n_columns))
+        moments[offsets] = bucket_moments_batch(evaluator.unit_ids, evaluator.values,
+                                                [seeds[offset] for offset in offsets], evaluator.memory_budget,
+                                                None if keep_moments else evaluator.layout.mean_columns)
+        scores = np.full(size, np.nan)
+        if criterion == 'mahalanobis':
+            scores[offsets] = np.fmax.reduce(evaluator.moments_mahalanobis(moments[offsets]), axis=-1)
+        if keep_moments:
+            t_stats = evaluator.moments_t_stats(moments[offsets])
+            if criterion == 'max-t':
+                scores[offsets] = [_max_abs(seed_t_stats) for seed_t_stats in t_stats]
+        result = _block_result_from_scores(block, seeds, scores, top_k, n_metrics)
+        if keep_moments:
+            result.computed = {seeds[offset]: dict(enumerate(seed_t_stats))
+                               for offset, seed_t_stats in zip(offsets, t_stats)}
+            result.bucket_moments = moments
+        return result
+    scores = np.full(size, np.nan)
+    todo, seen, computed = {}, set(), {}
+    cached_seeds = cached_metric_evaluations = 0
+    for offset, seed in enumerate(seeds):
+        if seed in seen:
+            continue
+        seen.add(seed)
+        known = cached.get(seed, {})
+        missing = tuple(i for i in range(n_metrics) if i not in known)
+        if missing:
+            todo.setdefault(missing, []).append(offset)
+        else:
+            scores[offset] = _max_abs(np.stack([known[i] for i in range(n_metrics)]))
+            cached_seeds += 1
+        cached_metric_evaluations += n_metrics - len(missing)
+    for missing, offsets in todo.items():
+        t_stats = evaluator.batch_t_stats([seeds[offset] for offset in offsets], list(missing))
+        for offset, seed_t_stats in zip(offsets, t_stats):
+            known = cached.get(seeds[offset], {})
+            for i, metric_t_stats in known.items():
+                seed_t_stats[i] = metric_t_stats
+            scores[offset] = _max_abs(seed_t_stats)
+            computed[seeds[offset]] = {i: seed_t_stats[i] for i in missing}
+    result = _block_result_from_scores(block, seeds, scores, top_k, n_metrics)
+    result.computed = computed
+    result.cached_seeds = cached_seeds
+    result.cached_metric_evaluations = cached_metric_evaluations
+    return result
+
+
+_worker_evaluator = None
+
+
+def _init_worker(evaluator: SeedEvaluator):
+    global _worker_evaluator
+    _worker_evaluator = evaluator
+
+
+def _evaluate_block_in_worker(args) -> _BlockResult:
+    return _evaluate_block(_worker_evaluator, *args)
+
+
+def search_seeds(evaluator: SeedEvaluator, iterations: int, random_state: Optional[int] = None,
+                 n_workers: int = 1, top_k: int = 10, prune: bool = False,
+                 checkpoint_path: Optional[str] = None,
+                 checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+                 progress_callback: Optional[Callable[['SearchProgress'], None]] = None,
+                 score_cache: Optional[SeedScoreCache] = None, engine: str = 'per-seed',
+                 keep_bucket_cube: bool = False, criterion: str = 'max-t') -> SeedSearchResult:
+    """
+    Search ``iterations`` candidate seeds for the one with the smallest maximum |t|.
+
+    Candidates come from per-block child streams of ``random_state`` and ties are
+    broken by candidate index, so for a given master seed the result is identical
+    for any ``n_workers``. With ``n_workers > 1`` blocks are scored in a process
+    pool and the per-block top-K heaps are merged as they complete. ``prune``
+    enables early abort of candidates that cannot enter the top-K (same result,
+    less work).
+
+    With ``checkpoint_path`` the search state (master seed, block cursor, top-K and a
+    fingerprint of the data and metric configuration) is written atomically every
+    ``checkpoint_every`` candidates. If the file already exists the search resumes
+    from it and returns exactly what an uninterrupted run would have returned; a
+    checkpoint written for other data, metrics or proportions is rejected.
+
+    ``progress_callback`` receives a SearchProgress after every block; an exception
+    raised by the callback aborts the search (this is how jobs are cancelled).
+
+    With ``score_cache`` per-metric t-statistics of seeds seen in earlier searches on
+    the same data are reused, so a re-run only computes new seeds and new metrics.
+
+    ``engine='batched'`` scores each block of candidates with one batched kernel call
+    per tile (bounded by ``evaluator.memory_budget``) instead of one seed at a time.
+    Both engines give the same candidates and scores.
+
+    ``keep_bucket_cube`` keeps the 100-bucket moments of every candidate in
+    ``result.bucket_cube`` (iterations x 100 x C x 8 bytes), so the candidates can be
+    re-ranked for other group proportions without hashing again (BucketCube.rerank).
+    Every metric of every seed is then computed: pruning is not available, cached
+    scores are not read (new ones are still stored) and a checkpoint can only be
+    written, not resumed.
+
+    ``criterion='mahalanobis'`` ranks seeds by the largest Mahalanobis distance of the
+    treatment-vs-control mean-difference vector instead of the max |t| (see
+    comparison_mahalanobis). The pooled covariance is computed once; each seed costs
+    its first-moment reductions and one quadratic form per arm. Pruning and the
+    score cache apply to max |t| only.
+
+    Args:
+        evaluator (SeedEvaluator): Prepared evaluator for the dataset
+        iterations (int): Number of candidate seeds
+        random_state (int): Master seed (None draws fresh entropy and reports it)
+        n_workers (int): Number of worker processes (1 = serial)
+        top_k (int): Number of best seeds to keep
+        prune (bool): Stop testing a candidate once its max |t| exceeds the K-th best
+        checkpoint_path (str): Local JSON file used to persist and resume progress
+        checkpoint_every (int): Candidates between two checkpoint writes
+        progress_callback (Callable): Called with a SearchProgress after every block
+        score_cache (SeedScoreCache): Shared cache of per-metric seed t-statistics
+        engine (str): 'per-seed' (default) or 'batched'; pruning always runs per seed
+        keep_bucket_cube (bool): Keep per-bucket moments of all candidates for re-ranking
+        criterion (str): 'max-t' (default) or 'mahalanobis'
+
+    Returns:
+        SeedSearchResult: Best seed, top-K list and search metadata
+    """
+    if criterion not in BALANCE_CRITERIA:
+        raise ValueError(f"Unsupported balance criterion: {criterion}")
+    if criterion != 'max-t' and prune:
+        raise ValueError("Pruning is only available for the max-t criterion")
+    if criterion != 'max-t':
+        score_cache = None
+    if keep_bucket_cube and prune:
+        raise ValueError("keep_bucket_cube needs every metric of every seed and cannot be combined with prune")
+    state = _SearchState(top_k, criterion)
+    fingerprint = None
+    if checkpoint_path is not None:
+        fingerprint = evaluator.fingerprint()
+        if os.path.exists(checkpoint_path):
+            state = _SearchState.load(checkpoint_path, fingerprint, random_state, top_k, criterion)
+            random_state = state.random_state
+            completed = sum(_block_sizes(state.iterations)[:state.cursor])
+            if iterations < completed:
+                # The candidates already folded into the checkpoint cannot be taken back out
+                raise ValueError(f"Checkpoint already evaluated {completed} candidates; "
+                                 f"it cannot be resumed with iterations={iterations}")
+            if state.cursor * SEED_BLOCK_SIZE > state.iterations != iterations:
+                # The last completed block was a partial one; extending it would skip candidates
+                raise ValueError(f"Checkpoint ended on a partial block of a {state.iterations}-seed search; "
+                                 f"it can only be resumed with iterations={state.iterations}")
+            if keep_bucket_cube and state.cursor > 0:
+                raise ValueError("The bucket cube is not checkpointed; a search with keep_bucket_cube "
+                                 "cannot resume from a checkpoint")
+    if random_state is None:
+        # Kept below 2**53 so the value survives a round trip through JSON/JavaScript
+        random_state = int(np.random.SeedSequence().entropy % (2 ** 53))
+    state.random_state = random_state
+    state.iterations = iterations
+
+    block_sizes = _block_sizes(iterations)
+    metric_keys = evaluator.metric_fingerprints() if score_cache is not None else None
+    if engine not in SEARCH_ENGINES:
+        raise ValueError(f"Unsupported search engine: {engine}")
+    tasks = []
+    for block in range(state.cursor, len(block_sizes)):
+        cached = None
+        if score_cache is not None and not keep_bucket_cube:
+            cached = score_cache.lookup(metric_keys, candidate_seeds(random_state, block, block_sizes[block]))
+        tasks.append((random_state, block, block_sizes[block], top_k, prune, cached, engine, keep_bucket_cube,
+                      criterion))
+    checkpoint_blocks = max(1, checkpoint_every // SEED_BLOCK_SIZE)
+
+    completed = sum(block_sizes[:state.cursor])
+    moment_blocks = []
+    with closing(_run_blocks(evaluator, tasks, n_workers)) as block_results:
+        for block_result in block_results:
+            state.add_block(block_result)
+            if keep_bucket_cube:
+                moment_blocks.append(block_result.bucket_moments)
+            if score_cache is not None:
+                score_cache.store(metric_keys, block_result.computed)
+            completed += block_sizes[state.cursor - 1]
+            if checkpoint_path is not None and state.cursor % checkpoint_blocks == 0:
+                state.save(checkpoint_path, fingerprint)
+            if progress_callback is not None:
+                best_score, _, best_seed = state.entries[0] if state.entries else (None, None, None)
+                progress_callback(SearchProgress(completed, iterations, best_seed, best_score))
+    if checkpoint_path is not None:
+        state.save(checkpoint_path, fingerprint)
+
+    if state.n_evaluated == 0:
+        raise ValueError("No valid seeds found. Please check your data and parameters.")
+
+    bucket_cube = None
+    if keep_bucket_cube:
+        seeds = [seed for block, size in enumerate(block_sizes) for seed in candidate_seeds(random_state, block, size)]
+        bucket_cube = BucketCube(evaluator.layout, seeds, np.concatenate(moment_blocks), random_state, criterion,
+                                 evaluator.inverse_covariance() if criterion == 'mahalanobis' else None)
+
+    top_seeds = [(seed, score) for score, _, seed in state.entries]
+    best_seed, best_score = top_seeds[0]
+    return SeedSearchResult(best_seed=best_seed, best_score=best_score, top_seeds=top_seeds,
+                            iterations=iterations, n_evaluated=state.n_evaluated, random_state=random_state,
+                            n_pruned=state.n_pruned, metric_evaluations=state.metric_evaluations,
+                            n_metrics=evaluator.layout.n_metrics, scores=state.scores(),
+                            top_t_stats=[evaluator.t_stats(seed) for seed, _ in top_seeds],
+                            metric_labels=list(evaluator.layout.labels),
+                            treatment_labels=list(evaluator.treatment_labels),
+                            cached_seeds=state.cached_seeds,
+                            cached_metric_evaluations=state.cached_metric_evaluations,
+                            bucket_cube=bucket_cube, criterion=criterion)
+
+
+def _run_blocks(evaluator: SeedEvaluator, tasks: List[tuple], n_workers: int):
+    """Yield block results in block order, serially or from a process pool."""
+    if n_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(evaluator,)) as executor:
+            futures = [executor.submit(_evaluate_block_in_worker, task) for task in tasks]
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                # On early exit (e.g. a cancelled job) drop the blocks that have not started
+                for future in futures:
+                    future.cancel()
+    else:
+        for task in tasks:
+            yield _evaluate_block(evaluator, *task)
+
+
+class _SearchState:
+    """Merged top-K and counters of the blocks completed so far (the checkpoint payload)."""
+
+    VERSION = 2
+
+    def __init__(self, top_k: int, criterion: str = 'max-t'):
+        self.top_k = top_k
+        self.criterion = criterion
+        self.random_state = None
+        self.iterations = 0
+        self.cursor = 0             # number of leading blocks already merged
+        self.entries = []           # sorted, distinct (score, candidate index, seed)
+        self.n_evaluated = 0
+        self.n_pruned = 0
+        self.metric_evaluations = 0
+        self.score_blocks = []      # per-block candidate score arrays, in block order
+        # Score cache usage of this run (not persisted in checkpoints)
+        self.cached_seeds = 0
+        self.cached_metric_evaluations = 0
+
+    def scores(self) -> np.ndarray:
+        return np.concatenate(self.score_blocks) if self.score_blocks else np.empty(0)
+
+    def add_block(self, block_result: _BlockResult):
+        merged, seen = [], set()
+        for entry in heapq.merge(self.entries, sorted(block_result.entries)):
+            if entry[2] not in seen:
+                seen.add(entry[2])
+                merged.append(entry)
+            if len(merged) == self.top_k:
+                break
+        self.entries = merged
+        self.n_evaluated += block_result.n_evaluated
+        self.n_pruned += block_result.n_pruned
+        self.metric_evaluations += block_result.metric_evaluations
+        self.cached_seeds += block_result.cached_seeds
+        self.cached_metric_evaluations += block_result.cached_metric_evaluations
+        self.score_blocks.append(block_result.scores)
+        self.cursor += 1
+
+    def save(self, path: str, fingerprint: str):
+        payload = {
+            'version': self.VERSION,
+            'fingerprint': fingerprint,
+            'random_state': self.random_state,
+            'iterations': self.iterations,
+            'top_k': self.top_k,
+            'criterion': self.criterion,
+            'cursor': self.cursor,
+            'entries': [list(entry) for entry in self.entries],
+            'n_evaluated': self.n_evaluated,
+            'n_pruned': self.n_pruned,
+            'metric_evaluations': self.metric_evaluations,
+        }
+        # The score vector goes to a sidecar .npy first; the JSON cursor says how much of it is valid
+        scores = self.scores()
+        self.score_blocks = [scores]
+        with open(path + '.scores.tmp', 'wb') as f:
+            np.save(f, scores)
+        os.replace(path + '.scores.tmp', path + '.scores.npy')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, fingerprint: str, random_state: Optional[int], top_k: int,
+             criterion: str = 'max-t') -> '_SearchState':
+        with open(path) as f:
+            payload = json.load(f)
+        if payload.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported checkpoint version in {path}")
+        if payload['fingerprint'] != fingerprint:
+            raise ValueError("Checkpoint was created for a different dataset or metric configuration; "
+                             "refusing to resume")
+        if random_state is not None and random_state != payload['random_state']:
+            raise ValueError(f"Checkpoint uses random_state={payload['random_state']}, not {random_state}")
+        if payload['top_k'] != top_k:
+            raise ValueError(f"Checkpoint keeps top_k={payload['top_k']}, not {top_k}")
+        if payload.get('criterion', 'max-t') != criterion:
+            raise ValueError(f"Checkpoint ranks seeds by {payload.get('criterion', 'max-t')}, not {criterion}")
+        state = cls(top_k, criterion)
+        state.random_state = payload['random_state']
+        state.iterations = payload['iterations']
+        state.cursor = payload['cursor']
+        state.entries = [(float(score), int(index), seed) for score, index, seed in payload['entries']]
+        state.n_evaluated = payload['n_evaluated']
+        state.n_pruned = payload['n_pruned']
+        state.metric_evaluations = payload['metric_evaluations']
+        completed = sum(_block_sizes(state.iterations)[:state.cursor])
+        state.score_blocks = [np.load(path + '.scores.npy')[:completed]]
+        return state
+
+
+def search_seeds_streaming(source: ChunkSource, metrics: List[Union[str, List[str]]], metric_types: List[str],
+                           unit_id: str, allocator: GroupAllocator, control_label: str, iterations: int,
+                           random_state: Optional[int] = None, top_k: int = 10,
+                           seed_batch_size: int = DEFAULT_SEED_BATCH_SIZE,
+                           chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE, file_format: Optional[str] = None,
+                           progress_callback: Optional[Callable[[SearchProgress], None]] = None,
+                           keep_bucket_cube: bool = False) -> SeedSearchResult:
+    """
+    Out-of-core seed search over a chunked CSV/Parquet file or an iterator of DataFrames.
+
+    The data is never held in memory as a whole. Candidates are processed in batches
+    of ``seed_batch_size`` seeds; for every batch the source is read chunk by chunk
+    and each chunk adds its per-bucket sufficient statistics to a
+    (batch, 100, C) accumulator. Memory is therefore bounded by chunk_size plus
+    seed_batch_size x 100 x C, independent of the number of units, at the price of
+    one pass over the source per batch. A one-shot iterator is read exactly once, so
+    all candidates form a single batch.
+
+    The candidates are the same as in search_seeds for the same ``random_state``.
+    Scores therefore agree with the in-memory search up to floating-point rounding,
+    because mean metrics are centered on the first chunk's mean here.
+
+    With ``keep_bucket_cube`` the accumulated per-bucket moments are kept in
+    ``result.bucket_cube`` for re-ranking under other group proportions.
+
+    Args:
+        source: File path, DataFrame, list of DataFrames, factory returning an iterable of
+            DataFrames, or a one-shot iterable of DataFrames (see chunked_input)
+        metrics (List): Metrics to balance; ratio metrics as [x, y] or 'x/y'
+        metric_types (List[str]): 'mean', 'proportion' or 'ratio' per metric
+        unit_id (str): Column name containing unit identifiers
+        allocator (GroupAllocator): Compiled group proportions
+        control_label (str): Label of the control group
+        iterations (int): Number of candidate seeds
+        random_state (int): Master seed (None draws fresh entropy and reports it)
+        top_k (int): Number of best seeds to keep
+        seed_batch_size (int): Candidates accumulated per pass over the source
+        chunk_size (int): Rows per chunk when reading files or DataFrames
+        file_format (str): 'csv' or 'parquet' (default: inferred from the file name)
+        progress_callback (Callable): Called with a SearchProgress after every batch
+        keep_bucket_cube (bool): Keep per-bucket moments of all candidates for re-ranking
+
+    Returns:
+        SeedSearchResult: Best seed, top-K list and search metadata
+    """
+    layout = MomentLayout(metrics, metric_types)
+    control_code = allocator.labels.index(control_label)
+    treatment_codes = [code for code in range(allocator.n_groups) if code != control_code]
+    membership = allocator.membership_matrix()
+    if random_state is None:
+        random_state = int(np.random.SeedSequence().entropy % (2 ** 53))
+
+    block_sizes = _block_sizes(iterations)
+    if is_reiterable(source):
+        blocks_per_batch = max(1, seed_batch_size // SEED_BLOCK_SIZE)
+    else:
+        blocks_per_batch = len(block_sizes)
+    state = _SearchState(top_k)
+    state.random_state, state.iterations = random_state, iterations
+    top_t_stats = {}
+    completed = 0
+    moment_batches, cube_seeds = [], []
+    for first in range(0, len(block_sizes), blocks_per_batch):
+        blocks = range(first, min(first + blocks_per_batch, len(block_sizes)))
+        block_seeds = [candidate_seeds(random_state, block, block_sizes[block]) for block in blocks]
+        seeds = [seed for block in block_seeds for seed in block]
+        chunks = iter_dataframe_chunks(source, columns=[unit_id] + layout.source_columns, chunk_size=chunk_size,
+                                       file_format=file_format, string_columns=[unit_id])
+        moments = _accumulate_bucket_moments(chunks, layout, unit_id, seeds, fit_shifts=first == 0)
+        if keep_bucket_cube:
+            moment_batches.append(moments)
+            cube_seeds.extend(seeds)
+        # (B, G, 100) @ (B, 100, C) -> per-seed group moments, then all t-statistics at once
+        t_stats = comparison_t_stats(layout, np.matmul(membership, moments), control_code, treatment_codes)
+        scores = np.fmax.reduce(np.abs(t_stats).reshape(len(seeds), -1), axis=1)
+
+        offset = 0
+        for block, candidates in zip(blocks, block_seeds):
+            block_scores = scores[offset:offset + len(candidates)]
+            state.add_block(_block_result_from_scores(block, candidates, block_scores, top_k, layout.n_metrics))
+            for score, index, seed in state.entries:
+                if seed not in top_t_stats and index // SEED_BLOCK_SIZE == block:
+                    top_t_stats[seed] = t_stats[offset + index % SEED_BLOCK_SIZE]
+            offset += len(candidates)
+            completed += len(candidates)
+        top_t_stats = {seed: top_t_stats[seed] for _, _, seed in state.entries}
+        if progress_callback is not None:
+            best_score, _, best_seed = state.entries[0] if state.entries else (None, None, None)
+            progress_callback(SearchProgress(completed, iterations, best_seed, best_score))
+
+    if state.n_evaluated == 0:
+        raise ValueError("No valid seeds found. Please check your data and parameters.")
+
+    bucket_cube = None
+    if keep_bucket_cube:
+        bucket_cube = BucketCube(layout, cube_seeds, np.concatenate(moment_batches), random_state)
+
+    top_seeds = [(seed, score) for score, _, seed in state.entries]
+    best_seed, best_score = top_seeds[0]
+    return SeedSearchResult(best_seed=best_seed, best_score=best_score, top_seeds=top_seeds,
+                            iterations=iterations, n_evaluated=state.n_evaluated, random_state=random_state,
+                            metric_evaluations=state.metric_evaluations, n_metrics=layout.n_metrics,
+                            scores=state.scores(), top_t_stats=[top_t_stats[seed] for seed, _ in top_seeds],
+                            metric_labels=list(layout.labels),
+                            treatment_labels=[allocator.labels[code] for code in treatment_codes],
+                            bucket_cube=bucket_cube)
+
+
+def _accumulate_bucket_moments(chunks: Iterable[pd.DataFrame], layout: MomentLayout, unit_id: str,
+                               seeds: List[str], fit_shifts: bool) -> np.ndarray:
+    """Sum per-bucket moments of every seed over all chunks; returns (n_seeds, 100, C)."""
+    moments = np.zeros((len(seeds), BUCKET_COUNT, layout.n_columns))
+    for chunk in chunks:
+        data = chunk.dropna(subset=layout.source_columns)
+        if data.empty:
+            continue
+        values = layout.build(data, fit_shifts=fit_shifts)
+        fit_shifts = False
+        unit_ids = [s.encode('utf-8') for s in format_unit_ids(data[unit_id].astype(str))]
+        moments += bucket_moments_batch(unit_ids, values, seeds)
+    return moments
+
+
+def _block_result_from_scores(block: int, seeds: List[str], scores: np.ndarray, top_k: int,
+                              n_metrics: int) -> _BlockResult:
+    """Turn precomputed candidate scores of one block into a _BlockResult (same rules as _evaluate_block)."""
+    scores = scores.copy()
+    seen = set()
+    for offset, seed in enumerate(seeds):
+        if seed in seen:
+            scores[offset] = np.nan
+        seen.add(seed)
+    valid = np.flatnonzero(~np.isnan(scores))
+    best = sorted((float(scores[offset]), block * SEED_BLOCK_SIZE + int(offset), seeds[offset])
+                  for offset in valid)[:top_k]
+    return _BlockResult(best, len(valid), 0, len(valid) * n_metrics, scores)
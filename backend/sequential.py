@@ -0,0 +1,177 @@
+"""
+Sequential (always-valid) tests
+基于 mSPRT 的序贯检验：每个指标只保存 O(1) 的累加状态，每来一批数据常数时间更新，
+随时查看的 p 值与置信序列都保持第一类错误率，不因反复查看而膨胀
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from accumulators import ExperimentAccumulator
+
+# Default prior scale of the effect: the mixing standard deviation τ is this fraction of
+# the control estimate at the first look (frozen afterwards)
+DEFAULT_RELATIVE_EFFECT = 0.05
+
+
+@dataclass
+class SequentialTable:
+    """
+    Always-valid results of every treatment-vs-control comparison, one entry per
+    (treatment, metric) in treatment-major order.
+
+    Attributes:
+        treated_labels (List): Treatment group of every entry
+        metrics (List): Metric of every entry
+        metric_types (List[str]): Metric type of every entry
+        treatment_value, control_value, absolute_diff (np.ndarray): Current estimates
+        p_value (np.ndarray): Always-valid p-value (running minimum over looks)
+        ci_lower, ci_upper (np.ndarray): Confidence sequence of the difference (running intersection)
+        significance (np.ndarray): "显著" / "不显著"
+        treatment_size, control_size (np.ndarray): Observations per group
+        looks (int): Number of batches folded in so far
+    """
+    treated_labels: List
+    metrics: List
+    metric_types: List[str]
+    treatment_value: np.ndarray
+    control_value: np.ndarray
+    absolute_diff: np.ndarray
+    p_value: np.ndarray
+    ci_lower: np.ndarray
+    ci_upper: np.ndarray
+    significance: np.ndarray
+    treatment_size: np.ndarray
+    control_size: np.ndarray
+    looks: int
+
+    def __len__(self) -> int:
+        return len(self.metrics)
+
+
+def msprt_log_likelihood_ratio(diff: np.ndarray, variance: np.ndarray, mixing_variance: np.ndarray) -> np.ndarray:
+    """
+    Log of the normal-mixture likelihood ratio for H0: difference = 0.
+
+    With estimate Δ, its variance V and mixing variance τ² (Johari et al., "Always
+    Valid Inference"): Λ = sqrt(V / (V + τ²)) · exp(Δ² τ² / (2 V (V + τ²))).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = variance + mixing_variance
+        return 0.5 * np.log(variance / total) + diff ** 2 * mixing_variance / (2 * variance * total)
+
+
+def confidence_sequence_radius(variance: np.ndarray, mixing_variance: np.ndarray, alpha: float) -> np.ndarray:
+    """Half-width of the (1 - alpha) mSPRT confidence sequence around the current estimate."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = variance + mixing_variance
+        return np.sqrt(variance * total / mixing_variance * (2 * np.log(1 / alpha) + np.log(total / variance)))
+
+
+class SequentialTest:
+    """
+    mSPRT for mean, proportion and ratio metrics over batches of observations.
+
+    The state is an ExperimentAccumulator (count, means and M2 per group and metric)
+    plus, per treatment and metric, the running minimum p-value and the running
+    confidence-sequence bounds, so it does not grow with the data; each batch costs
+    one pass over its own rows and O(groups × metrics) to re-test. Estimates and their
+    variances are the ones of the fixed-horizon tests (Welch, normal proportion test,
+    delta method), so a single look matches their point estimates.
+    Tests are two-sided.
+    """
+
+    def __init__(self, metrics: Sequence[Union[str, List[str]]], metric_types: Sequence[str], control_label,
+                 alpha: float = 0.05, relative_effect: float = DEFAULT_RELATIVE_EFFECT,
+                 mixing_variance: Optional[Sequence[float]] = None):
+        """
+        Args:
+            metrics (List): Metrics; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): 'mean', 'proportion' or 'ratio' per metric
+            control_label: Label of the control group
+            alpha (float): Significance level of the always-valid tests
+            relative_effect (float): Mixing standard deviation as a fraction of the
+                control estimate at the first look (used when mixing_variance is not given)
+            mixing_variance (List[float], optional): Mixing variance τ² per metric, on the
+                scale of the metric difference
+        """
+        self.accumulator = ExperimentAccumulator(metrics, metric_types)
+        self.control_label = control_label
+        self.alpha = alpha
+        self.relative_effect = relative_effect
+        n_metrics = len(self.accumulator.metrics)
+        if mixing_variance is None:
+            self.mixing_variance = np.full(n_metrics, np.nan)
+        else:
+            self.mixing_variance = np.asarray(mixing_variance, dtype=np.float64)
+            if self.mixing_variance.shape != (n_metrics,) or not (self.mixing_variance > 0).all():
+                raise ValueError("mixing_variance needs one positive value per metric")
+        self.looks = 0
+        # Running state per treatment label: [p-value, lower bound, upper bound] x metrics
+        self._running: Dict[object, np.ndarray] = {}
+
+    @property
+    def metrics(self) -> List:
+        return self.accumulator.metrics
+
+    @property
+    def metric_types(self) -> List[str]:
+        return self.accumulator.metric_types
+
+    def update(self, data: pd.DataFrame, groupname: str) -> SequentialTable:
+        """Fold one batch of rows into the state and return the updated results."""
+        self.accumulator.update(data, groupname)
+        self.looks += 1
+        return self.results()
+
+    def results(self) -> SequentialTable:
+        """
+        Current always-valid results (a look; idempotent while no new data arrives).
+        """
+        group_stats = self.accumulator.group_stats()
+        control = group_stats.group_index(self.control_label)
+        treatments = [label for label in group_stats.labels if label != self.control_label]
+        estimate, variance, counts = group_stats.estimate, group_stats.variance, group_stats.counts
+
+        # Freeze the mixing variance of each metric at the first look with a usable control estimate
+        pending = np.isnan(self.mixing_variance) & (np.abs(estimate[:, control]) > 0)
+        self.mixing_variance[pending] = (self.relative_effect * estimate[pending, control]) ** 2
+
+        parts = {key: [] for key in ('treated', 'control', 'diff', 'running', 'treated_size', 'control_size')}
+        for label in treatments:
+            treated = group_stats.group_index(label)
+            diff = estimate[:, treated] - estimate[:, control]
+            diff_variance = variance[:, treated] + variance[:, control]
+            log_ratio = msprt_log_likelihood_ratio(diff, diff_variance, self.mixing_variance)
+            radius = confidence_sequence_radius(diff_variance, self.mixing_variance, self.alpha)
+            running = self._running.setdefault(label, np.array([
+                np.ones(len(diff)), np.full(len(diff), -np.inf), np.full(len(diff), np.inf)
+            ]))
+            valid = np.isfinite(log_ratio) & np.isfinite(radius)
+            running[0, valid] = np.minimum(running[0, valid], np.minimum(1.0, np.exp(-log_ratio[valid])))
+            running[1, valid] = np.maximum(running[1, valid], diff[valid] - radius[valid])
+            running[2, valid] = np.minimum(running[2, valid], diff[valid] + radius[valid])
+            parts['treated'].append(estimate[:, treated])
+            parts['control'].append(estimate[:, control])
+            parts['diff'].append(diff)
+            parts['running'].append(running.copy())
+            parts['treated_size'].append(counts[:, treated])
+            parts['control_size'].append(counts[:, control])
+
+        def concat(key):
+            return np.concatenate(parts[key], axis=-1) if treatments else np.empty((3, 0) if key == 'running' else 0)
+
+        running = concat('running')
+        return SequentialTable(
+            treated_labels=[label for label in treatments for _ in self.metrics],
+            metrics=[metric for _ in treatments for metric in self.metrics],
+            metric_types=[metric_type for _ in treatments for metric_type in self.metric_types],
+            treatment_value=concat('treated'), control_value=concat('control'), absolute_diff=concat('diff'),
+            p_value=running[0], ci_lower=running[1], ci_upper=running[2],
+            significance=np.where(running[0] < self.alpha, "显著", "不显著").astype(object),
+            treatment_size=concat('treated_size'), control_size=concat('control_size'),
+            looks=self.looks,
+        )
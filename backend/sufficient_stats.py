@@ -0,0 +1,289 @@
+"""
+Sufficient statistics for mean / proportion / ratio metrics
+基于充分统计量（n, Σx, Σx², Σy, Σy², Σxy）的向量化检验统计量计算
+"""
+
+import json
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# Moment columns needed by each metric type, in layout order
+MOMENT_KINDS = {
+    'mean': ('x', 'xx'),
+    'proportion': ('x', 'xx'),
+    'ratio': ('x', 'y', 'xx', 'yy', 'xy'),
+}
+
+# Pre-aggregated per-group statistics accepted for each metric type, in MOMENT_KINDS order
+# (besides the group size 'n'); for 0/1 proportion metrics 'sum_sq' defaults to 'sum'
+SUMMARY_FIELDS = {
+    'mean': ('sum', 'sum_sq'),
+    'proportion': ('sum', 'sum_sq'),
+    'ratio': ('sum_x', 'sum_y', 'sum_x_sq', 'sum_y_sq', 'sum_xy'),
+}
+
+
+def parse_ratio_metric(metric: Union[str, List[str]]) -> Tuple[str, str]:
+    """Split a ratio metric given as [numerator, denominator] or 'numerator/denominator'."""
+    if isinstance(metric, (list, tuple)) and len(metric) == 2:
+        return metric[0], metric[1]
+    return tuple(metric.split('/'))
+
+
+def metric_label(metric: Union[str, List[str]]) -> str:
+    """Stable string key for a metric (ratio metrics given as lists become 'x/y')."""
+    if isinstance(metric, (list, tuple)):
+        return '/'.join(metric)
+    return metric
+
+
+class MomentLayout:
+    """
+    Column layout of the per-unit moment matrix for a list of metrics.
+
+    Column 0 holds ones (the group size n); every metric then owns the columns listed
+    in MOMENT_KINDS for its type. Summing the matrix rows per group yields all
+    sufficient statistics in one reduction per column. Mean metrics are centered on
+    their overall mean, which leaves every t-statistic unchanged but keeps Σx² from
+    losing precision.
+    """
+
+    def __init__(self, metrics: List[Union[str, List[str]]], metric_types: List[str]):
+        """
+        Args:
+            metrics (List): Metric columns; ratio metrics as [x, y] or 'x/y'
+            metric_types (List[str]): 'mean', 'proportion' or 'ratio' per metric
+        """
+        if len(metrics) != len(metric_types):
+            raise ValueError("metrics and metric_types must have the same length")
+        self.metrics = list(metrics)
+        self.metric_types = list(metric_types)
+        self.labels = [metric_label(m) for m in self.metrics]
+        self.sources = []            # (x column, y column or None) per metric
+        self.metric_columns = []     # moment column indices per metric, in MOMENT_KINDS order
+        n_columns = 1
+        for metric, metric_type in zip(self.metrics, self.metric_types):
+            if metric_type not in MOMENT_KINDS:
+                raise ValueError(f"Unsupported metric type: {metric_type}")
+            if metric_type == 'ratio':
+                self.sources.append(parse_ratio_metric(metric))
+            else:
+                self.sources.append((metric, None))
+            width = len(MOMENT_KINDS[metric_type])
+            self.metric_columns.append(np.arange(n_columns, n_columns + width))
+            n_columns += width
+        self.n_columns = n_columns
+        self.shifts = np.zeros(len(self.metrics))
+
+    @property
+    def n_metrics(self) -> int:
+        return len(self.metrics)
+
+    @property
+    def source_columns(self) -> List[str]:
+        """Distinct input columns referenced by the metrics."""
+        columns = []
+        for x_col, y_col in self.sources:
+            for col in (x_col, y_col):
+                if col is not None and col not in columns:
+                    columns.append(col)
+        return columns
+
+    def build(self, df: pd.DataFrame, fit_shifts: bool = True) -> np.ndarray:
+        """
+        Build the N x C moment matrix (Fortran order, one contiguous array per column).
+
+        Also records the centering shift of each mean metric in ``self.shifts``. With
+        ``fit_shifts=False`` the recorded shifts are reused, so that moment matrices of
+        several chunks of one dataset can be summed.
+        """
+        matrix = np.empty((len(df), self.n_columns), dtype=np.float64, order='F')
+        matrix[:, 0] = 1.0
+        for i, ((x_col, y_col), metric_type) in enumerate(zip(self.sources, self.metric_types)):
+            cols = self.metric_columns[i]
+            x = df[x_col].to_numpy(dtype=np.float64)
+            if metric_type == 'mean':
+                if fit_shifts:
+                    self.shifts[i] = x.mean() if len(x) else 0.0
+                x = x - self.shifts[i]
+            matrix[:, cols[0]] = x
+            if metric_type == 'ratio':
+                y = df[y_col].to_numpy(dtype=np.float64)
+                matrix[:, cols[1]] = y
+                np.multiply(x, x, out=matrix[:, cols[2]])
+                np.multiply(y, y, out=matrix[:, cols[3]])
+                np.multiply(x, y, out=matrix[:, cols[4]])
+            else:
+                np.multiply(x, x, out=matrix[:, cols[1]])
+        return matrix
+
+    @property
+    def mean_columns(self) -> List[int]:
+        """Moment columns needed for the group point estimates (Σx, and Σy for ratios)."""
+        return [int(c) for columns, metric_type in zip(self.metric_columns, self.metric_types)
+                for c in columns[:2 if metric_type == 'ratio' else 1]]
+
+    def linearized(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        Unit-level N x M matrix whose group means move like the metric estimates.
+
+        Mean and proportion metrics are the values themselves; a ratio metric is
+        replaced by its delta-method linearization (x - R y) / ȳ with R = Σx / Σy.
+        """
+        out = np.empty((matrix.shape[0], self.n_metrics))
+        for i, (columns, metric_type) in enumerate(zip(self.metric_columns, self.metric_types)):
+            x = matrix[:, columns[0]]
+            if metric_type == 'ratio':
+                y = matrix[:, columns[1]]
+                out[:, i] = (x - x.sum() / y.sum() * y) / y.mean()
+            else:
+                out[:, i] = x
+        return out
+
+    def spec_key(self) -> str:
+        """JSON description of the metric configuration (used for fingerprints)."""
+        return json.dumps([[metric_label(m), t] for m, t in zip(self.metrics, self.metric_types)])
+
+
+def ratio_delta_variance(x_mean, y_mean, x_var, y_var, cov):
+    """Delta-method variance of a ratio estimate Σx / Σy from the variances of the two means and their covariance."""
+    return (x_var / y_mean ** 2 + x_mean ** 2 / y_mean ** 4 * y_var
+            - 2 * x_mean / y_mean ** 3 * cov)
+
+
+def group_estimates(moments: np.ndarray, columns: np.ndarray, metric_type: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-group point estimate, variance of the estimate and Welch df term.
+
+    Args:
+        moments (np.ndarray): Group moments, shape (..., G, C) with n in column 0
+        columns (np.ndarray): Moment columns of the metric (see MomentLayout)
+        metric_type (str): 'mean', 'proportion' or 'ratio'
+
+    Returns:
+        Tuple of arrays shaped (..., G): estimate, variance of the estimate and
+        v**2 / (n - 1) (the Welch-Satterthwaite denominator contribution)
+    """
+    n = moments[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if metric_type == 'ratio':
+            sx, sy, sxx, syy, sxy = (moments[..., c] for c in columns)
+            x_mean, y_mean = sx / n, sy / n
+            x_var = (sxx - sx * x_mean) / (n - 1) / n
+            y_var = (syy - sy * y_mean) / (n - 1) / n
+            cov = (sxy - sx * y_mean) / (n - 1) / n
+            estimate = sx / sy
+            variance = ratio_delta_variance(x_mean, y_mean, x_var, y_var, cov)
+        else:
+            sx, sxx = moments[..., columns[0]], moments[..., columns[1]]
+            estimate = sx / n
+            if metric_type == 'proportion':
+                variance = estimate * (1 - estimate) / n
+            else:
+                variance = (sxx - sx * estimate) / (n - 1) / n
+        df_term = variance ** 2 / (n - 1)
+    return estimate, variance, df_term
+
+
+def group_point_estimates(moments: np.ndarray, layout: MomentLayout) -> np.ndarray:
+    """Per-group estimate of every metric (mean, proportion or Σx/Σy), shape (..., G, n_metrics)."""
+    n = moments[..., 0]
+    out = np.empty(moments.shape[:-1] + (layout.n_metrics,))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i, (columns, metric_type) in enumerate(zip(layout.metric_columns, layout.metric_types)):
+            denominator = moments[..., columns[1]] if metric_type == 'ratio' else n
+            out[..., i] = moments[..., columns[0]] / denominator
+    return out
+
+
+def comparison_mahalanobis(layout: MomentLayout, moments: np.ndarray, inverse_covariance: np.ndarray,
+                           control_code: int, treatment_codes: List[int]) -> np.ndarray:
+    """
+    Mahalanobis distance of every treatment-vs-control mean-difference vector.
+
+    With d the vector of metric differences and Σ the pooled unit-level covariance
+    (see MomentLayout.linearized), the distance is d' Σ⁻¹ d / (1/n_t + 1/n_c): the
+    Morgan-Rubin balance statistic, chi-square with n_metrics degrees of freedom under
+    random assignment. Unlike the max |t| it accounts for correlated metrics.
+
+    Args:
+        layout (MomentLayout): Metric layout the moments were built with
+        moments (np.ndarray): Group moments, shape (..., G, C); only n, Σx and Σy are read
+        inverse_covariance (np.ndarray): (Pseudo-)inverse of the pooled covariance, M x M
+        control_code (int): Group code of the control group
+        treatment_codes (List[int]): Group codes of the treatment groups
+
+    Returns:
+        np.ndarray: Distances shaped (..., n_treatments)
+    """
+    treatment_codes = np.asarray(treatment_codes)
+    estimates = group_point_estimates(moments, layout)
+    n = moments[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diff = estimates[..., treatment_codes, :] - estimates[..., [control_code], :]
+        scale = 1 / n[..., treatment_codes] + 1 / n[..., [control_code]]
+        return np.einsum('...tm,mk,...tk->...t', diff, inverse_covariance, diff) / scale
+
+
+def summary_moments(summaries: List[Dict[str, float]], metric_type: str) -> np.ndarray:
+    """
+    Group moment matrix of one metric from pre-aggregated summary statistics.
+
+    Args:
+        summaries (List[Dict]): Per group, 'n' and the SUMMARY_FIELDS of the metric type,
+            e.g. {'n': 1000, 'sum': 5230.5, 'sum_sq': 40110.2} for a mean metric
+        metric_type (str): 'mean', 'proportion' or 'ratio'
+
+    Returns:
+        np.ndarray: Moments shaped (G, C) in the layout of MomentLayout([metric], [metric_type])
+    """
+    if metric_type not in SUMMARY_FIELDS:
+        raise ValueError(f"Unsupported metric type: {metric_type}")
+    fields = ('n',) + SUMMARY_FIELDS[metric_type]
+    moments = np.empty((len(summaries), len(fields)))
+    for g, summary in enumerate(summaries):
+        if metric_type == 'proportion' and 'sum_sq' not in summary:
+            summary = dict(summary, sum_sq=summary.get('sum'))
+        missing = [f for f in fields if summary.get(f) is None]
+        if missing:
+            raise ValueError(f"Summary statistics of a {metric_type} metric need {', '.join(missing)}")
+        moments[g] = [float(summary[f]) for f in fields]
+        if moments[g, 0] <= 0:
+            raise ValueError("Summary statistics need n > 0 for every group")
+    return moments
+
+
+def metric_comparison_t_stats(moments: np.ndarray, columns: np.ndarray, metric_type: str,
+                              control_code: int, treatment_codes: List[int]) -> np.ndarray:
+    """Treatment-vs-control t-statistics of one metric; returns shape (..., n_treatments)."""
+    treatment_codes = np.asarray(treatment_codes)
+    estimate, variance, _ = group_estimates(moments, columns, metric_type)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (
+            (estimate[..., treatment_codes] - estimate[..., [control_code]])
+            / np.sqrt(variance[..., treatment_codes] + variance[..., [control_code]])
+        )
+
+
+def comparison_t_stats(layout: MomentLayout, moments: np.ndarray, control_code: int,
+                       treatment_codes: List[int]) -> np.ndarray:
+    """
+    Treatment-vs-control t-statistics for every metric from group moments.
+
+    Args:
+        layout (MomentLayout): Metric layout the moments were built with
+        moments (np.ndarray): Group moments, shape (..., G, C)
+        control_code (int): Group code of the control group
+        treatment_codes (List[int]): Group codes of the treatment groups
+
+    Returns:
+        np.ndarray: t-statistics shaped (..., n_metrics, n_treatments)
+    """
+    out = np.empty(moments.shape[:-2] + (layout.n_metrics, len(treatment_codes)))
+    for i, metric_type in enumerate(layout.metric_types):
+        out[..., i, :] = metric_comparison_t_stats(
+            moments, layout.metric_columns[i], metric_type, control_code, treatment_codes
+        )
+    return out
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from accumulators import ExperimentAccumulator, MomentAccumulator
+from experiment_analysis_with_seedfinder import ExperimentAnalysisWithSeedFinder
+from test_helpers import METRICS, METRIC_TYPES, make_dataset
+
+GROUPS = ['control', 'treatment']
+
+
+def test_moment_accumulator_merge_matches_single_pass():
+    """分批 Chan 合并得到的计数、均值、M2 与协矩与单次计算一致"""
+    rng = np.random.default_rng(0)
+    x, y = rng.normal(1e6, 3, 1000), rng.normal(5, 1, 1000)
+    full = MomentAccumulator.from_values(x, y)
+    merged = MomentAccumulator()
+    for part in np.array_split(np.arange(1000), 7):
+        merged.update(x[part], y[part])
+    assert merged.count == 1000
+    assert np.isclose(merged.mean_x, x.mean(), rtol=1e-15)
+    assert np.isclose(merged.m2_x, ((x - x.mean()) ** 2).sum(), rtol=1e-9)
+    assert np.isclose(merged.c_xy, ((x - x.mean()) * (y - y.mean())).sum(), rtol=1e-9)
+    assert np.allclose([full.m2_y, full.c_xy], [merged.m2_y, merged.c_xy], rtol=1e-9)
+
+
+def test_daily_accumulation_matches_full_analysis():
+    """逐日折叠并经二进制序列化往返后的检验结果，与多 worker 合并及整体数据检验一致"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(6000, 5, GROUPS, gmv_shift=1e5)
+    days = np.array_split(np.arange(len(df)), 10)
+
+    daily = ExperimentAccumulator(METRICS, METRIC_TYPES)
+    for day in days:
+        daily = ExperimentAccumulator.from_bytes(daily.update(df.iloc[day], 'group_name').to_bytes())
+    workers = [ExperimentAccumulator(METRICS, METRIC_TYPES).update(df.iloc[day], 'group_name') for day in days]
+    merged = workers[-1]
+    for worker in workers[:-1]:
+        merged.merge(worker)
+
+    for state in (daily, merged):
+        for expected, actual in [
+            (analyzer.test_mean(df, 'group_name', 'treatment', 'control', 'gmv'),
+             analyzer.test_mean(state, None, 'treatment', 'control', 'gmv')),
+            (analyzer.test_proportion(df, 'group_name', 'treatment', 'control', 'converted'),
+             analyzer.test_proportion(state, None, 'treatment', 'control', 'converted')),
+            (analyzer.test_ratio(df, 'group_name', 'treatment', 'control', 'orders', 'sessions'),
+             analyzer.test_ratio(state, None, 'treatment', 'control', 'orders', 'sessions')),
+        ]:
+            assert np.allclose(expected[:6], actual[:6], rtol=1e-9)
+            assert expected[6] == actual[6]
+
+    results = analyzer.run_statistical_tests(daily, METRICS, METRIC_TYPES, None, 'treatment', 'control')
+    assert list(results['Metric']) == METRICS
+    assert len(daily.to_bytes()) < 512
+
+
+def test_accumulator_rejects_mismatched_metrics():
+    """指标不同的累加器不能合并，二进制格式需带正确的头部"""
+    left = ExperimentAccumulator(['gmv'], ['mean'])
+    try:
+        left.merge(ExperimentAccumulator(['gmv'], ['proportion']))
+        assert False, "merging different metric types should fail"
+    except ValueError:
+        pass
+    try:
+        ExperimentAccumulator.from_bytes(b'not an accumulator blob')
+        assert False, "an invalid blob should be rejected"
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_moment_accumulator_merge_matches_single_pass()
+    test_daily_accumulation_matches_full_analysis()
+    test_accumulator_rejects_mismatched_metrics()
+    print("✅ 累加器测试通过！")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import glob
+import io
+import os
+import tempfile
+
+import numpy as np
+
+import app
+import assignment_store
+from assignment_store import AssignmentStore
+from bucketing import apollo_bucket_bulk, bucket_formatted_ids, format_unit_ids
+from experiment_analysis_with_seedfinder import ExperimentAnalysisWithSeedFinder
+
+
+def _segment_count(root):
+    return len(glob.glob(os.path.join(root, '*', 'seg_*.keys.npy')))
+
+
+def test_store_matches_hashing_and_persists():
+    """存储返回的分桶与直接哈希一致，并可在新进程中直接映射打开"""
+    root = tempfile.mkdtemp()
+    ids = np.arange(5000)
+    store = AssignmentStore(root)
+    store.register('exp_store')
+    buckets = store.get_buckets('exp_store', format_unit_ids(ids))
+    assert (buckets == apollo_bucket_bulk('exp_store', ids)).all()
+
+    reopened = AssignmentStore(root)
+    assert reopened.size('exp_store') == len(ids)
+    assert (reopened.get_buckets('exp_store', format_unit_ids(ids)) == buckets).all()
+
+
+def test_only_registered_experiments_are_stored():
+    """未注册的实验（如重随机种子）只哈希不落盘；删除后不再保存"""
+    root = tempfile.mkdtemp()
+    store = AssignmentStore(root)
+    ids = format_unit_ids(np.arange(300))
+    assert (store.get_buckets('seed_1', ids) == bucket_formatted_ids('seed_1', ids)).all()
+    assert store.get_bucket('seed_1', '7') == bucket_formatted_ids('seed_1', ['7'])[0]
+    store.flush()
+    assert os.listdir(root) == []
+
+    store.register('exp_live')
+    store.get_buckets('exp_live', ids)
+    assert store.size('exp_live') == 300
+    assert store.delete('exp_live') and not store.delete('exp_live')
+    store.get_buckets('exp_live', ids)
+    assert os.listdir(root) == [] and store.size('exp_live') == 0
+
+
+def test_incremental_append_and_compaction():
+    """新用户按分段追加，分段过多时合并"""
+    root = tempfile.mkdtemp()
+    store = AssignmentStore(root, max_segments=3, flush_threshold=4)
+    store.register('exp_inc')
+    for start in range(0, 1000, 200):
+        ids = np.arange(start, start + 300)
+        assert (store.get_buckets('exp_inc', format_unit_ids(ids)) == apollo_bucket_bulk('exp_inc', ids)).all()
+    assert store.size('exp_inc') == 1100
+    assert _segment_count(root) <= 3
+
+    for x in range(5000, 5010):
+        assert store.get_bucket('exp_inc', str(x)) == apollo_bucket_bulk('exp_inc', [x])[0]
+    store.flush()
+    assert store.size('exp_inc') == 1110
+
+
+def test_variable_length_ids_and_key_collisions():
+    """变长ID（含尾部空字节与空串）按字节精确匹配；键冲突时仍返回正确分桶"""
+    ids = ['', 'a', 'a\x00', 'a\x00\x00', '用户1', 'x' * 300, 'b']
+    expected = bucket_formatted_ids('exp_bytes', ids)
+    for key_hashes in [assignment_store._key_hashes, lambda offsets, blob: np.zeros(len(offsets) - 1, np.uint64)]:
+        original, assignment_store._key_hashes = assignment_store._key_hashes, key_hashes
+        try:
+            root = tempfile.mkdtemp()
+            store = AssignmentStore(root, max_segments=1)
+            store.register('exp_bytes')
+            assert (store.get_buckets('exp_bytes', ids[:4]) == expected[:4]).all()
+            assert (store.get_buckets('exp_bytes', ids[::-1]) == expected[::-1]).all()
+            assert (AssignmentStore(root).get_buckets('exp_bytes', ids) == expected).all()
+            assert store.size('exp_bytes') == len(ids)
+        finally:
+            assignment_store._key_hashes = original
+
+
+def test_concurrent_writers_do_not_overwrite_segments():
+    """多个进程（各自的存储实例，分段缓存已过期）同时追加时分段不会互相覆盖，合并时去重"""
+    root = tempfile.mkdtemp()
+    first, second = AssignmentStore(root, max_segments=2), AssignmentStore(root, max_segments=2)
+    first.register('exp_multi')
+    assert second.size('exp_multi') == 0
+    first.get_buckets('exp_multi', format_unit_ids(np.arange(300)))
+    second.get_buckets('exp_multi', format_unit_ids(np.arange(100, 400)))
+    assert _segment_count(root) == 2
+    assert AssignmentStore(root).size('exp_multi') == 600
+
+    first.get_buckets('exp_multi', format_unit_ids(np.arange(400, 410)))
+    assert _segment_count(root) == 1
+    reopened = AssignmentStore(root)
+    assert reopened.size('exp_multi') == 410
+    assert (reopened.get_buckets('exp_multi', format_unit_ids(np.arange(410)))
+            == apollo_bucket_bulk('exp_multi', np.arange(410))).all()
+
+
+def test_assign_endpoint_registers_launched_experiments():
+    """/assign 带 register=true 时注册并写入存储，不带时不落盘"""
+    root = tempfile.mkdtemp()
+    default_store = ExperimentAnalysisWithSeedFinder.assignment_store
+    ExperimentAnalysisWithSeedFinder.assignment_store = store = AssignmentStore(root)
+    try:
+        client = app.app.test_client()
+        for name, register in [('exp_dry_run', 'false'), ('exp_launch', 'true')]:
+            response = client.post('/assign', data={
+                'file': (io.BytesIO(b'user_id\n' + b'\n'.join(b'u%d' % i for i in range(250))), 'ids.csv'),
+                'experiment_name': name, 'register': register, 'chunk_size': '100'})
+            assert response.status_code == 200
+            rows = response.get_data(as_text=True).splitlines()[1:]
+            assert [int(row.split(',')[1]) for row in rows[:250]] == \
+                bucket_formatted_ids(name, [f'u{i}' for i in range(250)]).tolist()
+        assert not store.is_registered('exp_dry_run') and store.size('exp_dry_run') == 0
+        assert store.is_registered('exp_launch') and store.size('exp_launch') == 250
+    finally:
+        ExperimentAnalysisWithSeedFinder.assignment_store = default_store
+
+
+if __name__ == "__main__":
+    test_store_matches_hashing_and_persists()
+    test_only_registered_experiments_are_stored()
+    test_incremental_append_and_compaction()
+    test_variable_length_ids_and_key_collisions()
+    test_concurrent_writers_do_not_overwrite_segments()
+    test_assign_endpoint_registers_launched_experiments()
+    print("✅ 分桶存储测试通过！")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+
+import numpy as np
+
+from bootstrap import _POISSON_TABLE, poisson_bootstrap
+from experiment_analysis_with_seedfinder import ExperimentAnalysisWithSeedFinder
+from test_helpers import METRICS, METRIC_TYPES, make_dataset
+
+GROUPS = ['control', 'treatment']
+PAIRS = [('treatment', 'control')]
+
+
+def test_poisson_weights_follow_poisson_distribution():
+    """权重查找表的分布与 Poisson(1) 的概率一致（精度 2^-16）"""
+    frequencies = np.bincount(_POISSON_TABLE, minlength=8)[:8] / 2 ** 16
+    expected = np.exp(-1) / np.array([1, 1, 2, 6, 24, 120, 720, 5040])
+    assert np.allclose(frequencies, expected, atol=2 ** -15)
+
+
+def test_bootstrap_is_invariant_to_chunking_and_workers():
+    """结果与分块大小、内存预算、进程数无关，较大的重抽样次数包含较小次数的前缀"""
+    df = make_dataset(30000, 3, GROUPS, gmv='lognormal')
+    reference = poisson_bootstrap(df, 'group_name', METRICS, METRIC_TYPES, PAIRS, n_replicates=200, random_state=7)
+    for kwargs in [dict(chunk_size=7001), dict(memory_budget=1), dict(n_workers=2, chunk_size=10000)]:
+        other = poisson_bootstrap(df, 'group_name', METRICS, METRIC_TYPES, PAIRS, n_replicates=200,
+                                  random_state=7, **kwargs)
+        assert np.allclose(other.replicates, reference.replicates, rtol=1e-12, atol=1e-12)
+    prefix = poisson_bootstrap(df, 'group_name', METRICS, METRIC_TYPES, PAIRS, n_replicates=50, random_state=7)
+    assert np.allclose(prefix.replicates, reference.replicates[:50], rtol=1e-12, atol=1e-12)
+
+
+def test_bootstrap_standard_errors_match_analytic_ones():
+    """bootstrap 标准误与 Welch / 比例 / Delta 方法的解析标准误接近，点估计一致"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(30000, 3, GROUPS, gmv='lognormal')
+    results = analyzer.run_statistical_tests(df, METRICS, METRIC_TYPES, 'group_name', 'treatment', 'control',
+                                             bootstrap_replicates=400, random_state=1)
+    analytic = np.abs(results['Absolute_Diff'] / results['T_Statistic'])
+    assert np.allclose(results['Bootstrap_SE'], analytic, rtol=0.15)
+    for lower, upper in results['Bootstrap_CI']:
+        assert lower < upper
+
+    bootstrap = analyzer.bootstrap_tests(df, METRICS, METRIC_TYPES, 'group_name', 'treatment', 'control',
+                                         n_replicates=20, random_state=1)
+    assert np.allclose(bootstrap.absolute_diff, results['Absolute_Diff'], atol=1e-6)
+
+
+def test_bootstrap_streams_csv_files():
+    """对 CSV 文件分块流式计算的结果与内存 DataFrame 一致"""
+    df = make_dataset(5000, 3, GROUPS, gmv='lognormal')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'units.csv')
+        df.to_csv(path, index=False)
+        streamed = poisson_bootstrap(path, 'group_name', METRICS, METRIC_TYPES, PAIRS, n_replicates=100,
+                                     random_state=5, chunk_size=1234)
+    in_memory = poisson_bootstrap(df, 'group_name', METRICS, METRIC_TYPES, PAIRS, n_replicates=100, random_state=5)
+    assert np.allclose(streamed.replicates, in_memory.replicates, rtol=1e-9)
+
+
+if __name__ == "__main__":
+    test_poisson_weights_follow_poisson_distribution()
+    test_bootstrap_is_invariant_to_chunking_and_workers()
+    test_bootstrap_standard_errors_match_analytic_ones()
+    test_bootstrap_streams_csv_files()
+    print("✅ Bootstrap 测试通过！")
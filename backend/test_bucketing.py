@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import gzip
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+import app
+from bucketing import GroupAllocator, iter_unit_id_chunks
+from experiment_analysis_with_seedfinder import DEFAULT_ALLOCATOR_CACHE_ENTRIES, ExperimentAnalysisWithSeedFinder
+
+
+def _scalar_buckets(experiment_name, ids):
+    return [ExperimentAnalysisWithSeedFinder.apollo_bucket(experiment_name, x) for x in ids]
+
+
+def test_bulk_bucket_matches_scalar_path():
+    """批量分桶结果必须与逐个 apollo_bucket 完全一致"""
+    cases = [
+        np.arange(-50, 2000),
+        np.array([1234567890123456789, 9007199254740993, 42], dtype=np.int64),
+        np.array([2 ** 64 - 1, 7], dtype=np.uint64),
+        np.array([0.5, 1.5, 2.5, -0.4, 1e15, 123456789.0, np.nan]),
+        np.array([True, False]),
+        np.array(['u_1', 'u_2', '用户3']),
+        pd.Series([1, 2, None]),
+        pd.Series(['a', 'b', 'c']),
+        np.array([1, 'a', 2.7, None], dtype=object),
+    ]
+    for ids in cases:
+        buckets = ExperimentAnalysisWithSeedFinder.apollo_bucket_bulk('exp_test', ids)
+        assert buckets.dtype == np.uint8
+        assert buckets.tolist() == _scalar_buckets('exp_test', ids.tolist())
+
+
+def test_list_path_returns_ids():
+    """列表输入仍返回 (分桶列表, 原始ID) 二元组"""
+    ids = ['1001', '1002', 1003]
+    buckets, returned = ExperimentAnalysisWithSeedFinder.apollo_bucket('exp_test', ids)
+    assert returned is ids
+    assert buckets == _scalar_buckets('exp_test', ids)
+
+
+def test_parallel_bucketing_matches_serial():
+    """多进程分块分桶结果与串行路径完全一致且保持输入顺序"""
+    ids = np.arange(10000, 12500)
+    serial = ExperimentAnalysisWithSeedFinder.apollo_bucket_bulk('exp_par', ids)
+    parallel = ExperimentAnalysisWithSeedFinder.apollo_bucket_bulk('exp_par', ids, n_workers=2, chunk_size=300)
+    assert np.array_equal(serial, parallel)
+
+
+def test_group_allocator_matches_range_scan():
+    """查找表分组与逐组区间扫描的结果一致"""
+    group_proportions = {'control': '30%', 'treatment_a': 0.2, 'treatment_b': '50'}
+    allocator = GroupAllocator(group_proportions)
+    ids = [f'user_{i}' for i in range(3000)]
+
+    expected = []
+    for bucket in _scalar_buckets('seed_x', ids):
+        start_bucket = 0
+        for group, prop in zip(allocator.labels, [30, 20, 50]):
+            if start_bucket <= bucket < start_bucket + prop:
+                expected.append(group)
+                break
+            start_bucket += prop
+
+    codes = allocator.assign_codes('seed_x', np.array(ids))
+    assert [allocator.labels[c] for c in codes] == expected
+    assert list(allocator.assign_categorical('seed_x', ids)) == expected
+    assert allocator.assign('seed_x', ids[0]) == expected[0]
+
+
+def test_allocator_cache_is_bounded():
+    """分组查找表按比例复用，缓存条目数有上限"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    proportions = {'control': 50, 'treatment': 50}
+    assert analyzer.get_allocator(proportions) is analyzer.get_allocator(dict(proportions))
+    for control in range(2, 99):
+        analyzer.get_allocator({'control': control, 'treatment': 100 - control})
+    assert len(analyzer._allocators) == DEFAULT_ALLOCATOR_CACHE_ENTRIES
+
+
+def test_group_allocator_rejects_bad_proportions():
+    """比例之和不为100时构造即报错"""
+    try:
+        GroupAllocator({'control': 50, 'treatment': 40})
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError")
+
+
+def test_iter_unit_id_chunks_csv_and_ndjson():
+    """按块读取 CSV（含 gzip）与 NDJSON 格式的用户ID文件"""
+    csv_bytes = b'city,user_id\nbj,u1\nsh,u2\nsz,u3\n'
+    chunks = list(iter_unit_id_chunks(io.BytesIO(gzip.compress(csv_bytes)), 'csv', 'user_id', chunk_size=2))
+    assert chunks == [['u1', 'u2'], ['u3']]
+
+    ndjson_bytes = b'{"user_id": 7}\n\n{"user_id": "u8"}\n'
+    assert list(iter_unit_id_chunks(io.BytesIO(ndjson_bytes), 'ndjson', 'user_id')) == [[7, 'u8']]
+
+
+def _post_assign(client, payload, **form):
+    return client.post('/assign', data={'file': (io.BytesIO(payload), 'ids.csv'), 'experiment_name': 'exp_assign',
+                                        'chunk_size': '100', **form})
+
+
+def test_assign_endpoint_streams_assign_groups_results():
+    """/assign 流式返回的分桶与分组与逐个 assign_groups 一致；格式错误的上传在返回前以400拒绝"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    proportions = {'control': 30, 'treatment': 70}
+    ids = [f'user_{i}' for i in range(450)]
+    csv_bytes = ('city,user_id\n' + ''.join(f'bj,{u}\n' for u in ids)).encode()
+    client = app.app.test_client()
+    for payload in [csv_bytes, gzip.compress(csv_bytes)]:
+        response = _post_assign(client, payload, id_column='user_id', group_proportions=json.dumps(proportions))
+        assert response.status_code == 200 and response.headers['X-Unit-Count'] == str(len(ids))
+        rows = [line.split(',') for line in response.get_data(as_text=True).splitlines()]
+        assert rows[0] == ['unit_id', 'bucket', 'group'] and [row[0] for row in rows[1:]] == ids
+        assert [int(row[1]) for row in rows[1:]] == _scalar_buckets('exp_assign', ids)
+        assert [row[2] for row in rows[1:]] == [analyzer.assign_groups('exp_assign', u, proportions) for u in ids]
+
+    # 第三块中的残缺行、截断的 gzip、缺失的ID列
+    malformed = csv_bytes + b'sh\n'
+    for payload, form in [(malformed, {'id_column': 'user_id'}), (gzip.compress(csv_bytes)[:-40], {}),
+                          (csv_bytes, {'id_column': 'uid'})]:
+        response = _post_assign(client, payload, **form)
+        assert response.status_code == 400 and response.get_json()['error']
+
+
+if __name__ == "__main__":
+    test_bulk_bucket_matches_scalar_path()
+    test_list_path_returns_ids()
+    test_parallel_bucketing_matches_serial()
+    test_group_allocator_matches_range_scan()
+    test_allocator_cache_is_bounded()
+    test_group_allocator_rejects_bad_proportions()
+    test_iter_unit_id_chunks_csv_and_ndjson()
+    test_assign_endpoint_streams_assign_groups_results()
+    print("✅ 分桶测试通过！")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import json
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import app
+from dataset_store import DatasetStore
+
+
+def _make_rows(n=500, seed=2):
+    rng = np.random.default_rng(seed)
+    return [{'user_id': int(u), 'gmv': float(g), 'orders': int(o), 'sessions': int(s) + 1,
+             'group_name': group, 'platform': platform if i % 7 else None}
+            for i, (u, g, o, s, group, platform) in enumerate(zip(
+                rng.integers(10**9, 10**10, n), rng.lognormal(3, 1, n), rng.poisson(3, n), rng.poisson(10, n),
+                rng.choice(['control', 'treatment'], n), rng.choice(['ios', 'web'], n)))]
+
+
+def test_columns_round_trip_through_memory_maps():
+    """数值列保留类型并以只读内存映射读取，ID 与文本列字典编码，缺失值保留"""
+    df = pd.DataFrame(_make_rows())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = DatasetStore(tmp_dir)
+        info = store.create(df, 'user_id')
+        assert info.numeric_columns == ['gmv', 'orders', 'sessions']
+        assert info.encoded_columns == ['user_id', 'group_name', 'platform']
+
+        loaded = DatasetStore(tmp_dir).load(info.dataset_id, ['gmv', 'orders', 'user_id', 'platform', 'unknown'])
+        assert list(loaded.columns) == ['gmv', 'orders', 'user_id', 'platform']
+        assert loaded['orders'].dtype == np.int64 and not loaded['gmv'].to_numpy().flags.writeable
+        assert np.array_equal(loaded['gmv'].to_numpy(), df['gmv'].to_numpy())
+        assert list(loaded['user_id'].astype(str)) == list(df['user_id'].astype(str))
+        assert loaded['platform'].isna().equals(df['platform'].isna())
+
+        assert store.delete(info.dataset_id) and info.dataset_id not in store
+        try:
+            store.load(info.dataset_id)
+            assert False, "a deleted dataset should not load"
+        except KeyError:
+            pass
+
+
+def _check_endpoints(rows):
+    client = app.app.test_client()
+    created = client.post('/datasets', json={'data': rows, 'userIdColumn': 'user_id'})
+    assert created.status_code == 201
+    dataset_id = created.get_json()['dataset_id']
+
+    body = {'selectedMetrics': ['gmv', ['orders', 'sessions']],
+            'metricTypes': {'gmv': 'mean', json.dumps(['orders', 'sessions']): 'ratio'},
+            'userIdColumn': 'user_id', 'iterations': 20, 'randomState': 3}
+    inline = client.post('/rerandomization', json={**body, 'data': rows}).get_json()
+    registered = client.post('/rerandomization', json={**body, 'datasetId': dataset_id}).get_json()
+    for key in ('bestSeed', 'allTStats', 'bestSeedResults', 'availableMetrics'):
+        assert inline[key] == registered[key]
+
+    df = pd.DataFrame(rows)
+    arrays = client.post('/experiment-analysis', json={
+        'group1': df[df.group_name == 'control'].gmv.tolist(),
+        'group2': df[df.group_name == 'treatment'].gmv.tolist(),
+    }).get_json()
+    by_id = client.post('/experiment-analysis', json={'dataset_id': dataset_id, 'metric': 'gmv',
+                                                      'segment_by': ['platform']}).get_json()
+    assert by_id['t_stat'] == arrays['t_stat'] and by_id['p_value'] == arrays['p_value']
+    assert sorted(s['segment']['platform'] for s in by_id['segments']) == ['ios', 'web']
+
+    sample_size = client.post('/sample-size', json={'dataset_id': dataset_id, 'metric_name': 'gmv'}).get_json()
+    assert np.isclose(sample_size['baseline'], df['gmv'].mean())
+
+    assert client.delete(f'/datasets/{dataset_id}').status_code == 200
+    missing = client.post('/rerandomization', json={**body, 'datasetId': dataset_id})
+    assert missing.status_code == 400 and 'not found' in missing.get_json()['error']
+
+
+def _check_default_id_column(rows):
+    client = app.app.test_client()
+    padded = [{**row, 'user_id': f'{i:05d}', 'account': f'{i:05d}'} for i, row in enumerate(rows)]
+    created = client.post('/datasets', json={'data': padded})
+    assert created.status_code == 201
+    info = created.get_json()
+    assert info['id_column'] == 'user_id' and 'user_id' in info['encoded_columns']
+    assert list(app.dataset_store.load(info['dataset_id'], ['user_id'])['user_id'][:2]) == ['00000', '00001']
+
+    body = {'selectedMetrics': ['gmv'], 'metricTypes': {'gmv': 'mean'}, 'iterations': 20, 'randomState': 3}
+    inline = client.post('/rerandomization', json={**body, 'data': padded}).get_json()
+    registered = client.post('/rerandomization', json={**body, 'datasetId': info['dataset_id']}).get_json()
+    assert 'user_id' not in registered['availableMetrics']
+    for key in ('bestSeed', 'allTStats', 'bestSeedResults', 'availableMetrics'):
+        assert inline[key] == registered[key]
+
+    # 其他列上传时已转为数值，不能再作为 ID 列哈希
+    other_id = client.post('/rerandomization', json={**body, 'datasetId': info['dataset_id'],
+                                                     'userIdColumn': 'account'})
+    assert other_id.status_code == 400 and 'registered with user ID column' in other_id.get_json()['error']
+    no_ids = client.post('/datasets', json={'data': [{'gmv': 1.0}]})
+    assert no_ids.status_code == 400 and 'user_id' in no_ids.get_json()['error']
+
+
+def test_endpoints_accept_dataset_ids():
+    """按 dataset_id 的结果与每次携带完整数据的请求一致；未指定 ID 列时默认 user_id 并按字符串保存"""
+    rows = _make_rows()
+    default_store = app.dataset_store
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app.dataset_store = DatasetStore(tmp_dir)
+        try:
+            _check_endpoints(rows)
+            _check_default_id_column(rows)
+        finally:
+            app.dataset_store = default_store
+
+
+if __name__ == "__main__":
+    test_columns_round_trip_through_memory_maps()
+    test_endpoints_accept_dataset_ids()
+    print("✅ 数据集注册表测试通过！")
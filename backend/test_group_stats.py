@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import numpy as np
+from scipy import stats
+from statsmodels.stats.multitest import multipletests
+
+import app
+from experiment_analysis_with_seedfinder import ExperimentAnalysisWithSeedFinder
+from group_stats import GroupedMetricStats, critical_values, tail_probabilities
+from test_helpers import METRICS, METRIC_TYPES, make_dataset
+
+GROUPS = ['control', 'treatment_a', 'treatment_b']
+
+
+def _ratio_variance(x, y):
+    n = len(x)
+    cov = np.cov(x, y)
+    return (cov[0, 0] / y.mean() ** 2 + x.mean() ** 2 / y.mean() ** 4 * cov[1, 1]
+            - 2 * x.mean() / y.mean() ** 3 * cov[0, 1]) / n
+
+
+def test_engine_matches_reference_formulas():
+    """一次分组计算的所有组别对结果与 Welch t 检验、比例 z 检验及 Delta 方法的直接计算一致"""
+    df = make_dataset(2000, 11, GROUPS)
+    pairs = [('treatment_a', 'control'), ('treatment_b', 'control'), ('treatment_b', 'treatment_a')]
+    table = GroupedMetricStats(df, 'group_name', METRICS, METRIC_TYPES).compare(pairs)
+    assert len(table) == len(pairs) * len(METRICS)
+
+    for p, (treated, control) in enumerate(pairs):
+        t_rows, c_rows = df[df.group_name == treated], df[df.group_name == control]
+        welch = stats.ttest_ind(t_rows['gmv'], c_rows['gmv'], equal_var=False)
+        assert np.isclose(table.t_statistic[3 * p], welch.statistic, rtol=1e-10)
+        assert np.isclose(table.p_value[3 * p], welch.pvalue, rtol=1e-8)
+
+        rate_t, rate_c = t_rows['converted'].mean(), c_rows['converted'].mean()
+        z = (rate_t - rate_c) / np.sqrt(rate_t * (1 - rate_t) / len(t_rows) + rate_c * (1 - rate_c) / len(c_rows))
+        assert np.isclose(table.t_statistic[3 * p + 1], z, rtol=1e-10)
+        assert np.isclose(table.p_value[3 * p + 1], 2 * stats.norm.sf(abs(z)), rtol=1e-8)
+
+        ratio_t = t_rows['orders'].sum() / t_rows['sessions'].sum()
+        ratio_c = c_rows['orders'].sum() / c_rows['sessions'].sum()
+        se = np.sqrt(_ratio_variance(t_rows['orders'], t_rows['sessions'])
+                     + _ratio_variance(c_rows['orders'], c_rows['sessions']))
+        assert np.isclose(table.absolute_diff[3 * p + 2], ratio_t - ratio_c, rtol=1e-12)
+        assert np.isclose(table.t_statistic[3 * p + 2], (ratio_t - ratio_c) / se, rtol=1e-10)
+        assert table.treatment_size[3 * p] == len(t_rows) and table.control_size[3 * p] == len(c_rows)
+
+
+def test_per_test_functions_route_through_engine():
+    """test_mean/test_ratio/test_proportion 与 run_statistical_tests 给出同一结果，且单侧检验区间一侧开放"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(2000, 11, GROUPS)
+    df.loc[::17, 'gmv'] = np.nan
+    results = analyzer.run_statistical_tests(df, METRICS, METRIC_TYPES, 'group_name',
+                                             ['treatment_a', 'treatment_b'], 'control', bh_correction=True)
+    assert list(results['Treatment_Group']) == ['treatment_a'] * 3 + ['treatment_b'] * 3
+    assert 'P_Value_BH' in results.columns
+
+    row = results.iloc[3]
+    single = analyzer.test_mean(df, 'group_name', 'treatment_b', 'control', 'gmv')
+    assert row['T_Statistic'] == round(single[4], 6) and row['Confidence_Interval'] == single[7]
+    row = results.iloc[5]
+    single = analyzer.test_ratio(df, 'group_name', 'treatment_b', 'control', 'orders', 'sessions')
+    assert row['T_Statistic'] == round(single[4], 6) and row['Confidence_Interval'] == single[7]
+
+    less = analyzer.test_proportion(df, 'group_name', 'treatment_a', 'control', 'converted', False, 'less')
+    assert less[7][0] == float('-inf') and np.isfinite(less[7][1])
+    greater = analyzer.test_mean(df, 'group_name', 'treatment_a', 'control', 'gmv', False, 'greater')
+    assert np.isfinite(greater[7][0]) and greater[7][1] == float('inf')
+
+
+def test_collect_mode_reports_errors_per_entry():
+    """collect 模式下缺失列与空组只影响对应条目；raise 模式下空组抛出 ZeroDivisionError"""
+    df = make_dataset(300, 11, GROUPS)
+    engine = GroupedMetricStats(df, 'group_name', ['gmv', 'missing_column'], ['mean', 'mean'], on_error='collect')
+    table = engine.compare([('treatment_a', 'control'), ('no_such_group', 'control')])
+    assert table.errors[0] is None and np.isfinite(table.t_statistic[0])
+    assert table.errors[1] == "'missing_column'"
+    assert table.errors[2] == "float division by zero" and table.errors[3] == "'missing_column'"
+
+    try:
+        GroupedMetricStats(df, 'group_name', ['gmv'], ['mean']).compare([('no_such_group', 'control')])
+        assert False, "an empty group should raise"
+    except ZeroDivisionError:
+        pass
+
+
+def test_summary_statistics_match_raw_data():
+    """由每组 n、sum、sum_sq（比率指标含交叉积）计算的检验与原始数据检验一致"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(2000, 11, GROUPS)
+    summaries = {}
+    for label in ['control', 'treatment_a']:
+        rows = df[df.group_name == label]
+        gmv, x, y = rows['gmv'].to_numpy(), rows['orders'].to_numpy(), rows['sessions'].to_numpy()
+        summaries[label] = {
+            'mean': {'n': len(rows), 'sum': gmv.sum(), 'sum_sq': (gmv ** 2).sum()},
+            'proportion': {'n': len(rows), 'sum': rows['converted'].sum()},
+            'ratio': {'n': len(rows), 'sum_x': x.sum(), 'sum_y': y.sum(), 'sum_x_sq': (x ** 2).sum(),
+                      'sum_y_sq': (y ** 2).sum(), 'sum_xy': (x * y).sum()},
+        }
+    for is_two_sided, alternative in [(True, 'two-sided'), (False, 'greater')]:
+        pairs = [
+            (analyzer.test_mean(df, 'group_name', 'treatment_a', 'control', 'gmv', is_two_sided, alternative),
+             analyzer.test_mean_summary(summaries['treatment_a']['mean'], summaries['control']['mean'],
+                                        is_two_sided, alternative)),
+            (analyzer.test_proportion(df, 'group_name', 'treatment_a', 'control', 'converted',
+                                      is_two_sided, alternative),
+             analyzer.test_proportion_summary(summaries['treatment_a']['proportion'],
+                                              summaries['control']['proportion'], is_two_sided, alternative)),
+            (analyzer.test_ratio(df, 'group_name', 'treatment_a', 'control', 'orders', 'sessions',
+                                 is_two_sided, alternative),
+             analyzer.test_ratio_summary(summaries['treatment_a']['ratio'], summaries['control']['ratio'],
+                                         is_two_sided, alternative)),
+        ]
+        for raw, summary in pairs:
+            assert np.allclose(raw[:6], summary[:6], rtol=1e-9)
+            assert raw[6] == summary[6]
+            assert np.allclose(raw[7], summary[7], rtol=1e-6)
+
+    try:
+        analyzer.test_mean_summary({'n': 10, 'sum': 5.0}, summaries['control']['mean'])
+        assert False, "a mean metric without sum_sq should be rejected"
+    except ValueError:
+        pass
+
+
+def test_ratio_endpoint_pairs_x_and_y():
+    """/experiment-analysis 比率检验按 X、Y 配对计算；某组 X、Y 长度不一致时返回 400"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(300, 11, GROUPS)
+    groups = {label: {'X': rows.orders.tolist(), 'Y': rows.sessions.tolist()}
+              for label, rows in df.groupby('group_name') if label != 'treatment_b'}
+    client = app.app.test_client()
+    response = client.post('/experiment-analysis', json={'test_type': 'ratio', 'group1': groups['control'],
+                                                         'group2': groups['treatment_a']})
+    expected = analyzer.test_ratio(df, 'group_name', 'treatment_a', 'control', 'orders', 'sessions')
+    assert response.status_code == 200
+    assert np.isclose(response.get_json()['t_stat'], expected[4])
+
+    longer_y = {**groups['treatment_a'], 'Y': groups['treatment_a']['Y'] + [10.0]}
+    mismatched = client.post('/experiment-analysis', json={'test_type': 'ratio', 'group1': groups['control'],
+                                                           'group2': longer_y})
+    assert mismatched.status_code == 400 and 'equal length' in mismatched.get_json()['error']
+
+def test_stats_mode_and_batched_distribution_calls():
+    """stats 模式只给出统计量；批量计算的 p 值与临界值与 scipy 分布对象逐个计算一致"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(2000, 11, GROUPS)
+    full = analyzer.test_ratio(df, 'group_name', 'treatment_a', 'control', 'orders', 'sessions')
+    quick = analyzer.test_ratio(df, 'group_name', 'treatment_a', 'control', 'orders', 'sessions', result='stats')
+    assert quick[:5] == full[:5]
+    assert np.isnan(quick[5]) and quick[6] is None and np.isnan(quick[7]).all()
+
+    rng = np.random.default_rng(0)
+    abs_t, dof = np.abs(rng.normal(0, 3, 500)), rng.uniform(1, 500, 500)
+    is_normal = rng.random(500) < 0.3
+    expected = np.where(is_normal, stats.norm.sf(abs_t), stats.t.sf(abs_t, dof))
+    assert np.array_equal(tail_probabilities(abs_t, dof, is_normal, False, 'greater'), expected)
+    assert np.array_equal(tail_probabilities(abs_t, dof, is_normal, True, 'two-sided'), 2 * expected)
+
+    dof = np.append(dof, [np.inf, np.nan])
+    critical = critical_values(0.05, True, dof)
+    assert np.allclose(critical[:-2], stats.t.ppf(0.975, dof[:-2]), rtol=1e-12)
+    assert critical[-2] == stats.norm.ppf(0.975) and np.isnan(critical[-1])
+    mixed = critical_values(0.05, is_normal, dof[:-2])
+    assert np.allclose(mixed, stats.t.ppf(np.where(is_normal, 0.975, 0.95), dof[:-2]), rtol=1e-12)
+    assert critical_values(0.05, False, np.array([np.inf]))[0] == stats.norm.ppf(0.95)
+
+
+def test_segment_breakdown_matches_filtered_runs():
+    """一次分组的分维度结果与逐个维度过滤后单独检验一致；缺少对照组的维度被跳过，BH 覆盖全部维度检验"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(6000, 11, GROUPS)
+    rng = np.random.default_rng(1)
+    df['platform'] = rng.choice(['ios', 'android', 'web'], len(df))
+    df['tier'] = rng.choice([1, 2], len(df))
+    df.loc[(df.platform == 'web') & (df.group_name == 'treatment_b'), 'group_name'] = 'control'
+    df.loc[::50, 'platform'] = None
+
+    results = analyzer.run_statistical_tests(df, METRICS, METRIC_TYPES, 'group_name', ['treatment_a', 'treatment_b'],
+                                             'control', segment_by=['platform', 'tier'], bh_correction=True)
+    assert list(results.columns[:3]) == ['platform', 'tier', 'Treatment_Group']
+    assert len(results) == (2 * 2 * 2 + 2 * 1) * len(METRICS)
+    assert not ((results.platform == 'web') & (results.Treatment_Group == 'treatment_b')).any()
+    _, expected_bh, _, _ = multipletests(results['P_Value'], method='fdr_bh')
+    assert np.allclose(results['P_Value_BH'], expected_bh)
+
+    for (platform, tier), segment in results.groupby(['platform', 'tier'], sort=False):
+        rows = df[(df.platform == platform) & (df.tier == tier)]
+        treated = list(dict.fromkeys(segment['Treatment_Group']))
+        expected = analyzer.run_statistical_tests(rows, METRICS, METRIC_TYPES, 'group_name', treated, 'control')
+        assert segment.reset_index(drop=True)[expected.columns].equals(expected)
+
+
+if __name__ == "__main__":
+    test_engine_matches_reference_formulas()
+    test_per_test_functions_route_through_engine()
+    test_collect_mode_reports_errors_per_entry()
+    test_summary_statistics_match_raw_data()
+    test_ratio_endpoint_pairs_x_and_y()
+    test_stats_mode_and_batched_distribution_calls()
+    test_segment_breakdown_matches_filtered_runs()
+    print("✅ 分组检验引擎测试通过！")
@@ -0,0 +1,52 @@
+"""
+Shared test data
+测试共用的指标定义与随机数据集生成
+"""
+
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+METRICS = ['gmv', 'converted', ['orders', 'sessions']]
+METRIC_TYPES = ['mean', 'proportion', 'ratio']
+
+# Distributions of the 'gmv' column
+_GMV_DRAWS = {
+    'gamma': lambda rng, n: rng.gamma(2.0, 50.0, n),
+    'lognormal': lambda rng, n: rng.lognormal(3.0, 1.0, n),
+    'normal': lambda rng, n: rng.normal(100.0, 20.0, n),
+}
+
+
+def make_dataset(n: int, seed: Union[int, np.random.Generator], groups: Optional[Sequence[str]] = None,
+                 gmv: str = 'gamma', gmv_shift: float = 0.0, effects: Optional[Dict[str, float]] = None,
+                 user_ids: bool = False) -> pd.DataFrame:
+    """
+    Unit-level dataset with the columns of METRICS.
+
+    Args:
+        n (int): Number of rows
+        seed (int or np.random.Generator): Seed, or a generator shared by several batches
+        groups (List[str], optional): Labels drawn uniformly into 'group_name' (None = no group column)
+        gmv (str): Distribution of 'gmv': 'gamma' (2, 50), 'lognormal' (3, 1) or 'normal' (100, 20)
+        gmv_shift (float): Constant added to 'gmv'
+        effects (dict, optional): Additive 'gmv' effect per group label
+        user_ids (bool): Add a 'user_id' column of 'user_<i>' strings
+
+    Returns:
+        pd.DataFrame: Dataset with float metric columns
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    if user_ids:
+        columns['user_id'] = [f'user_{i}' for i in range(n)]
+    if groups is not None:
+        columns['group_name'] = rng.choice(list(groups), n)
+    columns['gmv'] = _GMV_DRAWS[gmv](rng, n) + gmv_shift
+    for label, effect in (effects or {}).items():
+        columns['gmv'] = columns['gmv'] + effect * (columns['group_name'] == label)
+    columns['converted'] = rng.integers(0, 2, n).astype(float)
+    columns['orders'] = rng.poisson(3, n).astype(float)
+    columns['sessions'] = rng.poisson(10, n) + 1.0
+    return pd.DataFrame(columns)
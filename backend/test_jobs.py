@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import json
+import threading
+import time
+
+import app
+from jobs import Job, JobManager
+from test_helpers import METRICS, make_dataset
+
+
+def _wait(manager, job_id, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job is None or job.finished:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish in time")
+
+
+def test_job_reports_progress_and_result():
+    """任务完成后可取回结果，进度按 report 更新"""
+    manager = JobManager(max_workers=1)
+
+    def work(job):
+        for i in range(1, 5):
+            job.report(i, 4, {'step': i})
+        return {'answer': 42}
+
+    job = _wait(manager, manager.submit('demo', work).id)
+    status = job.to_dict()
+    assert status['status'] == Job.COMPLETED
+    assert status['percentComplete'] == 100.0
+    assert status['best'] == {'step': 4}
+    assert status['result'] == {'answer': 42}
+    manager.shutdown()
+
+
+def test_cancel_running_and_queued_jobs():
+    """运行中的任务在下一次 report 时停止；排队中的任务直接取消"""
+    manager = JobManager(max_workers=1)
+    started = threading.Event()
+
+    def work(job):
+        started.set()
+        while True:
+            job.report(0, 1)
+            time.sleep(0.01)
+
+    running = manager.submit('demo', work)
+    queued = manager.submit('demo', lambda job: 'never')
+    assert started.wait(5)
+    assert manager.cancel(queued.id).status == Job.CANCELLED
+    manager.cancel(running.id)
+    assert _wait(manager, running.id).status == Job.CANCELLED
+    assert 'result' not in queued.to_dict()
+    manager.shutdown()
+
+
+def test_failed_jobs_expire_after_ttl():
+    """失败的任务记录错误信息，超过 TTL 后被淘汰"""
+    manager = JobManager(max_workers=1, result_ttl=0.05)
+
+    def work(job):
+        raise ValueError("bad input")
+
+    job = _wait(manager, manager.submit('demo', work).id)
+    assert job.status == Job.FAILED and job.error == "bad input"
+    time.sleep(0.1)
+    assert manager.get(job.id) is None
+    manager.shutdown()
+
+
+def _job_body(**extra):
+    return {'data': make_dataset(400, 7, user_ids=True).to_dict('records'),
+            'selectedMetrics': METRICS,
+            'metricTypes': {'gmv': 'mean', 'converted': 'proportion', json.dumps(['orders', 'sessions']): 'ratio'},
+            'iterations': 300, 'randomState': 5, **extra}
+
+
+def _poll(client, job_id, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = client.get(f'/jobs/{job_id}')
+        if response.status_code != 200 or response.get_json()['status'] in Job.FINISHED_STATES:
+            return response
+        time.sleep(0.02)
+    raise AssertionError("job did not finish in time")
+
+
+def test_job_endpoints_submit_poll_and_expire():
+    """异步提交后轮询到完成，结果与同步接口一致；每个任务的搜索进程数受限；TTL 过后返回 404"""
+    default_manager = app.job_manager
+    app.job_manager = JobManager(max_workers=1, result_ttl=0.2)
+    search_seeds = app.experiment_analyzer.search_seeds
+    requested_workers = []
+
+    def recording_search_seeds(*args, **kwargs):
+        requested_workers.append(kwargs['n_workers'])
+        return search_seeds(*args, **kwargs)
+
+    app.experiment_analyzer.search_seeds = recording_search_seeds
+    try:
+        client = app.app.test_client()
+        submitted = client.post('/jobs/rerandomization', json=_job_body(workers=10 ** 6))
+        assert submitted.status_code == 202 and submitted.get_json()['status'] in (Job.QUEUED, Job.RUNNING)
+        status = _poll(client, submitted.get_json()['jobId']).get_json()
+        assert status['status'] == Job.COMPLETED and status['completed'] == status['total'] == 300
+        assert requested_workers == [app.MAX_JOB_SEARCH_WORKERS]
+
+        expected = client.post('/rerandomization', json=_job_body()).get_json()
+        for key in ('bestSeed', 'allTStats', 'bestSeedResults', 'topSeeds'):
+            assert status['result'][key] == expected[key]
+
+        time.sleep(0.3)
+        assert client.get(f"/jobs/{status['jobId']}").status_code == 404
+        assert client.delete(f"/jobs/{status['jobId']}").status_code == 404
+        assert client.post('/jobs/rerandomization', json={**_job_body(), 'data': []}).status_code == 400
+    finally:
+        del app.experiment_analyzer.search_seeds
+        app.job_manager.shutdown()
+        app.job_manager = default_manager
+
+
+def test_job_endpoints_cancel_and_reject_when_full():
+    """排队中的任务可通过 DELETE 取消；未完成任务过多时提交返回 503"""
+    default_manager = app.job_manager
+    app.job_manager = JobManager(max_workers=1, max_pending=2)
+    release = threading.Event()
+    try:
+        client = app.app.test_client()
+        blocker = app.job_manager.submit('demo', lambda job: release.wait(10))
+        queued = client.post('/jobs/rerandomization', json=_job_body())
+        assert queued.status_code == 202
+        full = client.post('/jobs/rerandomization', json=_job_body())
+        assert full.status_code == 503 and 'Too many pending jobs' in full.get_json()['error']
+
+        job_id = queued.get_json()['jobId']
+        cancelled = client.delete(f'/jobs/{job_id}')
+        assert cancelled.status_code == 200 and cancelled.get_json()['status'] == Job.CANCELLED
+        assert client.get(f'/jobs/{job_id}').get_json()['status'] == Job.CANCELLED
+        assert client.post('/jobs/rerandomization', json=_job_body()).status_code == 202
+        release.set()
+        assert _wait(app.job_manager, blocker.id).status == Job.COMPLETED
+    finally:
+        release.set()
+        app.job_manager.shutdown()
+        app.job_manager = default_manager
+
+
+if __name__ == "__main__":
+    test_job_reports_progress_and_result()
+    test_cancel_running_and_queued_jobs()
+    test_failed_jobs_expire_after_ttl()
+    test_job_endpoints_submit_poll_and_expire()
+    test_job_endpoints_cancel_and_reject_when_full()
+    print("✅ 后台任务测试通过！")
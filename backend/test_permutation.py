@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from experiment_analysis_with_seedfinder import ExperimentAnalysisWithSeedFinder
+from permutation import permutation_test
+from test_helpers import METRICS, METRIC_TYPES, make_dataset
+
+GROUPS = ['control', 'treatment', 'variant']
+PAIRS = [('treatment', 'control'), ('variant', 'control')]
+
+
+def test_permutation_is_invariant_to_workers_and_memory():
+    """结果只取决于 random_state，与进程数和内存预算无关"""
+    df = make_dataset(3000, 11, GROUPS, gmv='normal')
+    reference = permutation_test(df, 'group_name', METRICS, METRIC_TYPES, PAIRS, max_permutations=300,
+                                 random_state=3)
+    other = permutation_test(df, 'group_name', METRICS, METRIC_TYPES, PAIRS, max_permutations=300,
+                             random_state=3, n_workers=2, memory_budget=1)
+    assert np.array_equal(reference.p_value, other.p_value)
+    assert np.array_equal(reference.n_permutations, other.n_permutations)
+
+
+def test_permutation_p_values_match_welch_tests():
+    """正态数据上置换 p 值与 Welch / 比例 / Delta 方法的 p 值接近，观测统计量一致"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(3000, 11, GROUPS, gmv='normal', effects={'variant': 1.5})
+    results = analyzer.run_statistical_tests(df, METRICS, METRIC_TYPES, 'group_name', ['treatment', 'variant'],
+                                             'control', permutations=2000, random_state=1)
+    assert np.allclose(results['Permutation_P_Value'], results['P_Value'], atol=0.05)
+
+    full = analyzer.permutation_tests(df, METRICS, METRIC_TYPES, 'group_name', ['treatment', 'variant'], 'control',
+                                      max_permutations=2000, stopping_confidence=None, random_state=1)
+    assert np.allclose(full.t_statistic, results['T_Statistic'], atol=1e-6)
+    assert (full.n_permutations == 2000).all() and not full.stopped_early.any()
+    assert (full.p_value_ci_lower <= full.p_value).all() and (full.p_value <= full.p_value_ci_upper).all()
+
+
+def test_permutation_stops_early_when_decided():
+    """p 值的蒙特卡洛区间明确落在 alpha 一侧后提前停止，且决策与完整置换一致"""
+    df = make_dataset(3000, 11, GROUPS, gmv='normal', effects={'variant': 8.0})
+    result = permutation_test(df, 'group_name', ['gmv'], ['mean'], PAIRS, max_permutations=5000, random_state=2)
+    assert result.stopped_early.all()
+    assert result.p_value[1] < 0.05 < result.p_value[0]
+    assert (result.n_permutations < 5000).all()
+
+    greater = permutation_test(df, 'group_name', ['gmv'], ['mean'], [('variant', 'control')],
+                               alternative='greater', random_state=2)
+    less = permutation_test(df, 'group_name', ['gmv'], ['mean'], [('variant', 'control')],
+                            alternative='less', random_state=2)
+    assert greater.p_value[0] < 0.05 < less.p_value[0]
+
+
+if __name__ == "__main__":
+    test_permutation_is_invariant_to_workers_and_memory()
+    test_permutation_p_values_match_welch_tests()
+    test_permutation_stops_early_when_decided()
+    print("✅ 置换检验测试通过！")
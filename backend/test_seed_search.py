@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import app
+from experiment_analysis_with_seedfinder import ExperimentAnalysisWithSeedFinder
+from score_cache import SeedScoreCache
+from seed_search import SeedEvaluator, candidate_seeds, search_seeds, search_seeds_streaming
+from test_helpers import METRICS, METRIC_TYPES, make_dataset
+
+GROUP_PROPORTIONS = {'control': 40, 'treatment_a': 30, 'treatment_b': 30}
+
+
+def test_evaluator_matches_per_test_functions():
+    """充分统计量计算的 t 统计量与 test_mean/test_proportion/test_ratio 一致"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(3000, 7, gmv_shift=500, user_ids=True)
+    evaluator = SeedEvaluator(df, METRICS, METRIC_TYPES, 'user_id',
+                              analyzer.get_allocator(GROUP_PROPORTIONS), 'control')
+    for seed in ['rr1', 'rr2024']:
+        assigned = analyzer.assign_groups_with_seed(df, seed, 'user_id', 'group_name', GROUP_PROPORTIONS)
+        t_stats = evaluator.t_stats(seed)
+        for j, treated in enumerate(['treatment_a', 'treatment_b']):
+            expected = [
+                analyzer.test_mean(assigned, 'group_name', treated, 'control', 'gmv')[4],
+                analyzer.test_proportion(assigned, 'group_name', treated, 'control', 'converted')[4],
+                analyzer.test_ratio(assigned, 'group_name', treated, 'control', 'orders', 'sessions')[4],
+            ]
+            assert np.allclose(t_stats[:, j], expected, rtol=1e-9, atol=1e-9)
+
+
+def test_generate_best_seed_returns_lowest_score():
+    """最佳种子即为候选中最大 |t| 最小的种子"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(1000, 7, gmv_shift=500, user_ids=True)
+    evaluator = SeedEvaluator(df, METRICS, METRIC_TYPES, 'user_id',
+                              analyzer.get_allocator(GROUP_PROPORTIONS), 'control')
+    expected = min(candidate_seeds(42, 0, 20), key=evaluator.score)
+
+    best_seed = analyzer.generate_best_seed(df, METRICS, METRIC_TYPES, 'group_name', 'user_id',
+                                            20, GROUP_PROPORTIONS, 'control', random_state=42)
+    assert best_seed == expected
+
+
+def test_search_is_independent_of_worker_count():
+    """相同主种子下，串行与多进程搜索结果完全一致"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    evaluator = SeedEvaluator(make_dataset(500, 7, gmv_shift=500, user_ids=True), METRICS, METRIC_TYPES, 'user_id',
+                              analyzer.get_allocator(GROUP_PROPORTIONS), 'control')
+    serial = search_seeds(evaluator, 600, random_state=2024, n_workers=1, top_k=5)
+    parallel = search_seeds(evaluator, 600, random_state=2024, n_workers=2, top_k=5)
+    assert serial.top_seeds == parallel.top_seeds
+    assert serial.n_evaluated == parallel.n_evaluated
+
+
+def test_pruning_keeps_top_seeds():
+    """剪枝只减少计算量，不改变前K个种子"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    evaluator = SeedEvaluator(make_dataset(500, 7, gmv_shift=500, user_ids=True), METRICS, METRIC_TYPES, 'user_id',
+                              analyzer.get_allocator(GROUP_PROPORTIONS), 'control')
+    full = search_seeds(evaluator, 300, random_state=7, top_k=5)
+    pruned = search_seeds(evaluator, 300, random_state=7, top_k=5, prune=True)
+    assert [seed for seed, _ in pruned.top_seeds] == [seed for seed, _ in full.top_seeds]
+    assert np.allclose([score for _, score in pruned.top_seeds], [score for _, score in full.top_seeds])
+    assert pruned.n_pruned > 0
+    assert pruned.metrics_per_seed < len(METRICS)
+
+
+def test_endpoint_flags_truncated_distribution_when_pruning():
+    """开启 prune 时接口标记 allTStats 不完整，totalIterations 仍为全部有效种子数"""
+    body = {'data': make_dataset(500, 7, gmv_shift=500, user_ids=True).to_dict('records'), 'selectedMetrics': METRICS,
+            'metricTypes': {'gmv': 'mean', 'converted': 'proportion', json.dumps(['orders', 'sessions']): 'ratio'},
+            'iterations': 300, 'randomState': 7, 'groupProportions': GROUP_PROPORTIONS}
+    client = app.app.test_client()
+    full = client.post('/rerandomization', json=body).get_json()
+    pruned = client.post('/rerandomization', json={**body, 'prune': True}).get_json()
+
+    assert not full['allTStatsTruncated'] and len(full['allTStats']) == full['totalIterations'] == 300
+    assert pruned['allTStatsTruncated'] and pruned['searchStats']['prunedSeeds'] > 0
+    assert pruned['totalIterations'] == pruned['searchStats']['evaluatedSeeds'] == 300
+    assert len(pruned['allTStats']) == 300 - pruned['searchStats']['prunedSeeds']
+    assert pruned['bestSeed'] == full['bestSeed']
+
+
+def test_batched_engine_matches_per_seed_engine():
+    """批量多种子核与逐种子计算得到完全相同的得分；小内存预算下分块结果一致"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    allocator = analyzer.get_allocator(GROUP_PROPORTIONS)
+    df = make_dataset(600, 7, gmv_shift=500, user_ids=True)
+    evaluator = SeedEvaluator(df, METRICS, METRIC_TYPES, 'user_id', allocator, 'control')
+    per_seed = search_seeds(evaluator, 300, random_state=21, top_k=5, engine='per-seed')
+    batched = search_seeds(evaluator, 300, random_state=21, top_k=5, engine='batched')
+    assert batched.top_seeds == per_seed.top_seeds
+    assert np.array_equal(batched.scores, per_seed.scores, equal_nan=True)
+
+    tiny = SeedEvaluator(df, METRICS, METRIC_TYPES, 'user_id', allocator, 'control', memory_budget=50000)
+    seeds = candidate_seeds(21, 0, 40)
+    expected = np.stack([evaluator.t_stats(seed) for seed in seeds])
+    assert np.allclose(tiny.batch_t_stats(seeds), expected, equal_nan=True)
+
+
+def test_search_returns_score_vector_and_breakdowns():
+    """搜索结果包含每个候选种子的得分以及前K名的逐指标T统计量"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    evaluator = SeedEvaluator(make_dataset(500, 7, gmv_shift=500, user_ids=True), METRICS, METRIC_TYPES, 'user_id',
+                              analyzer.get_allocator(GROUP_PROPORTIONS), 'control')
+    result = search_seeds(evaluator, 300, random_state=3, top_k=5)
+    assert len(result.scores) == 300
+    assert np.nanmin(result.scores) == result.best_score
+    assert len(result.score_distribution) == result.n_evaluated
+    assert result.metric_labels == ['gmv', 'converted', 'orders/sessions']
+    assert result.treatment_labels == ['treatment_a', 'treatment_b']
+    for (seed, score), t_stats in zip(result.top_seeds, result.top_t_stats):
+        assert t_stats.shape == (3, 2)
+        assert np.isclose(np.nanmax(np.abs(t_stats)), score)
+
+
+def test_checkpoint_resume_matches_uninterrupted_search():
+    """从检查点续跑的结果与一次跑完完全一致；数据变化或 iterations 少于已完成候选数时拒绝续跑"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    allocator = analyzer.get_allocator(GROUP_PROPORTIONS)
+    df = make_dataset(500, 7, gmv_shift=500, user_ids=True)
+    evaluator = SeedEvaluator(df, METRICS, METRIC_TYPES, 'user_id', allocator, 'control')
+    full = search_seeds(evaluator, 1000, random_state=11, top_k=5)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'search.json')
+        # 第一次只跑前 512 个候选（模拟中断），第二次从检查点继续
+        search_seeds(evaluator, 512, random_state=11, top_k=5, checkpoint_path=path, checkpoint_every=256)
+        resumed = search_seeds(evaluator, 1000, top_k=5, checkpoint_path=path)
+        assert resumed.top_seeds == full.top_seeds
+        assert resumed.n_evaluated == full.n_evaluated
+        assert np.array_equal(resumed.scores, full.scores, equal_nan=True)
+        assert resumed.random_state == 11
+
+        # 检查点已包含的候选数多于新的 iterations 时拒绝续跑
+        short_path = os.path.join(tmp_dir, 'short.json')
+        search_seeds(evaluator, 512, random_state=11, top_k=5, checkpoint_path=short_path)
+        try:
+            search_seeds(evaluator, 300, top_k=5, checkpoint_path=short_path)
+            assert False, "shrinking below the completed candidates should be rejected"
+        except ValueError as e:
+            assert "already evaluated 512" in str(e)
+
+        df.loc[0, 'gmv'] += 1
+        changed = SeedEvaluator(df, METRICS, METRIC_TYPES, 'user_id', allocator, 'control')
+        try:
+            search_seeds(changed, 1000, top_k=5, checkpoint_path=path)
+            assert False, "fingerprint mismatch should be rejected"
+        except ValueError as e:
+            assert "different dataset" in str(e)
+
+
+def test_score_cache_reuses_seeds_and_metrics():
+    """得分缓存：重复搜索只计算新种子，新增指标时只计算新指标，结果不变"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    allocator = analyzer.get_allocator(GROUP_PROPORTIONS)
+    df = make_dataset(500, 7, gmv_shift=500, user_ids=True)
+    cache = SeedScoreCache()
+    two = SeedEvaluator(df, METRICS[:2], METRIC_TYPES[:2], 'user_id', allocator, 'control')
+    search_seeds(two, 256, random_state=5, score_cache=cache)
+    rerun = search_seeds(two, 512, random_state=5, score_cache=cache)
+    assert rerun.cached_seeds == 256
+    assert rerun.top_seeds == search_seeds(two, 512, random_state=5).top_seeds
+
+    three = SeedEvaluator(df, METRICS, METRIC_TYPES, 'user_id', allocator, 'control')
+    extended = search_seeds(three, 512, random_state=5, score_cache=cache)
+    assert extended.cached_metric_evaluations == 2 * 512
+    uncached = search_seeds(three, 512, random_state=5)
+    assert [seed for seed, _ in extended.top_seeds] == [seed for seed, _ in uncached.top_seeds]
+    assert np.allclose(extended.scores, uncached.scores, equal_nan=True)
+
+
+def test_streaming_search_matches_in_memory_search():
+    """分块（文件/迭代器）搜索与内存搜索得到相同的种子和得分"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    allocator = analyzer.get_allocator(GROUP_PROPORTIONS)
+    df = make_dataset(700, 7, gmv_shift=500, user_ids=True)
+    evaluator = SeedEvaluator(df, METRICS, METRIC_TYPES, 'user_id', allocator, 'control')
+    expected = search_seeds(evaluator, 600, random_state=13, top_k=5)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'units.csv.gz')
+        df.to_csv(path, index=False)
+        from_file = search_seeds_streaming(path, METRICS, METRIC_TYPES, 'user_id', allocator, 'control', 600,
+                                           random_state=13, top_k=5, seed_batch_size=256, chunk_size=200)
+    one_pass = search_seeds_streaming(iter([df.iloc[:300], df.iloc[300:]]), METRICS, METRIC_TYPES, 'user_id',
+                                      allocator, 'control', 600, random_state=13, top_k=5)
+    for result in (from_file, one_pass):
+        assert [seed for seed, _ in result.top_seeds] == [seed for seed, _ in expected.top_seeds]
+        assert np.allclose(result.scores, expected.scores, equal_nan=True)
+        assert np.allclose(result.top_t_stats, expected.top_t_stats)
+
+
+def test_bucket_cube_reranks_for_new_proportions():
+    """分桶立方体：修改分组比例后重新排序，与按新比例重新搜索的结果一致"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(600, 7, gmv_shift=500, user_ids=True)
+    new_proportions = {'control': 10, 'treatment_a': 10, 'treatment_b': 80}
+    fresh = analyzer.search_seeds(df, METRICS, METRIC_TYPES, 'user_id', 300, new_proportions,
+                                  random_state=17, top_k=5)
+    for engine in ('per-seed', 'batched'):
+        result = analyzer.search_seeds(df, METRICS, METRIC_TYPES, 'user_id', 300, GROUP_PROPORTIONS,
+                                       random_state=17, top_k=5, engine=engine, keep_bucket_cube=True)
+        assert result.bucket_cube.moments.shape == (300, 100, 10)
+        same = analyzer.rerank_seeds(result, GROUP_PROPORTIONS, top_k=5)
+        assert [seed for seed, _ in same.top_seeds] == [seed for seed, _ in result.top_seeds]
+        assert np.allclose(same.scores, result.scores, equal_nan=True)
+
+        reranked = analyzer.rerank_seeds(result.bucket_cube, new_proportions, top_k=5)
+        assert [seed for seed, _ in reranked.top_seeds] == [seed for seed, _ in fresh.top_seeds]
+        assert np.allclose(reranked.scores, fresh.scores, equal_nan=True)
+        assert np.allclose(reranked.top_t_stats, fresh.top_t_stats)
+        assert reranked.treatment_labels == ['treatment_a', 'treatment_b']
+
+
+def test_rerank_endpoint_matches_fresh_search():
+    """/rerandomization/rerank 按新比例重新排序的结果与重新搜索一致；未知立方体返回 404，比例之和不为 100 返回 400"""
+    body = {'data': make_dataset(600, 7, gmv_shift=500, user_ids=True).to_dict('records'), 'selectedMetrics': METRICS,
+            'metricTypes': {'gmv': 'mean', 'converted': 'proportion', json.dumps(['orders', 'sessions']): 'ratio'},
+            'iterations': 300, 'randomState': 17, 'groupProportions': GROUP_PROPORTIONS}
+    new_proportions = {'control': 10, 'treatment_a': 10, 'treatment_b': 80}
+    client = app.app.test_client()
+    searched = client.post('/rerandomization', json={**body, 'keepBucketCube': True}).get_json()
+    fresh = client.post('/rerandomization', json={**body, 'groupProportions': new_proportions}).get_json()
+
+    reranked = client.post('/rerandomization/rerank', json={'bucketCubeId': searched['bucketCubeId'],
+                                                             'groupProportions': new_proportions}).get_json()
+    assert reranked['bestSeed'] == fresh['bestSeed'] and reranked['randomState'] == 17
+    assert [top['seed'] for top in reranked['topSeeds']] == [top['seed'] for top in fresh['topSeeds']]
+    assert np.allclose(reranked['allTStats'], fresh['allTStats'])
+    assert reranked['totalIterations'] == fresh['totalIterations'] == 300
+
+    unknown = client.post('/rerandomization/rerank', json={'bucketCubeId': 'missing',
+                                                            'groupProportions': new_proportions})
+    assert unknown.status_code == 404 and 'not found' in unknown.get_json()['error']
+    bad_sum = client.post('/rerandomization/rerank', json={'bucketCubeId': searched['bucketCubeId'],
+                                                            'groupProportions': {'control': 50, 'treatment_b': 40}})
+    assert bad_sum.status_code == 400 and 'sum to 100%' in bad_sum.get_json()['error']
+
+
+def test_mahalanobis_criterion_matches_direct_computation():
+    """马氏距离准则：与按组均值差和合并协方差直接计算的结果一致，两种引擎结果相同"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    df = make_dataset(800, 7, gmv_shift=500, user_ids=True)
+    evaluator = SeedEvaluator(df, METRICS, METRIC_TYPES, 'user_id',
+                              analyzer.get_allocator(GROUP_PROPORTIONS), 'control')
+    ratio = df['orders'].sum() / df['sessions'].sum()
+    linearized = np.column_stack([df['gmv'], df['converted'],
+                                  (df['orders'] - ratio * df['sessions']) / df['sessions'].mean()])
+    inverse_covariance = np.linalg.inv(np.cov(linearized, rowvar=False))
+    assert np.allclose(evaluator.inverse_covariance(), inverse_covariance)
+
+    assigned = analyzer.assign_groups_with_seed(df, 'rr7', 'user_id', 'group_name', GROUP_PROPORTIONS)
+    groups = assigned.groupby('group_name')
+    means = groups[['gmv', 'converted']].mean()
+    means['ratio'] = groups['orders'].sum() / groups['sessions'].sum()
+    sizes = groups.size()
+    expected = []
+    for treated in ['treatment_a', 'treatment_b']:
+        diff = (means.loc[treated] - means.loc['control']).to_numpy()
+        expected.append(diff @ inverse_covariance @ diff / (1 / sizes[treated] + 1 / sizes['control']))
+    assert np.isclose(evaluator.mahalanobis_score('rr7'), max(expected))
+
+    per_seed = search_seeds(evaluator, 300, random_state=3, top_k=5, criterion='mahalanobis')
+    batched = search_seeds(evaluator, 300, random_state=3, top_k=5, criterion='mahalanobis', engine='batched')
+    assert per_seed.criterion == 'mahalanobis'
+    assert [seed for seed, _ in batched.top_seeds] == [seed for seed, _ in per_seed.top_seeds]
+    assert np.allclose(batched.scores, per_seed.scores, equal_nan=True)
+    assert per_seed.best_score == np.nanmin(per_seed.scores)
+    try:
+        search_seeds(evaluator, 300, random_state=3, criterion='mahalanobis', prune=True)
+        assert False, "pruning should be rejected for the mahalanobis criterion"
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_evaluator_matches_per_test_functions()
+    test_generate_best_seed_returns_lowest_score()
+    test_search_is_independent_of_worker_count()
+    test_pruning_keeps_top_seeds()
+    test_endpoint_flags_truncated_distribution_when_pruning()
+    test_batched_engine_matches_per_seed_engine()
+    test_search_returns_score_vector_and_breakdowns()
+    test_checkpoint_resume_matches_uninterrupted_search()
+    test_score_cache_reuses_seeds_and_metrics()
+    test_streaming_search_matches_in_memory_search()
+    test_bucket_cube_reranks_for_new_proportions()
+    test_rerank_endpoint_matches_fresh_search()
+    test_mahalanobis_criterion_matches_direct_computation()
+    print("✅ 种子搜索测试通过！")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import json
+
+import numpy as np
+import pandas as pd
+
+import app
+from experiment_analysis_with_seedfinder import ExperimentAnalysisWithSeedFinder
+from test_helpers import METRICS, METRIC_TYPES, make_dataset
+
+GROUPS = ['control', 'treatment']
+
+
+def test_sequential_estimates_match_fixed_horizon_tests():
+    """逐批更新后的点估计与对全部数据的固定样本检验一致，状态大小不随数据增长"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    rng = np.random.default_rng(0)
+    sequential_test = analyzer.create_sequential_test(METRICS, METRIC_TYPES, 'control')
+    batches = [make_dataset(500, rng, GROUPS, gmv='normal') for _ in range(8)]
+    state_sizes = set()
+    for batch in batches:
+        table = sequential_test.update(batch, 'group_name')
+        state_sizes.add(len(sequential_test.accumulator.to_bytes()))
+    assert table.looks == 8 and len(state_sizes) == 1
+
+    df = pd.concat(batches, ignore_index=True)
+    expected = [
+        analyzer.test_mean(df, 'group_name', 'treatment', 'control', 'gmv'),
+        analyzer.test_proportion(df, 'group_name', 'treatment', 'control', 'converted'),
+        analyzer.test_ratio(df, 'group_name', 'treatment', 'control', 'orders', 'sessions'),
+    ]
+    for i, result in enumerate(expected):
+        assert np.isclose(table.treatment_value[i], result[0], rtol=1e-9)
+        assert np.isclose(table.absolute_diff[i], result[2], rtol=1e-9, atol=1e-12)
+        assert table.ci_lower[i] <= table.absolute_diff[i] <= table.ci_upper[i]
+
+
+def test_sequential_p_values_are_monotone_and_detect_effects():
+    """随时有效的 p 值单调不增、置信序列逐步收窄；真实效应最终被检出且区间覆盖真值"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    rng = np.random.default_rng(1)
+    sequential_test = analyzer.create_sequential_test(['gmv'], ['mean'], 'control')
+    previous = None
+    for _ in range(20):
+        table = sequential_test.update(make_dataset(1000, rng, GROUPS, gmv='normal', effects={'treatment': 2.0}),
+                                       'group_name')
+        if previous is not None:
+            assert table.p_value[0] <= previous.p_value[0]
+            assert table.ci_upper[0] - table.ci_lower[0] <= previous.ci_upper[0] - previous.ci_lower[0]
+        previous = table
+    assert table.significance[0] == "显著"
+    assert table.ci_lower[0] <= 2.0 <= table.ci_upper[0]
+    # Looking again without new data changes nothing
+    again = sequential_test.results()
+    assert again.p_value[0] == table.p_value[0] and again.looks == table.looks
+
+
+def test_repeated_peeks_keep_false_positive_rate():
+    """无真实差异时每批都查看，随时有效检验的误报率不超过 alpha"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    rng = np.random.default_rng(2)
+    rejections = 0
+    for _ in range(100):
+        sequential_test = analyzer.create_sequential_test(['gmv'], ['mean'], 'control')
+        for _ in range(20):
+            table = sequential_test.update(make_dataset(200, rng, GROUPS, gmv='normal'), 'group_name')
+        rejections += table.p_value[0] < 0.05
+    assert rejections <= 5
+
+
+def test_sequential_endpoint_folds_batches():
+    """/sequential-tests/<name> 逐批追加的结果与直接更新一致；可查询、删除；对照组标签可为 0"""
+    analyzer = ExperimentAnalysisWithSeedFinder()
+    rng = np.random.default_rng(3)
+    batches = [make_dataset(400, rng, GROUPS, gmv='normal', effects={'treatment': 2.0}) for _ in range(3)]
+    sequential_test = analyzer.create_sequential_test(METRICS, METRIC_TYPES, 'control')
+    for batch in batches:
+        expected = sequential_test.update(batch, 'group_name')
+
+    client = app.app.test_client()
+    name = 'exp_sequential_endpoint'
+    missing = client.post(f'/sequential-tests/{name}', json={'rows': batches[0].to_dict('records')})
+    assert missing.status_code == 404 and 'controlGroup are required' in missing.get_json()['error']
+    created = client.post(f'/sequential-tests/{name}', json={
+        'rows': batches[0].to_dict('records'), 'metrics': METRICS, 'controlGroup': 'control',
+        'metricTypes': {'gmv': 'mean', 'converted': 'proportion', json.dumps(['orders', 'sessions']): 'ratio'}})
+    assert created.status_code == 200 and created.get_json()['looks'] == 1
+    for batch in batches[1:]:
+        response = client.post(f'/sequential-tests/{name}', json={'rows': batch.to_dict('records')}).get_json()
+    assert response['looks'] == 3 and client.get(f'/sequential-tests/{name}').get_json() == response
+    for i, key in enumerate(['gmv', 'converted', 'orders/sessions']):
+        test = response['results'][key]['tests'][0]
+        assert np.isclose(test['p_value'], expected.p_value[i], rtol=1e-9)
+        assert np.isclose(test['absolute_diff'], expected.absolute_diff[i], rtol=1e-9, atol=1e-12)
+
+    assert client.delete(f'/sequential-tests/{name}').status_code == 200
+    assert client.get(f'/sequential-tests/{name}').status_code == 404
+
+    numeric = batches[0].assign(group_name=(batches[0].group_name == 'treatment').astype(int))
+    zero_control = client.post('/sequential-tests/exp_zero_control', json={
+        'rows': numeric.to_dict('records'), 'metrics': ['gmv'], 'controlGroup': 0})
+    assert zero_control.status_code == 200
+    assert zero_control.get_json()['results']['gmv']['tests'][0]['group1'] == '0'
+    client.delete('/sequential-tests/exp_zero_control')
+
+if __name__ == "__main__":
+    test_sequential_estimates_match_fixed_horizon_tests()
+    test_sequential_p_values_are_monotone_and_detect_effects()
+    test_repeated_peeks_keep_false_positive_rate()
+    test_sequential_endpoint_folds_batches()
+    print("✅ 序贯检验测试通过！")